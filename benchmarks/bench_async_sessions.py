@@ -0,0 +1,232 @@
+"""Session throughput of the async graph vs. one blocking thread per session.
+
+Serves a fake OpenAI chat API on localhost with a fixed response latency, then
+runs the router -> analysis graph for N concurrent sessions both ways. The
+response and semantic plan caches are turned off so every session calls the
+server. Finally it runs more concurrent async ingestions than the event loop's
+default executor has threads, which must finish rather than deadlock. Run from
+the repository root:
+
+    python benchmarks/bench_async_sessions.py [--sessions 1,4,16,64] [--latency 0.2] [--ingestions N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+PLAN = {
+    "steps": [
+        {"op": "groupby_agg", "by": ["region"], "aggregations": [{"column": "sales", "agg": "sum"}]},
+        {"op": "sort", "by": ["sales_sum"], "ascending": False},
+    ]
+}
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    latency = 0.2
+    # Keep-alive, as the real API allows
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:  # noqa: N802
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/embeddings"):
+            self.embeddings(body)
+            return
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        time.sleep(self.latency)
+        if "You are a router" in prompt:
+            content = "analyze"
+        elif "analysis plan" in prompt:
+            content = json.dumps(PLAN)
+        else:
+            content = "Region north leads total sales."
+        payload = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        }
+        self.reply(payload)
+
+    def embeddings(self, body: Dict[str, Any]) -> None:
+        time.sleep(self.latency)
+        inputs = body.get("input", [])
+        data = [
+            {"object": "embedding", "index": i, "embedding": np.random.default_rng(i).random(8).tolist()}
+            for i in range(len(inputs))
+        ]
+        self.reply({"object": "list", "data": data, "model": body.get("model", "fake"),
+                    "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}})
+
+    def reply(self, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Listen backlog; the default of 5 drops bursts of concurrent connects
+    request_queue_size = 1024
+
+
+def serve(latency: float, ports: Any) -> None:
+    FakeOpenAI.latency = latency
+    server = FakeServer(("127.0.0.1", 0), FakeOpenAI)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(latency: float) -> Tuple[multiprocessing.Process, int]:
+    """The fake API in its own process, so thread counts below are the app's alone."""
+    ports: Any = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(latency, ports), daemon=True)
+    process.start()
+    return process, int(ports.get(timeout=30))
+
+
+def session_state(data_path: Path, vector_dir: Path, i: int) -> Dict[str, Any]:
+    # Low rule confidence, so every session also asks the router LLM
+    return {
+        "run_id": f"bench-{i}-{time.perf_counter_ns()}",
+        "query": f"tell me about region sales ({i})",
+        "data_path": str(data_path),
+        "vector_dir": str(vector_dir),
+        "top_k": 5,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="1,4,16,64")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM response")
+    parser.add_argument(
+        "--ingestions",
+        type=int,
+        default=min(32, (os.cpu_count() or 1) + 4) + 4,
+        help="concurrent async ingestions (default: more than the loop's default executor threads)",
+    )
+    args = parser.parse_args()
+    counts = [int(n) for n in args.sessions.split(",") if n.strip()]
+
+    server, port = start_server(args.latency)
+    base_url = f"http://127.0.0.1:{port}/v1"
+    os.environ.update(
+        {
+            "OPENAI_API_KEY": "sk-fake",
+            "OPENAI_BASE_URL": base_url,
+            "OPENAI_API_BASE": base_url,
+            "HTTP_MAX_CONNECTIONS": str(max(counts + [args.ingestions]) * 2),
+            "LLM_CACHE_TTL_HOURS": "0",
+            "SEMANTIC_PLAN_THRESHOLD": "2",
+        }
+    )
+    import streamlit_app as app  # noqa: E402  (settings are read at import)
+
+    workdir = Path(tempfile.mkdtemp())
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({"region": rng.choice(["north", "south", "east", "west"], 1_000), "sales": rng.random(1_000)})
+    data_path = app.save_dataset(frame, workdir / "sales.parquet")
+    vector_dir = workdir / "vectors"  # no index: retrieval returns nothing without an embedding call
+
+    sync_graph = app.build_graph()
+    async_graph = app.build_graph(asynchronous=True)
+
+    def run_threads(n: int) -> List[float]:
+        def one(i: int) -> float:
+            started = time.perf_counter()
+            state = sync_graph.invoke(session_state(data_path, vector_dir, i))
+            app.finish_speculation(state.get("run_id"))
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            return list(pool.map(one, range(n)))
+
+    def run_async(n: int) -> List[float]:
+        async def one(i: int) -> float:
+            started = time.perf_counter()
+            state = await async_graph.ainvoke(session_state(data_path, vector_dir, i))
+            app.finish_speculation(state.get("run_id"))
+            return time.perf_counter() - started
+
+        async def many() -> List[float]:
+            return list(await asyncio.gather(*(one(i) for i in range(n))))
+
+        return app.run_async(many())
+
+    run_threads(1)
+    run_async(1)
+    print(f"fake LLM latency {args.latency:.2f}s; 2-3 LLM round trips per session")
+    print(f"{'sessions':>8}{'mode':>9}{'wall s':>9}{'sessions/s':>12}{'mean s':>9}{'new thr':>9}{'cpu s':>8}")
+    for n in counts:
+        for mode, runner in (("threads", run_threads), ("async", run_async)):
+            # Threads started during the run (pools from earlier runs are excluded)
+            before = {t.ident for t in threading.enumerate()}
+            started_threads: set = set()
+            done = threading.Event()
+
+            def sample() -> None:
+                while not done.wait(0.01):
+                    started_threads.update(t.ident for t in threading.enumerate() if t.ident not in before)
+
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+            started, cpu = time.perf_counter(), time.process_time()
+            latencies = runner(n)
+            wall, cpu = time.perf_counter() - started, time.process_time() - cpu
+            done.set()
+            sampler.join()
+            print(f"{n:>8}{mode:>9}{wall:>9.2f}{n / wall:>12.1f}{sum(latencies) / n:>9.2f}{len(started_threads) - 1:>9}{cpu:>8.2f}")
+
+    # The fake server takes raw strings, so skip tokenizing to the context length
+    app.get_embeddings().check_embedding_ctx_length = False
+    ingest_states = []
+    for i in range(args.ingestions):
+        upload = frame.assign(region=frame["region"] + f"-{i}")
+        path = app.save_dataset(upload, workdir / f"upload-{i}.parquet")
+        ingest_states.append({"data_path": str(path), "vector_dir": str(workdir / f"vectors-{i}")})
+
+    async def ingest_all() -> List[Dict[str, Any]]:
+        return list(await asyncio.gather(*(app.aingestion_agent(s) for s in ingest_states)))
+
+    started = time.perf_counter()
+    future = asyncio.run_coroutine_threadsafe(ingest_all(), app._event_loop())
+    try:
+        future.result(timeout=120)
+    except TimeoutError:
+        print(f"{args.ingestions} concurrent async ingestions did not finish within 120s (deadlock?)", file=sys.stderr)
+        server.terminate()
+        # The stuck worker threads would block a normal interpreter exit
+        os._exit(1)
+    print(f"\n{args.ingestions} concurrent async ingestions finished in {time.perf_counter() - started:.2f}s")
+    server.terminate()
+
+
+if __name__ == "__main__":
+    main()
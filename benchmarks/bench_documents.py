@@ -0,0 +1,106 @@
+"""Compare the vectorized row serializer against the original iterrows loop.
+
+Run from the repository root:
+
+    python benchmarks/bench_documents.py [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from langchain_core.documents import Document  # noqa: E402
+
+from streamlit_app import dataframe_to_documents  # noqa: E402
+
+
+def iterrows_documents(df: pd.DataFrame, max_rows: int = 20000, rows_per_chunk: int = 100) -> List[Document]:
+    """The pre-vectorization implementation, kept as the reference."""
+    df_limited = df.head(max_rows)
+    docs: List[Document] = []
+    num_rows = len(df_limited)
+    for start in range(0, num_rows, rows_per_chunk):
+        end = min(start + rows_per_chunk, num_rows)
+        chunk = df_limited.iloc[start:end]
+        lines: List[str] = []
+        for idx, row in chunk.iterrows():
+            parts = [f"{col}={row[col]}" for col in chunk.columns]
+            lines.append("; ".join(parts))
+        docs.append(
+            Document(
+                page_content="\n".join(lines),
+                metadata={
+                    "row_start": int(start),
+                    "row_end": int(end - 1),
+                    "n_rows": int(end - start),
+                },
+            )
+        )
+    return docs
+
+
+def make_frame(n_rows: int, n_cols: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(n_cols):
+        kind = i % 5
+        if kind == 0:
+            data[f"int_{i}"] = rng.integers(0, 10_000, n_rows)
+        elif kind == 1:
+            values = rng.normal(100, 25, n_rows).round(2)
+            values[rng.random(n_rows) < 0.05] = np.nan
+            data[f"float_{i}"] = values
+        elif kind == 2:
+            data[f"cat_{i}"] = rng.choice(["north", "south", "east", "west", None], n_rows)
+        elif kind == 3:
+            data[f"date_{i}"] = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D")
+        else:
+            data[f"flag_{i}"] = rng.random(n_rows) < 0.5
+    return pd.DataFrame(data)
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    shapes = {
+        "tall (20000 x 10)": (20_000, 10),
+        "wide (2000 x 200)": (2_000, 200),
+        "default cap (20000 x 50)": (20_000, 50),
+        "numeric only (20000 x 20)": (20_000, 20),
+    }
+    print(f"{'frame':<28}{'iterrows s':>12}{'vectorized s':>14}{'speedup':>10}")
+    for label, (rows, cols) in shapes.items():
+        df = make_frame(rows, cols)
+        if label.startswith("numeric"):
+            df = df.select_dtypes(include=[np.number])
+        reference = iterrows_documents(df)
+        candidate = dataframe_to_documents(df)
+        assert [d.page_content for d in reference] == [d.page_content for d in candidate], label
+        assert [d.metadata for d in reference] == [d.metadata for d in candidate], label
+        slow = best_of(lambda: iterrows_documents(df), args.repeat)
+        fast = best_of(lambda: dataframe_to_documents(df), args.repeat)
+        print(f"{label:<28}{slow:>12.3f}{fast:>14.3f}{slow / fast:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Recall@k and query latency of the selectable FAISS index types vs. exact search.
+
+Run from the repository root:
+
+    python benchmarks/bench_faiss_index.py [--n 100000] [--dim 128] [--queries 500] [--k 10]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import faiss  # noqa: E402
+
+from streamlit_app import faiss_index_params, make_faiss_index  # noqa: E402
+
+
+def clustered_vectors(n: int, dim: int, n_clusters: int = 200, seed: int = 0) -> np.ndarray:
+    """Gaussian clusters, closer to embedding data than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, n)
+    return centers[labels] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+
+
+def build(params: Dict[str, Any], vectors: np.ndarray) -> Any:
+    index = make_faiss_index(params)
+    if not index.is_trained:
+        index.train(vectors[: int(params.get("train_size", len(vectors)))])
+    index.add(vectors)
+    return index
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found.tolist(), truth.tolist()))
+    return hits / float(truth.shape[0] * k)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    data = clustered_vectors(args.n, args.dim)
+    queries = clustered_vectors(args.queries, args.dim, seed=1)
+    faiss.omp_set_num_threads(1)
+
+    rows: List[str] = []
+    baseline = None
+    truth = None
+    sweeps = {
+        "flat": [None],
+        "hnsw": [16, 64, 256],
+        "ivf_flat": [1, 8, 32],
+        "ivf_pq": [1, 8, 32],
+    }
+    for index_type, settings in sweeps.items():
+        params = faiss_index_params(index_type, args.dim, args.n)
+        start = time.perf_counter()
+        index = build(params, data)
+        build_s = time.perf_counter() - start
+        space = faiss.ParameterSpace()
+        for value in settings:
+            label = params["factory"]
+            if index_type == "hnsw":
+                space.set_index_parameter(index, "efSearch", value)
+                label += f" efSearch={value}"
+            elif index_type.startswith("ivf"):
+                space.set_index_parameter(index, "nprobe", value)
+                label += f" nprobe={value}"
+            start = time.perf_counter()
+            _, found = index.search(queries, args.k)
+            per_query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            if truth is None:
+                truth, baseline = found, per_query_ms
+            rows.append(
+                f"{label:<32}{build_s:>9.1f}{per_query_ms:>12.3f}{baseline / per_query_ms:>9.1f}x"
+                f"{recall_at_k(found, truth):>12.3f}"
+            )
+
+    print(f"n={args.n:,} dim={args.dim} queries={args.queries} k={args.k} (single thread)")
+    print(f"{'index':<32}{'build s':>9}{'ms/query':>12}{'speedup':>10}{'recall@k':>12}")
+    print("\n".join(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Core scaling of partition-parallel plan execution vs. a single core.
+
+Run from the repository root:
+
+    python benchmarks/bench_parallel_plans.py [--rows 5000000] [--workers 1,2,4,8] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_plan_compiler import PLANS, best_of, make_frame  # noqa: E402
+from streamlit_app import _run_plan_steps, compile_analysis_plan, execute_plan_parallel  # noqa: E402
+
+PLANS = dict(
+    PLANS,
+    **{
+        "value_counts of a slice": [
+            {"op": "filter", "conditions": [{"column": "qty", "operator": ">", "value": 50}]},
+            {"op": "value_counts", "column": "product", "k": 10},
+        ],
+        "first row per product": [{"op": "dedupe", "subset": ["product"]}],
+    },
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    default_workers = sorted({1, 2, 4, 8, 16, 32, os.cpu_count() or 1})
+    parser.add_argument("--workers", default=",".join(str(w) for w in default_workers if w <= (os.cpu_count() or 1)))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    counts = [int(w) for w in args.workers.split(",") if w.strip()]
+
+    df = make_frame(args.rows)
+    print(f"{len(df):,} rows x {len(df.columns)} columns, {os.cpu_count()} cores")
+    print(f"{'plan':<28}{'1 core s':>10}" + "".join(f"{f'{w} workers':>14}" for w in counts))
+    for label, steps in PLANS.items():
+        program = compile_analysis_plan({"steps": steps}, list(df.columns))
+        try:
+            execute_plan_parallel(df, program, workers=1)
+        except ValueError:
+            continue
+        reference = _run_plan_steps(df, program["steps"], lambda _msg: None).reset_index(drop=True)
+        serial = best_of(lambda: _run_plan_steps(df, program["steps"], lambda _msg: None), args.repeat)
+        cells = []
+        for workers in counts:
+            result, _ = execute_plan_parallel(df, program, workers=workers)
+            assert reference.round(6).astype(str).equals(result.reset_index(drop=True).round(6).astype(str)), label
+            elapsed = best_of(lambda: execute_plan_parallel(df, program, workers=workers), args.repeat)
+            cells.append(f"{elapsed:>8.3f} {serial / elapsed:>4.1f}x")
+        print(f"{label:<28}{serial:>10.3f}" + "".join(f"{c:>14}" for c in cells))
+
+
+if __name__ == "__main__":
+    main()
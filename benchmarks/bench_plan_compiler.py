@@ -0,0 +1,99 @@
+"""Compare interpreted vs. compiled execution of representative analysis plans.
+
+Run from the repository root:
+
+    python benchmarks/bench_plan_compiler.py [--rows 1000000] [--repeat 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from streamlit_app import _execute_analysis_plan, compact_dataframe, compile_analysis_plan  # noqa: E402
+
+PLANS: Dict[str, List[Dict[str, Any]]] = {
+    "top products by revenue": [
+        {"op": "compute", "new_column": "revenue", "operation": "multiply", "left": {"column": "qty"}, "right": {"column": "price"}},
+        {"op": "filter", "conditions": [{"column": "region", "operator": "==", "value": "north"}]},
+        {"op": "filter", "conditions": [{"column": "qty", "operator": ">", "value": 10}]},
+        {"op": "groupby_agg", "by": ["product"], "aggregations": [{"column": "revenue", "agg": "sum"}]},
+        {"op": "topk", "k": 5, "by": "revenue_sum"},
+    ],
+    "group then filter on key": [
+        {"op": "groupby_agg", "by": ["region", "product"], "aggregations": [{"column": "price", "agg": "mean"}]},
+        {"op": "filter", "conditions": [{"column": "region", "operator": "in", "values": ["east", "west"]}]},
+    ],
+    "sort, filter, select": [
+        {"op": "sort", "by": ["price"], "ascending": False},
+        {"op": "filter", "conditions": [{"column": "cost", "operator": "<", "value": 5}]},
+        {"op": "select", "columns": ["product", "price", "cost"]},
+        {"op": "limit", "n": 20},
+    ],
+    "monthly totals": [
+        {"op": "date_trunc", "column": "date", "freq": "month"},
+        {"op": "filter", "conditions": [{"column": "qty", "operator": "between", "values": [5, 50]}]},
+        {"op": "groupby_agg", "by": ["date"], "aggregations": [{"column": "price", "agg": "sum"}]},
+    ],
+    "pivot of a filtered slice": [
+        {"op": "filter", "conditions": [{"column": "qty", "operator": ">", "value": 90}]},
+        {"op": "pivot", "index": "region", "columns": "channel", "values": "qty", "aggfunc": "sum"},
+    ],
+}
+
+
+def make_frame(n_rows: int, n_extra: int = 15, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {
+        "region": rng.choice(["north", "south", "east", "west"], n_rows),
+        "channel": rng.choice(["web", "store", "partner"], n_rows),
+        "product": rng.choice([f"p{i}" for i in range(500)], n_rows),
+        "qty": rng.integers(1, 100, n_rows),
+        "price": rng.random(n_rows) * 100,
+        "cost": rng.random(n_rows) * 50,
+        "date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D"),
+    }
+    data.update({f"extra_{i}": rng.random(n_rows) for i in range(n_extra)})
+    return compact_dataframe(pd.DataFrame(data))[0]
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    print(f"{len(df):,} rows x {len(df.columns)} columns")
+    print(f"{'plan':<28}{'interpreted s':>15}{'compiled s':>12}{'speedup':>10}")
+    for label, steps in PLANS.items():
+        plan = {"steps": steps}
+        reference, _ = _execute_analysis_plan(df, plan, typed=True, compiled=False)
+        candidate, _ = _execute_analysis_plan(df, plan, typed=True)
+        assert reference.reset_index(drop=True).equals(candidate.reset_index(drop=True)), label
+        slow = best_of(lambda: _execute_analysis_plan(df, plan, typed=True, compiled=False), args.repeat)
+        fast = best_of(lambda: _execute_analysis_plan(df, plan, typed=True), args.repeat)
+        print(f"{label:<28}{slow:>15.3f}{fast:>12.3f}{slow / fast:>9.1f}x")
+        for rewrite in dict.fromkeys(compile_analysis_plan(plan, list(df.columns))["rewrites"]):
+            print(f"    {rewrite}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Correctness of semantic plan reuse on labelled question pairs.
+
+For each pair the first question's plan is stored, then the second question is
+looked up. Every question gets the same embedding, the worst case for the
+cache: only the literal and filter-value guards stand between a paraphrase and
+a question that needs a different plan. A wrong reuse is a silently wrong
+answer; a wrong refusal only costs a planner call. Run from the repository
+root:
+
+    python benchmarks/bench_plan_reuse.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from streamlit_app import _SemanticPlanCache  # noqa: E402
+
+COLUMNS = ["region", "product", "sales", "year"]
+
+
+def region_total(region: str) -> dict:
+    return {
+        "steps": [
+            {"op": "filter", "conditions": [{"column": "region", "operator": "==", "value": region}]},
+            {"op": "groupby_agg", "by": ["region"], "aggregations": [{"column": "sales", "agg": "sum"}]},
+        ]
+    }
+
+
+def top_products(k: int, ascending: bool = False) -> dict:
+    return {
+        "steps": [
+            {"op": "groupby_agg", "by": ["product"], "aggregations": [{"column": "sales", "agg": "sum"}]},
+            {"op": "topk", "k": k, "by": "sales_sum", "ascending": ascending},
+        ]
+    }
+
+
+def regions_total(regions: list) -> dict:
+    return {
+        "steps": [
+            {"op": "filter", "conditions": [{"column": "region", "operator": "in", "values": regions}]},
+            {"op": "groupby_agg", "by": ["region"], "aggregations": [{"column": "sales", "agg": "sum"}]},
+        ]
+    }
+
+
+# (stored question, its plan, new question, whether the plan answers it)
+CASES = [
+    ("total sales in Europe", region_total("Europe"), "What were total sales in Europe?", True),
+    ("total sales in Europe", region_total("Europe"), "total sales in Asia", False),
+    ("sales for the europe region", region_total("Europe"), "sales for the EUROPE region", True),
+    ("sales in Europe", region_total("Europe"), "sales in European stores", False),
+    ("sales in Europe and Asia", regions_total(["Europe", "Asia"]), "Asia and Europe sales", True),
+    ("sales in Europe and Asia", regions_total(["Europe", "Asia"]), "sales in Europe and Africa", False),
+    ("top 5 products by sales", top_products(5), "Which five products sell the most?", True),
+    ("top 5 products by sales", top_products(5), "top 10 products by sales", False),
+    ("top 5 products by sales", top_products(5), "bottom 5 products by sales", False),
+    ("top 5 products by sales", top_products(5), "top 5 products by sales in 2023", False),
+]
+
+
+def main() -> None:
+    argparse.ArgumentParser(description=__doc__.splitlines()[0]).parse_args()
+    vector = np.ones(8, dtype=np.float32) / np.sqrt(8)
+    counts = {"reused": 0, "refused": 0, "wrong reuse": 0, "missed reuse": 0}
+    print(f"{'outcome':<14}{'stored question':<30}new question")
+    with tempfile.TemporaryDirectory() as workdir:
+        for i, (stored, plan, query, reusable) in enumerate(CASES):
+            cache = _SemanticPlanCache(Path(workdir) / f"plans-{i}.sqlite3", threshold=0.92, max_entries=10)
+            cache.add("bench", stored, vector, plan)
+            hit = cache.lookup("bench", vector, COLUMNS, query) is not None
+            if hit == reusable:
+                outcome = "reused" if hit else "refused"
+            else:
+                outcome = "wrong reuse" if hit else "missed reuse"
+            counts[outcome] += 1
+            print(f"{outcome:<14}{stored!r:<30}{query!r}")
+    print(
+        f"\n{len(CASES)} pairs: {counts['reused']} reused and {counts['refused']} refused correctly, "
+        f"{counts['wrong reuse']} wrong reuses (wrong answers), {counts['missed reuse']} missed reuses (extra planner calls)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Accuracy and cost of the rule-based router on labelled queries.
+
+Each query is classified by the keyword rules alone. A route is "confident"
+when its score reaches ROUTER_CONFIDENCE_THRESHOLD (no LLM call), and
+"deferred" otherwise. Confident routes to the wrong intent are the failures
+that matter, since nothing downstream corrects them. Run from the repository
+root:
+
+    python benchmarks/bench_router.py [--repeat 1000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from streamlit_app import ROUTER_CONFIDENCE_THRESHOLD, _classify_intent_rules  # noqa: E402
+
+# (query, has_new_upload, prefer_visual, expected intent)
+CASES = [
+    ("What are the top 5 products by revenue?", False, False, "analyze"),
+    ("How many orders were placed per region?", False, False, "analyze"),
+    ("Average basket size by month", False, False, "analyze"),
+    ("plot total sales by region", False, False, "analyze_and_visualize"),
+    ("Draw a pie chart of sales by region", False, False, "visualize"),
+    ("visualize revenue", False, False, "visualize"),
+    ("Visualization of sales by month", False, False, "visualize"),
+    ("show a histogram of price", False, False, "visualize"),
+    ("scatter of price vs qty", False, False, "visualize"),
+    ("line charts of revenue over time", False, False, "visualize"),
+    ("heatmap of orders by weekday and hour", False, False, "visualize"),
+    ("revenue by region", False, True, "visualize"),
+    ("", True, False, "ingest"),
+    ("top customers by spend", True, False, "ingest_then_analyze"),
+    ("plot revenue by month", True, False, "ingest_then_visualize"),
+    # Analytic questions whose words merely start like chart words
+    ("How many pieces were sold in March?", False, False, "analyze"),
+    ("List chartered accounts by balance", False, False, "analyze"),
+    ("What is the max drawdown per fund?", False, False, "analyze"),
+    ("Which graphics cards sold best?", False, False, "analyze"),
+    ("Total sales by drawer", False, False, "analyze"),
+    ("Customers scattered across regions", False, False, "analyze"),
+    ("Which paragraphs mention refunds?", False, False, "analyze"),
+    # Question words alone say little about the intent
+    ("Which view shows revenue per month best?", False, False, "visualize"),
+    ("Where can I see how revenue moved across the year?", False, False, "visualize"),
+    ("List the customers in Ohio", False, False, "analyze"),
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1000, help="classifications per query for the timing")
+    args = parser.parse_args()
+
+    counts = {"correct": 0, "deferred": 0, "wrong": 0}
+    print(f"{'outcome':<10}{'conf':>6}  {'routed to':<24}{'expected':<24}query")
+    for query, has_new_upload, prefer_visual, expected in CASES:
+        intent, confidence = _classify_intent_rules(query, has_new_upload, prefer_visual)
+        if confidence < ROUTER_CONFIDENCE_THRESHOLD:
+            outcome = "deferred"
+        else:
+            outcome = "correct" if intent == expected else "wrong"
+        counts[outcome] += 1
+        print(f"{outcome:<10}{confidence:>6.2f}  {intent:<24}{expected:<24}{query!r}")
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for query, has_new_upload, prefer_visual, _expected in CASES:
+            _classify_intent_rules(query, has_new_upload, prefer_visual)
+    per_query = (time.perf_counter() - started) / (args.repeat * len(CASES))
+    print(
+        f"\n{len(CASES)} queries: {counts['correct']} routed correctly without the LLM, "
+        f"{counts['deferred']} deferred to the LLM, {counts['wrong']} confidently wrong | "
+        f"{per_query * 1e6:.1f} µs per classification"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,46 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import logging
 import os
+import queue
 from io import BytesIO
 import re
 import difflib
+import hashlib
+import multiprocessing
+import sqlite3
+import threading
+import uuid
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Any, Dict, List, Optional, TypedDict, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TypedDict, Tuple, Union
 
 import pandas as pd
 import numpy as np
+from pandas.tseries.api import guess_datetime_format
+import faiss
+import httpx
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import plotly.graph_objects as go
 import streamlit as st
+import streamlit.components.v1 as components
 
 # LangChain / LangGraph
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
 from langchain_experimental.agents.agent_toolkits.pandas.base import (
     create_pandas_dataframe_agent,
 )
@@ -27,10 +50,15 @@ from langgraph.graph import StateGraph, END
 # Configuration & helpers
 # -------------------------
 
+logger = logging.getLogger(__name__)
+
 APP_NAME = "AI Data Analysis & Visualization"
 BASE_DIR = Path(".")
 DATA_DIR = BASE_DIR / "data"
 STORE_DIR = BASE_DIR / "stores"
+DATASET_SUFFIX = ".parquet"
+# Rows per Parquet row group; bounds the unit of projected/streamed reads
+PARQUET_ROW_GROUP_SIZE = 128_000
 
 
 def _get_secret(key: str, default: Optional[str] = None) -> Optional[str]:
@@ -45,6 +73,26 @@ def _get_secret(key: str, default: Optional[str] = None) -> Optional[str]:
     return os.getenv(key, default)
 
 
+def _get_int_setting(key: str, default: int) -> int:
+    value = _get_secret(key)
+    if value is None:
+        return default
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _get_float_setting(key: str, default: float) -> float:
+    value = _get_secret(key)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
 def ensure_openai_key() -> str:
     api_key = _get_secret("OPENAI_API_KEY")
     if not api_key:
@@ -57,57 +105,831 @@ def ensure_openai_key() -> str:
 
 
 def ensure_dirs_for(user_id: str, dataset_id: str) -> Dict[str, Path]:
-    data_path = DATA_DIR / user_id / f"{dataset_id}.csv"
+    data_path = DATA_DIR / user_id / f"{dataset_id}{DATASET_SUFFIX}"
+    legacy_path = data_path.with_suffix(".csv")
+    if not data_path.exists() and legacy_path.exists():
+        # Datasets saved before the columnar format are still read as CSV
+        data_path = legacy_path
     vector_dir = STORE_DIR / user_id / dataset_id
     data_path.parent.mkdir(parents=True, exist_ok=True)
     vector_dir.mkdir(parents=True, exist_ok=True)
     return {"data_path": data_path, "vector_dir": vector_dir}
 
 
+# -------------------------
+# Dataset fingerprints
+# -------------------------
+
+INGESTED_MARKER = "ingested.json"
+
+
+def upload_fingerprint(raw: Any) -> str:
+    """BLAKE2 digest of uploaded bytes (``bytes`` or a buffer such as ``getbuffer()``)."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _dataset_meta_path(data_path: Path) -> Path:
+    return Path(data_path).with_suffix(".meta.json")
+
+
+def read_dataset_meta(data_path: Path) -> Dict[str, Any]:
+    path = _dataset_meta_path(data_path)
+    try:
+        meta = json.loads(path.read_text())
+        return meta if isinstance(meta, dict) else {}
+    except Exception:
+        return {}
+
+
+def write_dataset_meta(data_path: Path, updates: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge ``updates`` into the dataset's ``.meta.json`` sidecar."""
+    meta = read_dataset_meta(data_path)
+    meta.update(updates)
+    path = _dataset_meta_path(data_path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(meta, indent=2, default=str))
+    os.replace(tmp, path)
+    return meta
+
+
+def read_indexed_fingerprint(vector_dir: Path) -> Optional[str]:
+    """Fingerprint of the dataset the FAISS store in ``vector_dir`` was built from."""
+    try:
+        return json.loads((Path(vector_dir) / INGESTED_MARKER).read_text()).get("fingerprint")
+    except Exception:
+        return None
+
+
+def _write_indexed_fingerprint(vector_dir: Path, fingerprint: Optional[str]) -> None:
+    marker = Path(vector_dir) / INGESTED_MARKER
+    if fingerprint:
+        marker.write_text(json.dumps({"fingerprint": fingerprint}))
+    elif marker.exists():
+        marker.unlink()
+
+
+# -------------------------
+# In-memory caches
+# -------------------------
+
+class _LRUCache:
+    """Thread-safe LRU mapping bounded by the summed ``sizeof`` of its values."""
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = lambda _: 1) -> None:
+        self.max_size = max(0, int(max_size))
+        self._sizeof = sizeof
+        self._items: "OrderedDict[Any, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks: Dict[Any, threading.Lock] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+            return default
+
+    def peek(self, key: Any, default: Any = None) -> Any:
+        """Like ``get`` but without touching recency or hit/miss counters."""
+        with self._lock:
+            entry = self._items.get(key)
+            return entry[0] if entry is not None else default
+
+    def put(self, key: Any, value: Any) -> None:
+        size = int(self._sizeof(value))
+        with self._lock:
+            self._remove(key)
+            if size > self.max_size:
+                # Larger than the whole budget: hand it back uncached
+                return
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size and self._items:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_load(self, key: Any, loader: Callable[[], Any]) -> Any:
+        """Return the cached value for ``key``, calling ``loader`` at most once concurrently."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                if key in self._items:
+                    # Another thread loaded it while we waited
+                    self._items.move_to_end(key)
+                    return self._items[key][0]
+            value = loader()
+            self.put(key, value)
+        with self._lock:
+            self._load_locks.pop(key, None)
+        return value
+
+    def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+        with self._lock:
+            stale = [k for k in self._items if predicate(k)]
+            for k in stale:
+                self._remove(k)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: Any) -> None:
+        entry = self._items.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+def _frame_nbytes(df: pd.DataFrame) -> int:
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return 0
+
+
+def _file_version(path: Path) -> Tuple[str, int, int]:
+    stat = path.stat()
+    return (str(path.resolve()), int(stat.st_mtime_ns), int(stat.st_size))
+
+
+# Streamlit re-executes this module on every rerun, so process-wide caches are
+# created through st.cache_resource rather than as plain module globals.
+@st.cache_resource(show_spinner=False)
+def _dataset_cache() -> _LRUCache:
+    """Parsed datasets shared by every graph node; budget in MB via DATASET_CACHE_MAX_MB."""
+    return _LRUCache(_get_int_setting("DATASET_CACHE_MAX_MB", 2048) * 1024 * 1024, sizeof=_frame_nbytes)
+
+
+def _to_arrow_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    """Make column names and mixed-type object columns representable in Arrow."""
+    out = df
+    if not all(isinstance(c, str) for c in df.columns):
+        out = out.rename(columns={c: str(c) for c in df.columns})
+    for col in out.columns:
+        series = out[col]
+        if pd.api.types.is_object_dtype(series):
+            kind = pd.api.types.infer_dtype(series, skipna=True)
+            if kind in {"mixed", "mixed-integer"}:
+                if out is df:
+                    out = df.copy(deep=False)
+                out[col] = series.where(series.isna(), series.astype(str))
+    return out
+
+
+def compact_dataframe(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Shrink ``df`` to compact dtypes; returns the new frame and a report.
+
+    Integers are downcast to int32 where the range allows and float64 to
+    float32 only when the round trip is exact. Text columns become
+    ``category`` at low cardinality (the CATEGORY_MAX_DISTINCT and
+    CATEGORY_MAX_RATIO limits type inference uses) and ``string[pyarrow]``
+    otherwise. Narrower
+    integers are not used so arithmetic in plan ops stays clear of overflow.
+    The report carries the resulting dtype map and memory before and after.
+    """
+    before = _frame_nbytes(df)
+    out = df.copy(deep=False)
+    for col in list(out.columns):
+        series = out[col]
+        try:
+            if pd.api.types.is_bool_dtype(series) or not isinstance(series.dtype, (np.dtype, pd.StringDtype)):
+                continue
+            if pd.api.types.is_integer_dtype(series) and series.dtype.itemsize > 4:
+                info = np.iinfo(np.int32)
+                if len(series) and info.min <= series.min() and series.max() <= info.max:
+                    out[col] = series.astype(np.int32)
+            elif series.dtype == np.float64:
+                narrow = series.to_numpy().astype(np.float32)
+                if np.array_equal(narrow.astype(np.float64), series.to_numpy(), equal_nan=True):
+                    out[col] = pd.Series(narrow, index=series.index)
+            elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+                if pd.api.types.infer_dtype(series, skipna=True) not in {"string", "empty"}:
+                    continue
+                distinct = int(series.nunique(dropna=True))
+                if len(series) and distinct <= CATEGORY_MAX_DISTINCT and distinct <= CATEGORY_MAX_RATIO * len(series):
+                    out[col] = series.astype("category")
+                else:
+                    out[col] = series.astype("string[pyarrow]")
+        except Exception:
+            continue
+    report = {
+        "dtypes": {
+            str(c): f"string[{t.storage}]" if isinstance(t, pd.StringDtype) else str(t) for c, t in out.dtypes.items()
+        },
+        "memory_before": before,
+        "memory_after": _frame_nbytes(out),
+    }
+    return out, report
+
+
+def save_dataset(df: pd.DataFrame, data_path: Path) -> Path:
+    """Persist ``df`` as Parquet next to ``data_path`` and return the written path.
+
+    A legacy ``.csv`` copy of the same dataset is removed so readers pick up
+    the columnar file.
+    """
+    target = Path(data_path).with_suffix(DATASET_SUFFIX)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.Table.from_pandas(_to_arrow_compatible(df), preserve_index=False)
+    tmp = target.with_name(target.name + ".tmp")
+    pq.write_table(table, tmp, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    os.replace(tmp, target)
+    legacy_path = target.with_suffix(".csv")
+    if legacy_path.exists():
+        try:
+            legacy_path.unlink()
+        except Exception:
+            pass
+    return target
+
+
+# Text columns come back as string[pyarrow] rather than the metadata's python storage
+_ARROW_STRING_DTYPES = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+
+
+def _read_dataset_file(
+    data_path: Path, columns: Optional[List[str]] = None, filters: Optional[List[Tuple[str, str, Any]]] = None
+) -> pd.DataFrame:
+    if data_path.suffix == ".parquet":
+        # Memory-mapped read; self_destruct releases Arrow buffers as columns convert.
+        # Row groups whose statistics rule out ``filters`` are skipped entirely.
+        table = pq.read_table(data_path, columns=columns, filters=filters or None, memory_map=True)
+        return table.to_pandas(split_blocks=True, self_destruct=True, types_mapper=_ARROW_STRING_DTYPES.get)
+    # Legacy CSV copies predate the compaction stage
+    return compact_dataframe(pd.read_csv(data_path, usecols=columns))[0]
+
+
+def dataset_columns(data_path: Path) -> List[str]:
+    """Column names of a stored dataset, read from metadata only where possible."""
+    data_path = Path(data_path)
+    if data_path.suffix == ".parquet":
+        return [str(name) for name in pq.read_schema(data_path).names]
+    return [str(c) for c in pd.read_csv(data_path, nrows=0).columns]
+
+
+def load_dataset(data_path: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Load the dataset at ``data_path`` through the process-wide cache.
+
+    Entries are keyed by (path, mtime, size) plus the projected ``columns``, so
+    a rewritten file is re-read. A projection is served from the full frame when
+    that is already cached. The returned frame is shared between callers and
+    must not be mutated.
+    """
+    data_path = Path(data_path)
+    version = _file_version(data_path)
+    projection = tuple(columns) if columns is not None else None
+    # Drop frames parsed from older versions of the same file
+    _dataset_cache().discard_where(lambda k: k[0] == version[0] and k[:3] != version)
+    if projection is not None:
+        full = _dataset_cache().peek(version + (None,))
+        if full is not None:
+            return full.loc[:, list(projection)]
+    return _dataset_cache().get_or_load(
+        version + (projection,),
+        lambda: _read_dataset_file(data_path, list(projection) if projection is not None else None),
+    )
+
+
+def cached_dataset(data_path: Path) -> Optional[pd.DataFrame]:
+    """The fully parsed dataset if it is already in memory, without loading it."""
+    try:
+        return _dataset_cache().peek(_file_version(Path(data_path)) + (None,))
+    except OSError:
+        return None
+
+
+def dataset_cache_stats() -> Dict[str, int]:
+    return _dataset_cache().stats()
+
+
 # -------------------------
 # Vector store (FAISS)
 # -------------------------
 
+def _datetime_text(values: np.ndarray) -> np.ndarray:
+    """``str(Timestamp)`` for a naive datetime64 array, vectorized when second-aligned."""
+    seconds = values.astype("datetime64[s]")
+    missing = np.isnat(values)
+    if bool(((seconds == values) | missing).all()):
+        text = np.char.replace(np.datetime_as_string(seconds, unit="s"), "T", " ").astype(object)
+        text[missing] = "NaT"
+        return text
+    return pd.Series(values).map(str).to_numpy(dtype=object)
+
+
+def _cell_text(values: np.ndarray, boxed: bool) -> np.ndarray:
+    """Format one column's cells the way ``f"{row[col]}"`` would.
+
+    ``boxed`` means the frame interleaves to ``object``, in which case rows hold
+    Python scalars and datetimes become Timestamps. Floats of any width format
+    like Python floats, since f-strings go through ``float.__format__``.
+    """
+    kind = values.dtype.kind
+    if kind in "mM":
+        if kind == "M":
+            return _datetime_text(values)
+        return pd.Series(values).map(str).to_numpy(dtype=object)
+    if kind == "f":
+        values = values.astype(np.float64, copy=False)
+    return values.astype(str).astype(object)
+
+
+def _row_dtype(dtypes: List[np.dtype]) -> np.dtype:
+    """The dtype pandas interleaves numpy columns to, as each ``iterrows`` row gets.
+
+    This is numpy promotion, with pandas' exceptions. Datetimes (or
+    timedeltas) of different units keep the finest unit. Bool mixed with
+    numbers boxes to ``object``. Any other mix that would promote to a time or
+    string dtype, or that cannot promote at all, also boxes to ``object``.
+    """
+    unique = list(dict.fromkeys(dtypes))
+    if len(unique) == 1:
+        return unique[0]
+    kinds = {t.kind for t in unique}
+    if kinds in ({"M"}, {"m"}):
+        return max(unique)
+    if "b" in kinds and kinds & set("iufc"):
+        return np.dtype(object)
+    try:
+        common = np.result_type(*unique)
+    except TypeError:
+        return np.dtype(object)
+    return np.dtype(object) if common.kind in "mMSU" else common
+
+
+def _rows_as_text(df: pd.DataFrame) -> np.ndarray:
+    """Render every row as ``col=value; ...`` without iterating rows in Python.
+
+    Cells are formatted with the dtype ``iterrows`` would give each row Series,
+    so the text matches ``f"{row[col]}"`` exactly.
+    """
+    n_rows = len(df)
+    if not len(df.columns):
+        return np.full(n_rows, "", dtype=object)
+    dtypes = list(df.dtypes)
+    if all(isinstance(t, np.dtype) for t in dtypes):
+        common = _row_dtype(dtypes)
+        boxed = common == np.dtype(object)
+        columns = [
+            df.iloc[:, j].to_numpy() if boxed else df.iloc[:, j].to_numpy().astype(common, copy=False)
+            for j in range(len(df.columns))
+        ]
+    else:
+        # Extension dtypes: format from the interleaved array itself
+        values = df.to_numpy()
+        boxed = values.dtype == np.dtype(object)
+        columns = [values[:, j] for j in range(len(df.columns))]
+    parts: List[np.ndarray] = []
+    for col, cells in zip(df.columns, columns):
+        if boxed and cells.dtype == np.dtype(object):
+            text = cells.astype(str).astype(object)
+        else:
+            text = _cell_text(cells, boxed)
+        parts.append(f"{col}=" + text)
+    if len(parts) == 1:
+        return parts[0]
+    # One C-level join per row keeps wide frames linear in output size
+    return np.fromiter(("; ".join(cells) for cells in zip(*parts)), dtype=object, count=n_rows)
+
+
+def iter_dataset_batches(
+    data_path: Path, batch_rows: int = 50_000, columns: Optional[List[str]] = None
+) -> Iterator[pd.DataFrame]:
+    """Yield the stored dataset as consecutive frames of at most ``batch_rows`` rows."""
+    data_path = Path(data_path)
+    if data_path.suffix == ".parquet":
+        parquet = pq.ParquetFile(data_path, memory_map=True)
+        for batch in parquet.iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas(types_mapper=_ARROW_STRING_DTYPES.get)
+        return
+    yield from pd.read_csv(data_path, chunksize=batch_rows, usecols=columns)
+
+
+def iter_documents(
+    frames: Iterable[pd.DataFrame],
+    rows_per_chunk: int = 100,
+    max_rows: Optional[int] = None,
+    batch_rows: int = 10_000,
+) -> Iterator[Document]:
+    """Stream ``rows_per_chunk``-row Documents from consecutive frames.
+
+    Rows are serialized ``batch_rows`` at a time and chunk boundaries carry
+    across frames, so row numbering matches serializing one concatenated frame.
+    """
+    pending: List[str] = []
+    chunk_start = 0
+    seen = 0
+
+    def make_doc(lines: List[str], start: int) -> Document:
+        return Document(
+            page_content="\n".join(lines),
+            metadata={
+                "row_start": int(start),
+                "row_end": int(start + len(lines) - 1),
+                "n_rows": int(len(lines)),
+            },
+        )
+
+    for frame in frames:
+        if max_rows is not None:
+            if seen >= max_rows:
+                break
+            frame = frame.head(max_rows - seen)
+        seen += len(frame)
+        for offset in range(0, len(frame), batch_rows):
+            pending.extend(_rows_as_text(frame.iloc[offset : offset + batch_rows]).tolist())
+            while len(pending) >= rows_per_chunk:
+                yield make_doc(pending[:rows_per_chunk], chunk_start)
+                del pending[:rows_per_chunk]
+                chunk_start += rows_per_chunk
+    if pending:
+        yield make_doc(pending, chunk_start)
+
+
 def dataframe_to_documents(df: pd.DataFrame, max_rows: int = 20000, rows_per_chunk: int = 100) -> List[Document]:
-    df_limited = df.head(max_rows)
-    docs: List[Document] = []
-    num_rows = len(df_limited)
-    for start in range(0, num_rows, rows_per_chunk):
-        end = min(start + rows_per_chunk, num_rows)
-        chunk = df_limited.iloc[start:end]
-        # Represent chunk as newline-delimited key=value pairs
-        lines: List[str] = []
-        for idx, row in chunk.iterrows():
-            parts = [f"{col}={row[col]}" for col in chunk.columns]
-            lines.append("; ".join(parts))
-        content = "\n".join(lines)
-        docs.append(
-            Document(
-                page_content=content,
-                metadata={
-                    "row_start": int(start),
-                    "row_end": int(end - 1),
-                    "n_rows": int(end - start),
-                },
+    # Represent each chunk as newline-delimited key=value pairs
+    return list(iter_documents([df], rows_per_chunk=rows_per_chunk, max_rows=max_rows))
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# -------------------------
+# Embedding cache
+# -------------------------
+
+EMBEDDING_CACHE_PATH = STORE_DIR / "embedding_cache.sqlite3"
+
+
+class _EmbeddingCache:
+    """Content-addressed embeddings shared by every dataset and user.
+
+    Rows are keyed by (model, sha256(text)) and hold float32 vectors as blobs.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        if not self._initialized:
+            with self._lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings ("
+                    "model TEXT NOT NULL, digest BLOB NOT NULL, vector BLOB NOT NULL, "
+                    "PRIMARY KEY (model, digest))"
+                )
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def get_many(self, model: str, digests: List[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        if not digests:
+            return found
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            for start in range(0, len(digests), 500):
+                part = digests[start : start + 500]
+                rows = conn.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                )
+                for digest, blob in rows:
+                    found[bytes(digest)] = np.frombuffer(blob, dtype=np.float32)
+        finally:
+            conn.close()
+        return found
+
+    def put_many(self, model: str, items: List[Tuple[bytes, List[float]]]) -> None:
+        if not items:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, digest, vector) VALUES (?, ?, ?)",
+                [(model, digest, np.asarray(vec, dtype=np.float32).tobytes()) for digest, vec in items],
             )
-        )
-    return docs
+            conn.commit()
+        finally:
+            conn.close()
+
+
+_EMBEDDING_CACHE = _EmbeddingCache(EMBEDDING_CACHE_PATH)
+
+
+class _CachedEmbedder:
+    """Embed through ``_EMBEDDING_CACHE``, calling the API only for unseen texts."""
+
+    def __init__(self, embeddings: Any, model: str, cache: _EmbeddingCache = _EMBEDDING_CACHE) -> None:
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[bytes], List[bytes], Dict[bytes, np.ndarray], Dict[bytes, str]]:
+        encoded = [t.encode("utf-8") for t in texts]
+        digests = [hashlib.sha256(b).digest() for b in encoded]
+        found = self.cache.get_many(self.model, list(dict.fromkeys(digests)))
+        # Embed each unseen text once, even if it repeats within the batch
+        missing: Dict[bytes, str] = {}
+        for digest, text in zip(digests, texts):
+            if digest not in found and digest not in missing:
+                missing[digest] = text
+        return encoded, digests, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        encoded, digests, found, missing = self._lookup(texts)
+        vectors = self.embeddings.embed_documents(list(missing.values())) if missing else []
+        return self._store(encoded, digests, found, missing, vectors)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        encoded, digests, found, missing = await asyncio.to_thread(self._lookup, texts)
+        vectors = await self.embeddings.aembed_documents(list(missing.values())) if missing else []
+        return await asyncio.to_thread(self._store, encoded, digests, found, missing, vectors)
+
+    def _store(
+        self,
+        encoded: List[bytes],
+        digests: List[bytes],
+        found: Dict[bytes, np.ndarray],
+        missing: Dict[bytes, str],
+        vectors: List[List[float]],
+    ) -> List[List[float]]:
+        if missing:
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model, new_items)
+            for digest, vec in new_items:
+                found[digest] = np.asarray(vec, dtype=np.float32)
+        for digest, raw in zip(digests, encoded):
+            if digest in missing:
+                self.misses += 1
+                missing.pop(digest)
+            else:
+                self.hits += 1
+                self.bytes_saved += len(raw)
+        return [found[d].tolist() for d in digests]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "cache_hits": self.hits,
+            "embedded": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+# -------------------------
+# FAISS index selection
+# -------------------------
+
+INDEX_PARAMS_FILE = "index_params.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+# "auto" picks by expected chunk count; otherwise one of INDEX_TYPES
+FAISS_INDEX_TYPE = str(_get_secret("FAISS_INDEX_TYPE", "auto") or "auto").lower()
+# Vectors buffered to train IVF indexes before streaming the rest
+FAISS_MAX_TRAIN_SIZE = 50_000
+
+
+def choose_index_type(n_vectors: int, requested: str = "auto") -> str:
+    if requested in INDEX_TYPES:
+        return requested
+    if n_vectors <= 50_000:
+        return "flat"
+    if n_vectors <= 500_000:
+        return "hnsw"
+    return "ivf_pq"
+
+
+def faiss_index_params(index_type: str, dim: int, n_vectors: int) -> Dict[str, Any]:
+    """Factory string plus build/search parameters for ``index_type``."""
+    params: Dict[str, Any] = {"type": index_type, "dim": int(dim), "n_vectors": int(n_vectors)}
+    if index_type == "hnsw":
+        params.update({"factory": "HNSW32", "ef_construction": 80, "ef_search": 128})
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = int(min(1024, max(16, np.sqrt(max(n_vectors, 1)))))
+        params.update({"nlist": nlist, "nprobe": min(nlist, 16)})
+        min_train = 39 * nlist
+        if index_type == "ivf_pq":
+            # Most sub-quantizers (<= 64, >= 4 dims each) that divide the dimension
+            pq_m = max([m for m in range(1, 65) if dim % m == 0 and dim // m >= 4] or [1])
+            params.update({"factory": f"IVF{nlist},PQ{pq_m}x8", "pq_m": pq_m})
+            min_train = max(min_train, 39 * 256)
+        else:
+            params["factory"] = f"IVF{nlist},Flat"
+        params["min_train"] = min_train
+        params["train_size"] = min(FAISS_MAX_TRAIN_SIZE, max(min_train, n_vectors))
+    else:
+        params.update({"type": "flat", "factory": "Flat"})
+    return params
+
+
+def make_faiss_index(params: Dict[str, Any]) -> Any:
+    index = faiss.index_factory(int(params["dim"]), str(params["factory"]), faiss.METRIC_L2)
+    if params.get("type") == "hnsw":
+        index.hnsw.efConstruction = int(params.get("ef_construction", 40))
+    return index
+
+
+def apply_search_params(index: Any, params: Dict[str, Any]) -> None:
+    """Set nprobe/efSearch from FAISS_NPROBE/FAISS_EF_SEARCH, else the persisted values."""
+    space = faiss.ParameterSpace()
+    if str(params.get("type", "")).startswith("ivf"):
+        space.set_index_parameter(index, "nprobe", _get_int_setting("FAISS_NPROBE", int(params.get("nprobe", 16))))
+    elif params.get("type") == "hnsw":
+        space.set_index_parameter(index, "efSearch", _get_int_setting("FAISS_EF_SEARCH", int(params.get("ef_search", 128))))
+
+
+def read_index_params(vector_dir: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((Path(vector_dir) / INDEX_PARAMS_FILE).read_text())
+    except Exception:
+        return {"type": "flat", "factory": "Flat"}
+
+
+def _new_faiss_store(
+    embeddings: Any, params: Dict[str, Any], rows: List[Tuple[str, np.ndarray, Dict[str, Any]]]
+) -> Tuple[FAISS, Dict[str, Any]]:
+    """Create (and train, if needed) an index from the first buffered rows."""
+    vectors = np.vstack([r[1] for r in rows]).astype(np.float32, copy=False)
+    if len(vectors) < int(params.get("min_train", 0)):
+        # Too few vectors to train the requested index well; exact search is cheap here
+        params = faiss_index_params("flat", vectors.shape[1], len(vectors))
+    index = make_faiss_index(params)
+    if not index.is_trained:
+        index.train(vectors)
+    store = FAISS(embeddings, index, InMemoryDocstore(), {})
+    store.add_embeddings([(r[0], r[1].tolist()) for r in rows], metadatas=[r[2] for r in rows])
+    return store, params
+
+
+def _source_num_rows(source: Union[pd.DataFrame, Path]) -> Optional[int]:
+    if isinstance(source, pd.DataFrame):
+        return len(source)
+    if Path(source).suffix == ".parquet":
+        return int(pq.ParquetFile(source).metadata.num_rows)
+    rows = read_dataset_meta(Path(source)).get("rows")
+    return int(rows) if rows is not None else None
+
+
+# Documents embedded per request while building an index
+EMBED_BATCH_SIZE = 512
+# Optional cap on rows indexed into FAISS at ingestion (0 = index every row)
+INGEST_MAX_ROWS: Optional[int] = _get_int_setting("INGEST_MAX_ROWS", 0) or None
+
+
+def build_vector_store(
+    source: Union[pd.DataFrame, Path],
+    vector_dir: Path,
+    embedding_model: str = "text-embedding-3-small",
+    max_rows: Optional[int] = None,
+    index_type: Optional[str] = None,
+    rows_per_chunk: int = 100,
+    embed_async: bool = False,
+) -> Dict[str, Any]:
+    """Embed ``source`` (a frame or a stored dataset path) into a FAISS store.
+
+    Documents are generated lazily and embedded ``EMBED_BATCH_SIZE`` at a time,
+    growing the index with ``add_embeddings``, so peak memory does not scale
+    with row count. ``max_rows`` optionally caps the rows indexed. Chunks seen
+    before (by content) are served from the embedding cache. The index type
+    (``index_type`` or FAISS_INDEX_TYPE) defaults to one sized for the expected
+    chunk count; IVF indexes are trained on the first vectors streamed in, and
+    the chosen parameters are saved next to ``index.faiss``. ``embed_async``
+    sends the embedding requests through the shared event loop (call it from
+    a thread outside the loop and its default executor). Returns indexing stats including the
+    cache hit ratio.
+    """
+    embeddings = get_embeddings(embedding_model)
+    embedder = _CachedEmbedder(embeddings, embedding_model)
+    frames: Iterable[pd.DataFrame] = [source] if isinstance(source, pd.DataFrame) else iter_dataset_batches(Path(source))
+    n_rows = _source_num_rows(source)
+    if n_rows is not None and max_rows is not None:
+        n_rows = min(n_rows, max_rows)
+    expected_docs = -(-n_rows // rows_per_chunk) if n_rows is not None else 0
+    requested = (index_type or FAISS_INDEX_TYPE).lower()
+
+    store: Optional[FAISS] = None
+    params: Optional[Dict[str, Any]] = None
+    # Rows held back until there are enough vectors to train the index
+    pending: List[Tuple[str, np.ndarray, Dict[str, Any]]] = []
+    n_docs = 0
+    documents = iter_documents(frames, rows_per_chunk=rows_per_chunk, max_rows=max_rows)
+    for batch in _batched(documents, EMBED_BATCH_SIZE):
+        texts = [d.page_content for d in batch]
+        metadatas = [d.metadata for d in batch]
+        vectors = run_async(embedder.aembed_documents(texts)) if embed_async else embedder.embed_documents(texts)
+        n_docs += len(batch)
+        if store is not None:
+            store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+            continue
+        if params is None:
+            params = faiss_index_params(choose_index_type(expected_docs, requested), len(vectors[0]), expected_docs)
+        pending.extend(zip(texts, (np.asarray(v, dtype=np.float32) for v in vectors), metadatas))
+        if len(pending) >= int(params.get("train_size", 0)):
+            store, params = _new_faiss_store(embeddings, params, pending)
+            pending = []
+    if store is None and pending and params is not None:
+        store, params = _new_faiss_store(embeddings, params, pending)
+
+    if store is None or params is None:
+        # Empty dataset: make sure no index from a previous upload lingers
+        for p in [vector_dir / "index.faiss", vector_dir / "index.pkl", vector_dir / INDEX_PARAMS_FILE]:
+            if p.exists():
+                p.unlink()
+        invalidate_vector_store(vector_dir)
+    else:
+        params["n_vectors"] = n_docs
+        store.save_local(str(vector_dir))
+        (vector_dir / INDEX_PARAMS_FILE).write_text(json.dumps(params, indent=2))
+        apply_search_params(store.index, params)
+        # Serve the freshly built store from memory instead of reloading it
+        invalidate_vector_store(vector_dir)
+        version = _vector_store_version(vector_dir)
+        if version is not None:
+            _vector_store_cache().put(version + (embedding_model,), store)
+    return {"documents": n_docs, "index_type": (params or {}).get("type"), **embedder.stats()}
+
+
+@st.cache_resource(show_spinner=False)
+def _vector_store_cache() -> _LRUCache:
+    """Loaded FAISS stores kept in memory; VECTOR_STORE_CACHE_SIZE bounds the entry count."""
+    return _LRUCache(_get_int_setting("VECTOR_STORE_CACHE_SIZE", 8))
+
+
+def _vector_store_version(vector_dir: Path) -> Optional[Tuple[Any, ...]]:
+    files = [Path(vector_dir) / "index.faiss", Path(vector_dir) / "index.pkl"]
+    try:
+        stats = [p.stat() for p in files]
+    except OSError:
+        return None
+    return (str(Path(vector_dir).resolve()),) + tuple((info.st_mtime_ns, info.st_size) for info in stats)
 
 
-def build_vector_store(df: pd.DataFrame, vector_dir: Path, embedding_model: str = "text-embedding-3-small") -> None:
-    embeddings = OpenAIEmbeddings(model=embedding_model)
-    docs = dataframe_to_documents(df)
-    store = FAISS.from_documents(docs, embeddings)
-    store.save_local(str(vector_dir))
+def invalidate_vector_store(vector_dir: Path) -> None:
+    """Forget any in-memory copy of the store in ``vector_dir``."""
+    resolved = str(Path(vector_dir).resolve())
+    _vector_store_cache().discard_where(lambda k: k[0] == resolved)
 
 
 def load_vector_store(vector_dir: Path, embedding_model: str = "text-embedding-3-small") -> Optional[FAISS]:
-    if not (vector_dir / "index.faiss").exists():
+    """Return the FAISS store in ``vector_dir``, deserializing it only when its files change."""
+    version = _vector_store_version(vector_dir)
+    if version is None:
+        invalidate_vector_store(vector_dir)
         return None
-    embeddings = OpenAIEmbeddings(model=embedding_model)
-    return FAISS.load_local(
-        str(vector_dir), embeddings, allow_dangerous_deserialization=True
-    )
+    key = version + (embedding_model,)
+    _vector_store_cache().discard_where(lambda k: k[0] == key[0] and k != key)
+
+    def _load() -> FAISS:
+        embeddings = get_embeddings(embedding_model)
+        store = FAISS.load_local(
+            str(vector_dir), embeddings, allow_dangerous_deserialization=True
+        )
+        apply_search_params(store.index, read_index_params(vector_dir))
+        return store
+
+    return _vector_store_cache().get_or_load(key, _load)
 
 
 def retrieve_context(vector_dir: Path, query: str, k: int = 5) -> List[Document]:
@@ -117,6 +939,13 @@ def retrieve_context(vector_dir: Path, query: str, k: int = 5) -> List[Document]
     return store.similarity_search(query, k=k)
 
 
+async def aretrieve_context(vector_dir: Path, query: str, k: int = 5) -> List[Document]:
+    store = await asyncio.to_thread(load_vector_store, vector_dir)
+    if store is None:
+        return []
+    return await store.asimilarity_search(query, k=k)
+
+
 # -------------------------
 # LangGraph state & nodes
 # -------------------------
@@ -124,6 +953,7 @@ def retrieve_context(vector_dir: Path, query: str, k: int = 5) -> List[Document]
 class AppState(TypedDict, total=False):
     user_id: str
     dataset_id: str
+    run_id: str  # keys this run's speculative branches
     query: str
     prefer_visual: bool
     has_new_upload: bool
@@ -132,7 +962,9 @@ class AppState(TypedDict, total=False):
     vector_dir: str
 
     # Router outcome
-    intent: str  # "ingest", "analyze", "visualize", or composite like "ingest_then_analyze"
+    intent: str  # "ingest", "analyze", "visualize", "analyze_and_visualize", or composite like "ingest_then_analyze"
+    route_source: str  # "rules", "llm", or "rules_fallback"
+    route_confidence: float
 
     # Intermediate artifacts
     retrieved_text: str
@@ -140,136 +972,1287 @@ class AppState(TypedDict, total=False):
     analysis_plan: Dict[str, Any]
     analysis_table: Dict[str, Any]
     analysis_logs: List[str]
+    ingestion_stats: Dict[str, Any]
     chart_spec: Dict[str, Any]
+    chart_logs: List[str]  # steps that reduced the dataset to the chart's data
+    speculation: Dict[str, Any]  # per-branch used/tokens/seconds from finish_speculation
     final_answer: str
 
 
-def get_llm() -> ChatOpenAI:
-    ensure_openai_key()
-    # Lightweight model suitable for routing/analysis
-    return ChatOpenAI(model="gpt-4o-mini", temperature=0)
+# Lightweight model suitable for routing/analysis
+LLM_MODEL = "gpt-4o-mini"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+# Keep-alive connection pool shared by every OpenAI client in the process
+HTTP_MAX_CONNECTIONS = _get_int_setting("HTTP_MAX_CONNECTIONS", 20)
+
+
+@st.cache_resource(show_spinner=False)
+def _http_client() -> httpx.Client:
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    )
+
+
+# httpcore's async pool checks every idle connection on each request; a small
+# keep-alive set keeps that cheap with many sessions in flight
+ASYNC_KEEPALIVE_CONNECTIONS = 8
+
+
+@st.cache_resource(show_spinner=False)
+def _async_http_client() -> httpx.AsyncClient:
+    """Pool for ``ainvoke``/``aembed_documents``; only used from ``_event_loop``."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=min(HTTP_MAX_CONNECTIONS, ASYNC_KEEPALIVE_CONNECTIONS),
+        ),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """One loop per process, on a daemon thread, running every session's async graph."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="graph-event-loop", daemon=True).start()
+    return loop
+
+
+def run_async(coro: Any) -> Any:
+    """Run ``coro`` on the shared loop, blocking only the calling thread for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+
+@st.cache_resource(show_spinner=False)
+def _chat_client(model: str) -> ChatOpenAI:
+    # stream_usage: streamed completions still report their token counts
+    return ChatOpenAI(
+        model=model,
+        temperature=0,
+        stream_usage=True,
+        http_client=_http_client(),
+        http_async_client=_async_http_client(),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _embeddings_client(model: str) -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(model=model, http_client=_http_client(), http_async_client=_async_http_client())
+
+
+def get_llm() -> ChatOpenAI:
+    ensure_openai_key()
+    return _chat_client(LLM_MODEL)
+
+
+def get_embeddings(model: str = DEFAULT_EMBEDDING_MODEL) -> OpenAIEmbeddings:
+    ensure_openai_key()
+    return _embeddings_client(model)
+
+
+# -------------------------
+# LLM response cache
+# -------------------------
+
+LLM_CACHE_PATH = STORE_DIR / "llm_cache.sqlite3"
+
+
+class _LLMResponseCache:
+    """Deterministic completions keyed by (model, sha256(prompt)).
+
+    Entries expire after ``ttl_seconds``; past ``max_bytes`` of stored text the
+    least recently used are deleted. Hit/miss counters are kept per call site.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: float, max_bytes: int) -> None:
+        self.path = Path(path)
+        self.ttl_seconds = float(ttl_seconds)
+        self.max_bytes = max(0, int(max_bytes))
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._sites: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_bytes > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        if not self._initialized:
+            with self._lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "model TEXT NOT NULL, digest BLOB NOT NULL, site TEXT NOT NULL, content TEXT NOT NULL, "
+                    "size INTEGER NOT NULL, latency REAL NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL, "
+                    "PRIMARY KEY (model, digest))"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def _record(self, site: str, hit: bool, seconds_saved: float = 0.0) -> None:
+        with self._lock:
+            counts = self._sites.setdefault(site, {"hits": 0, "misses": 0, "seconds_saved": 0.0})
+            counts["hits" if hit else "misses"] += 1
+            counts["seconds_saved"] += seconds_saved
+
+    def get(self, model: str, digest: bytes, site: str) -> Optional[str]:
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT content, latency FROM responses WHERE model = ? AND digest = ? AND created >= ?",
+                (model, digest, now - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET last_used = ? WHERE model = ? AND digest = ?", (now, model, digest))
+                conn.commit()
+        finally:
+            conn.close()
+        self._record(site, row is not None, float(row[1]) if row is not None else 0.0)
+        return row[0] if row is not None else None
+
+    def put(self, model: str, digest: bytes, site: str, content: str, latency: float) -> None:
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (model, digest, site, content, size, latency, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (model, digest, site, content, size, latency, now, now),
+            )
+            conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk from the least recently used until the rest fits
+                excess = total - self.max_bytes
+                stale: List[Tuple[str, bytes]] = []
+                for old_model, old_digest, old_size in conn.execute(
+                    "SELECT model, digest, size FROM responses ORDER BY last_used"
+                ).fetchall():
+                    stale.append((old_model, old_digest))
+                    excess -= old_size
+                    if excess <= 0:
+                        break
+                conn.executemany("DELETE FROM responses WHERE model = ? AND digest = ?", stale)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {site: dict(counts) for site, counts in self._sites.items()}
+
+
+@st.cache_resource(show_spinner=False)
+def _llm_response_cache() -> _LLMResponseCache:
+    """Shared by every session; LLM_CACHE_TTL_HOURS = 0 turns caching off."""
+    return _LLMResponseCache(
+        LLM_CACHE_PATH,
+        ttl_seconds=_get_float_setting("LLM_CACHE_TTL_HOURS", 168.0) * 3600,
+        max_bytes=_get_int_setting("LLM_CACHE_MAX_MB", 64) * 1024 * 1024,
+    )
+
+
+def _llm_model_name(llm: Any) -> str:
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__)
+
+
+def _cache_lookup(
+    cache: _LLMResponseCache, llm: Any, prompt: str, site: str
+) -> Tuple[Optional[Tuple[str, bytes]], Optional[str]]:
+    """The cache key and any cached completion; the key is None when the call is not cacheable."""
+    if not cache.enabled or getattr(llm, "temperature", 0) not in (0, None):
+        return None, None
+    key = (_llm_model_name(llm), hashlib.sha256(prompt.encode("utf-8")).digest())
+    try:
+        return key, cache.get(key[0], key[1], site)
+    except sqlite3.Error as exc:
+        logger.warning("LLM cache unavailable: %s", exc)
+        return None, None
+
+
+def _cache_store(cache: _LLMResponseCache, key: Optional[Tuple[str, bytes]], site: str, resp: Any, latency: float) -> None:
+    content = getattr(resp, "content", resp)
+    if key is None or not (isinstance(content, str) and content.strip()):
+        return
+    try:
+        cache.put(key[0], key[1], site, content, latency)
+    except sqlite3.Error as exc:
+        logger.warning("LLM cache unavailable: %s", exc)
+
+
+def cached_invoke(llm: Any, prompt: str, site: str, cache: Optional[_LLMResponseCache] = None) -> Any:
+    """``llm.invoke(prompt)`` through the response cache.
+
+    Only deterministic (temperature 0) clients are cached; any object with an
+    ``invoke`` method works, so a stub LLM can stand in offline.
+    """
+    cache = cache or _llm_response_cache()
+    key, content = _cache_lookup(cache, llm, prompt, site)
+    if content is not None:
+        return AIMessage(content=content)
+    started = time.perf_counter()
+    resp = llm.invoke(prompt)
+    _record_usage(resp, prompt)
+    _cache_store(cache, key, site, resp, time.perf_counter() - started)
+    return resp
+
+
+async def acached_invoke(llm: Any, prompt: str, site: str, cache: Optional[_LLMResponseCache] = None) -> Any:
+    """``cached_invoke`` awaiting ``llm.ainvoke``; SQLite lookups run on a worker thread.
+
+    A stub without ``ainvoke`` has its ``invoke`` run on a worker thread instead.
+    """
+    cache = cache or _llm_response_cache()
+    key, content = await asyncio.to_thread(_cache_lookup, cache, llm, prompt, site)
+    if content is not None:
+        return AIMessage(content=content)
+    started = time.perf_counter()
+    if hasattr(llm, "ainvoke"):
+        resp = await llm.ainvoke(prompt)
+    else:
+        resp = await asyncio.to_thread(llm.invoke, prompt)
+    _record_usage(resp, prompt)
+    await asyncio.to_thread(_cache_store, cache, key, site, resp, time.perf_counter() - started)
+    return resp
+
+
+def cached_stream(
+    llm: Any, prompt: str, site: str, on_token: Callable[[str], None], cache: Optional[_LLMResponseCache] = None
+) -> Any:
+    """``cached_invoke`` that hands the completion to ``on_token`` as it is generated.
+
+    A cached completion arrives as one piece; a client without ``stream`` is invoked whole.
+    """
+    if not hasattr(llm, "stream"):
+        resp = cached_invoke(llm, prompt, site, cache)
+        on_token(str(getattr(resp, "content", resp)))
+        return resp
+    cache = cache or _llm_response_cache()
+    key, content = _cache_lookup(cache, llm, prompt, site)
+    if content is not None:
+        on_token(content)
+        return AIMessage(content=content)
+    started = time.perf_counter()
+    resp = None
+    for chunk in llm.stream(prompt):
+        # Chunks add up to the full message, usage included
+        resp = chunk if resp is None else resp + chunk
+        if chunk.content:
+            on_token(str(chunk.content))
+    resp = resp if resp is not None else AIMessage(content="")
+    _record_usage(resp, prompt)
+    _cache_store(cache, key, site, resp, time.perf_counter() - started)
+    return resp
+
+
+async def acached_stream(
+    llm: Any, prompt: str, site: str, on_token: Callable[[str], None], cache: Optional[_LLMResponseCache] = None
+) -> Any:
+    """``cached_stream`` iterating ``llm.astream``."""
+    if not hasattr(llm, "astream"):
+        resp = await acached_invoke(llm, prompt, site, cache)
+        on_token(str(getattr(resp, "content", resp)))
+        return resp
+    cache = cache or _llm_response_cache()
+    key, content = await asyncio.to_thread(_cache_lookup, cache, llm, prompt, site)
+    if content is not None:
+        on_token(content)
+        return AIMessage(content=content)
+    started = time.perf_counter()
+    resp = None
+    async for chunk in llm.astream(prompt):
+        resp = chunk if resp is None else resp + chunk
+        if chunk.content:
+            on_token(str(chunk.content))
+    resp = resp if resp is not None else AIMessage(content="")
+    _record_usage(resp, prompt)
+    await asyncio.to_thread(_cache_store, cache, key, site, resp, time.perf_counter() - started)
+    return resp
+
+
+def llm_cache_stats() -> Dict[str, Dict[str, float]]:
+    return _llm_response_cache().stats()
+
+
+# -------------------------
+# Semantic plan cache
+# -------------------------
+
+SEMANTIC_PLAN_CACHE_PATH = STORE_DIR / "plan_cache.sqlite3"
+# Cosine similarity between two questions above which a stored plan is reused
+SEMANTIC_PLAN_THRESHOLD = _get_float_setting("SEMANTIC_PLAN_THRESHOLD", 0.92)
+# Stored questions per schema; the oldest are dropped first
+SEMANTIC_PLAN_MAX_QUERIES = _get_int_setting("SEMANTIC_PLAN_MAX_QUERIES", 500)
+
+
+def schema_fingerprint(df: pd.DataFrame, embedding_model: str = DEFAULT_EMBEDDING_MODEL) -> str:
+    """Column names and dtypes, plus the model whose vectors index the schema's questions."""
+    columns = [[str(c), str(t)] for c, t in df.dtypes.items()]
+    return hashlib.sha256(json.dumps([embedding_model, columns]).encode("utf-8")).hexdigest()
+
+
+def _reference_count(value: Any) -> int:
+    return len(value) if isinstance(value, (list, tuple, dict)) else int(bool(value))
+
+
+def _plan_fits_columns(plan: Dict[str, Any], columns: List[str]) -> bool:
+    """True when every column a plan names still resolves against ``columns``."""
+    schema: Optional[List[str]] = [str(c) for c in columns]
+    for step in plan.get("steps") or []:
+        if schema is None:
+            # Past a pivot the columns depend on the data; the interpreter checks them
+            return True
+        if not isinstance(step, dict):
+            return False
+        resolved, schema = _resolve_step(step, schema)
+        if resolved is None:
+            return False
+        for key in ("conditions", "columns", "by", "aggregations", "types", "mapping", "partition_by", "column"):
+            if _reference_count(resolved.get(key)) < _reference_count(step.get(key)):
+                return False
+        for side in ("left", "right"):
+            if (step.get(side) or {}).get("column") and not (resolved.get(side) or {}).get("column"):
+                return False
+    return True
+
+
+# Quoted strings and numbers, the literals a plan's filter values and k come from
+_QUESTION_LITERAL_PATTERN = re.compile(r'"[^"]*"|(?<!\w)\'[^\']*\'(?!\w)|\d+(?:[.,:/-]\d+)*|[a-z]+', re.I)
+_NUMBER_WORDS = {
+    word: str(value)
+    for value, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve".split()
+    )
+}
+# Words that set a sort direction; "top 5" and "bottom 5" embed almost identically
+_DIRECTION_WORDS = {
+    **dict.fromkeys(("top", "highest", "largest", "biggest", "most", "max", "maximum", "best", "desc", "descending"), "high"),
+    **dict.fromkeys(("bottom", "lowest", "smallest", "fewest", "least", "min", "minimum", "worst", "asc", "ascending"), "low"),
+}
+
+
+def question_literals(query: str) -> Tuple[str, ...]:
+    """The numbers, quoted strings and direction words of a question, in a comparable form.
+
+    Paraphrases share these; questions that differ only in them ("top 5" vs
+    "top 10", "2022" vs "2023", "highest" vs "lowest") need different plans.
+    """
+    found = []
+    for token in _QUESTION_LITERAL_PATTERN.findall(query):
+        lowered = token.lower()
+        if lowered[0] in "\"'":
+            found.append("q:" + lowered[1:-1].strip())
+        elif lowered[0].isdigit():
+            found.append("n:" + lowered.replace(",", ""))
+        elif lowered in _NUMBER_WORDS:
+            found.append("n:" + _NUMBER_WORDS[lowered])
+        elif lowered in _DIRECTION_WORDS:
+            found.append("d:" + _DIRECTION_WORDS[lowered])
+    return tuple(sorted(found))
+
+
+def _plan_filter_texts(plan: Dict[str, Any]) -> List[str]:
+    """The text values a plan's filter conditions compare against."""
+    texts = []
+    for step in plan.get("steps") or []:
+        for cond in step.get("conditions") or []:
+            if not isinstance(cond, dict):
+                continue
+            values = cond.get("values")
+            for value in (values if isinstance(values, list) else []) + [cond.get("value")]:
+                if isinstance(value, str) and value.strip() and _as_number(value) is value:
+                    texts.append(value.strip())
+    return texts
+
+
+def plan_values_in_question(plan: Dict[str, Any], query: str) -> bool:
+    """Whether every text filter value of ``plan`` appears in ``query``.
+
+    Unquoted category names ("Europe" vs "Asia") are not among the
+    ``question_literals``, yet a plan filtering on one answers the other wrongly.
+    """
+    lowered = query.lower()
+    return all(
+        re.search(r"(?<!\w)" + re.escape(text.lower()) + r"(?!\w)", lowered) for text in _plan_filter_texts(plan)
+    )
+
+
+class _SemanticPlanCache:
+    """Past (question -> plan) pairs searched by question embedding.
+
+    Pairs are stored in SQLite per schema fingerprint and loaded on first use
+    into an exact inner-product FAISS index over normalized vectors. A stored
+    plan is only reused for a question with the same ``question_literals``
+    that also names each of the plan's text filter values.
+    """
+
+    # Nearest stored questions checked for one with matching literals
+    candidates = 8
+
+    def __init__(self, path: Path, threshold: float, max_entries: int) -> None:
+        self.path = Path(path)
+        self.threshold = float(threshold)
+        self.max_entries = max(0, int(max_entries))
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, Tuple[Any, List[Tuple[str, Dict[str, Any], Tuple[str, ...]]]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.mismatched = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold <= 1.0 and self.max_entries > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        if not self._initialized:
+            with self._lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS plans ("
+                    "fingerprint TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, plan TEXT NOT NULL, "
+                    "created REAL NOT NULL, PRIMARY KEY (fingerprint, query))"
+                )
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def _index(self, fingerprint: str) -> Tuple[Any, List[Tuple[str, Dict[str, Any], Tuple[str, ...]]]]:
+        with self._lock:
+            if fingerprint in self._indexes:
+                return self._indexes[fingerprint]
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT query, vector, plan FROM plans WHERE fingerprint = ? ORDER BY created DESC LIMIT ?",
+                (fingerprint, self.max_entries),
+            ).fetchall()
+        finally:
+            conn.close()
+        entries = [(query, json.loads(plan), question_literals(query)) for query, _, plan in rows]
+        index = None
+        if rows:
+            vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in rows])
+            index = faiss.IndexFlatIP(vectors.shape[1])
+            index.add(vectors)
+        with self._lock:
+            self._indexes[fingerprint] = (index, entries)
+        return index, entries
+
+    def lookup(
+        self, fingerprint: str, vector: np.ndarray, columns: List[str], query: str
+    ) -> Optional[Tuple[Dict[str, Any], float, str]]:
+        """The stored plan of the closest question above the threshold with the same
+        literals as ``query`` and whose filter values it names, if it fits ``columns``."""
+        index, entries = self._index(fingerprint)
+        literals = question_literals(query)
+        stale = mismatched = False
+        if index is not None and index.d == vector.shape[0]:
+            scores, ids = index.search(vector.reshape(1, -1), min(self.candidates, len(entries)))
+            for score, idx in zip(scores[0].tolist(), ids[0].tolist()):
+                if idx < 0 or score < self.threshold:
+                    break
+                matched, plan, matched_literals = entries[idx]
+                if matched_literals != literals or not plan_values_in_question(plan, query):
+                    mismatched = True
+                elif not _plan_fits_columns(plan, columns):
+                    stale = True
+                else:
+                    with self._lock:
+                        self.hits += 1
+                    return plan, float(score), matched
+        with self._lock:
+            self.rejected += int(stale)
+            self.mismatched += int(mismatched)
+            self.misses += 1
+        return None
+
+    def add(self, fingerprint: str, query: str, vector: np.ndarray, plan: Dict[str, Any]) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO plans (fingerprint, query, vector, plan, created) VALUES (?, ?, ?, ?, ?)",
+                (fingerprint, query, vector.astype(np.float32).tobytes(), json.dumps(plan), time.time()),
+            )
+            conn.execute(
+                "DELETE FROM plans WHERE fingerprint = ? AND query NOT IN "
+                "(SELECT query FROM plans WHERE fingerprint = ? ORDER BY created DESC LIMIT ?)",
+                (fingerprint, fingerprint, self.max_entries),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            # Rebuilt from SQLite on the next lookup
+            self._indexes.pop(fingerprint, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "rejected": self.rejected, "mismatched": self.mismatched}
+
+
+@st.cache_resource(show_spinner=False)
+def _semantic_plan_cache() -> _SemanticPlanCache:
+    return _SemanticPlanCache(SEMANTIC_PLAN_CACHE_PATH, SEMANTIC_PLAN_THRESHOLD, SEMANTIC_PLAN_MAX_QUERIES)
+
+
+def semantic_plan_cache_stats() -> Dict[str, int]:
+    return _semantic_plan_cache().stats()
+
+
+def _unit(vector: List[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else array
+
+
+def _query_vector(query: str, embeddings: Any, model: str) -> np.ndarray:
+    return _unit(_CachedEmbedder(embeddings, model).embed_documents([query.strip()])[0])
+
+
+async def _aquery_vector(query: str, embeddings: Any, model: str) -> np.ndarray:
+    return _unit((await _CachedEmbedder(embeddings, model).aembed_documents([query.strip()]))[0])
+
+
+def _plan_cache_hit(hit: Tuple[Dict[str, Any], float, str]) -> Tuple[Dict[str, Any], None, List[str]]:
+    plan, score, matched = hit
+    return plan, None, [f"semantic plan cache hit: similarity {score:.3f} to {matched[:120]!r}"]
+
+
+def plan_for_query(
+    llm: Any,
+    preview: pd.DataFrame,
+    query: str,
+    embeddings: Any = None,
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+    cache: Optional[_SemanticPlanCache] = None,
+) -> Tuple[Dict[str, Any], Optional[Callable[[], None]], List[str]]:
+    """An analysis plan for ``query``, reused from a paraphrase when one is close enough.
+
+    Returns the plan, a callback that stores a freshly generated plan (call it
+    once the plan has run), and log lines describing a cache hit.
+    """
+    cache = cache or _semantic_plan_cache()
+    vector: Optional[np.ndarray] = None
+    fingerprint = schema_fingerprint(preview, embedding_model)
+    columns = [str(c) for c in preview.columns]
+    if cache.enabled and query.strip():
+        try:
+            vector = _query_vector(query, embeddings if embeddings is not None else get_embeddings(embedding_model), embedding_model)
+            hit = cache.lookup(fingerprint, vector, columns, query)
+        except Exception as exc:
+            logger.warning("semantic plan cache unavailable: %s", exc)
+            hit = None
+        if hit is not None:
+            return _plan_cache_hit(hit)
+    plan = _generate_analysis_plan(llm, preview, query)
+    if vector is None or not (isinstance(plan, dict) and plan.get("steps")):
+        return plan, None, []
+    return plan, (lambda: cache.add(fingerprint, query.strip(), vector, plan)), []
+
+
+async def aplan_for_query(
+    llm: Any,
+    preview: pd.DataFrame,
+    query: str,
+    embeddings: Any = None,
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+    cache: Optional[_SemanticPlanCache] = None,
+) -> Tuple[Dict[str, Any], Optional[Callable[[], None]], List[str]]:
+    """``plan_for_query`` awaiting the embedding and planner calls."""
+    cache = cache or _semantic_plan_cache()
+    vector: Optional[np.ndarray] = None
+    fingerprint = schema_fingerprint(preview, embedding_model)
+    columns = [str(c) for c in preview.columns]
+    if cache.enabled and query.strip():
+        try:
+            vector = await _aquery_vector(query, embeddings if embeddings is not None else get_embeddings(embedding_model), embedding_model)
+            hit = await asyncio.to_thread(cache.lookup, fingerprint, vector, columns, query)
+        except Exception as exc:
+            logger.warning("semantic plan cache unavailable: %s", exc)
+            hit = None
+        if hit is not None:
+            return _plan_cache_hit(hit)
+    plan = await _agenerate_analysis_plan(llm, preview, query)
+    if vector is None or not (isinstance(plan, dict) and plan.get("steps")):
+        return plan, None, []
+    return plan, (lambda: cache.add(fingerprint, query.strip(), vector, plan)), []
+
+
+# -------------------------
+# Streaming output
+# -------------------------
+
+# Seconds the page waits on a run's event queue before checking whether the run has finished
+STREAM_POLL_SECONDS = 0.05
+
+
+@st.cache_resource(show_spinner=False)
+def _output_streams() -> Dict[str, queue.Queue]:
+    """Event queues of runs whose page renders output as it is produced, by run id."""
+    return {}
+
+
+_STREAM_LOCK = threading.Lock()
+
+
+@st.cache_resource(show_spinner=False)
+def _run_pool() -> ThreadPoolExecutor:
+    """Runs blocking graph invocations while the script thread renders their output."""
+    return ThreadPoolExecutor(max_workers=HTTP_MAX_CONNECTIONS, thread_name_prefix="graph-run")
+
+
+def open_output_stream(run_id: str) -> queue.Queue:
+    stream: queue.Queue = queue.Queue()
+    with _STREAM_LOCK:
+        _output_streams()[str(run_id)] = stream
+    return stream
+
+
+def close_output_stream(run_id: Optional[str]) -> None:
+    with _STREAM_LOCK:
+        _output_streams().pop(str(run_id), None)
+
+
+def emit(state: AppState, kind: str, payload: Any) -> None:
+    """Send ``(kind, payload)`` to the page rendering ``state``'s run, if one is listening.
+
+    Nodes emit "table" and "chart" as soon as those are computed and "token"
+    for each piece of answer text.
+    """
+    with _STREAM_LOCK:
+        stream = _output_streams().get(str(state.get("run_id")))
+    if stream is not None:
+        stream.put((kind, payload))
+
+
+def _token_sink(state: AppState) -> Optional[Callable[[str], None]]:
+    """Passes answer tokens to the run's page; None when nobody is listening, so calls need not stream."""
+    with _STREAM_LOCK:
+        listening = str(state.get("run_id")) in _output_streams()
+    return (lambda token: emit(state, "token", token)) if listening else None
+
+
+def stream_run_output(
+    stream: queue.Queue,
+    finished: Callable[[], bool],
+    on_event: Callable[[str, Any], None],
+    timings: Dict[str, float],
+    started: float,
+) -> Iterator[str]:
+    """Yield a run's answer tokens until it finishes, passing other events to ``on_event``.
+
+    ``timings`` gets the seconds from ``started`` to the first event of any kind
+    ("first_output") and to the first answer token ("first_token").
+    """
+    while True:
+        try:
+            kind, payload = stream.get(timeout=STREAM_POLL_SECONDS)
+        except queue.Empty:
+            # Nothing is emitted after the run finishes, so an empty queue then is the end
+            if finished() and stream.empty():
+                return
+            continue
+        timings.setdefault("first_output", time.perf_counter() - started)
+        if kind == "token":
+            timings.setdefault("first_token", time.perf_counter() - started)
+            yield str(payload)
+        else:
+            on_event(kind, payload)
+
+
+class _FinalAnswerStreamer(BaseCallbackHandler):
+    """Passes on what a ReAct agent writes after "Final Answer:" as it is generated."""
+
+    marker = "Final Answer:"
+
+    def __init__(self, on_token: Callable[[str], None]) -> None:
+        self.on_token = on_token
+        self._text = ""
+        self._answering = False
+
+    def on_llm_start(self, *args: Any, **kwargs: Any) -> None:
+        # Each agent step is a new completion; earlier thoughts are not the answer
+        self._text = ""
+        self._answering = False
+
+    def on_chat_model_start(self, *args: Any, **kwargs: Any) -> None:
+        self.on_llm_start()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self._answering:
+            self.on_token(token)
+            return
+        self._text += token
+        at = self._text.find(self.marker)
+        if at >= 0:
+            self._answering = True
+            rest = self._text[at + len(self.marker):].lstrip()
+            if rest:
+                self.on_token(rest)
+
+
+# -------------------------
+# Parallel branches
+# -------------------------
+
+
+@st.cache_resource(show_spinner=False)
+def _run_results() -> Dict[Tuple[str, str], Future]:
+    """Values computed once per run and shared by its parallel branches, by (run id, name)."""
+    return {}
+
+
+_RUN_RESULTS_LOCK = threading.Lock()
+
+
+def _claim_run_result(state: AppState, name: str) -> Tuple[Optional[Future], bool]:
+    """The run's future for ``name`` and whether the caller must compute it."""
+    run_id = state.get("run_id")
+    if not run_id:
+        return None, True
+    with _RUN_RESULTS_LOCK:
+        results = _run_results()
+        future = results.get((str(run_id), name))
+        if future is not None:
+            return future, False
+        future = results[(str(run_id), name)] = Future()
+        return future, True
+
+
+def shared_run_result(state: AppState, name: str, compute: Callable[[], Any]) -> Any:
+    """``compute()`` once per run; a parallel branch asking for the same ``name`` gets the first one's result."""
+    future, owner = _claim_run_result(state, name)
+    if not owner:
+        return future.result()  # type: ignore[union-attr]
+    try:
+        value = compute()
+    except BaseException as exc:
+        if future is not None:
+            future.set_exception(exc)
+        raise
+    if future is not None:
+        future.set_result(value)
+    return value
+
+
+async def ashared_run_result(state: AppState, name: str, make: Callable[[], Any]) -> Any:
+    """``shared_run_result`` where ``make`` returns a coroutine; waiting branches await it."""
+    future, owner = _claim_run_result(state, name)
+    if not owner:
+        return await asyncio.wrap_future(future)  # type: ignore[arg-type]
+    try:
+        value = await make()
+    except BaseException as exc:
+        if future is not None:
+            future.set_exception(exc)
+        raise
+    if future is not None:
+        future.set_result(value)
+    return value
+
+
+def release_run_results(run_id: Optional[str]) -> None:
+    with _RUN_RESULTS_LOCK:
+        results = _run_results()
+        for key in [key for key in results if key[0] == str(run_id)]:
+            del results[key]
+
+
+def _branch_update(state: AppState, keys: Tuple[str, ...]) -> AppState:
+    """Only the state keys a branch wrote: LangGraph rejects two writes to one key in the same step."""
+    return {key: state[key] for key in keys if key in state}  # type: ignore[literal-required,misc]
+
+
+# -------------------------
+# Speculative execution
+# -------------------------
+
+# Start retrieval and analysis planning alongside the router; 0 runs them after routing
+SPECULATIVE_EXECUTION = _get_int_setting("SPECULATIVE_EXECUTION", 1)
+# LLM tokens used by the calls made in the current thread or task, when a branch is metering them
+_token_meter: ContextVar[Optional[List[int]]] = ContextVar("token_meter", default=None)
+
+
+def _record_usage(resp: Any, prompt: str) -> None:
+    tokens = _token_meter.get()
+    if tokens is None:
+        return
+    usage = getattr(resp, "usage_metadata", None) or {}
+    if usage.get("total_tokens"):
+        tokens[0] += int(usage["total_tokens"])
+    else:
+        # No usage reported (e.g. a stub model): about four characters per token
+        tokens[0] += (len(prompt) + len(str(getattr(resp, "content", resp)))) // 4
+
+
+class _Speculation:
+    """Branches started for one graph run before its intent is known."""
+
+    def __init__(self) -> None:
+        self.futures: Dict[str, Any] = {}
+        self.tokens: Dict[str, List[int]] = {}
+        self.seconds: Dict[str, float] = {}
+        self.used: set = set()
+
+    def submit(self, pool: ThreadPoolExecutor, name: str, fn: Callable[[], Any]) -> None:
+        tokens = self.tokens[name] = [0]
+
+        def run() -> Any:
+            started = time.perf_counter()
+            token = _token_meter.set(tokens)
+            try:
+                return fn()
+            finally:
+                _token_meter.reset(token)
+                self.seconds[name] = time.perf_counter() - started
+
+        self.futures[name] = pool.submit(run)
+
+    def submit_coroutine(self, name: str, make: Callable[[], Any]) -> None:
+        """Like ``submit`` for a coroutine, run as a task on the shared event loop."""
+        tokens = self.tokens[name] = [0]
+
+        async def run() -> Any:
+            started = time.perf_counter()
+            # Tasks get their own context, so this stays local to the branch
+            _token_meter.set(tokens)
+            try:
+                return await make()
+            finally:
+                self.seconds[name] = time.perf_counter() - started
+
+        self.futures[name] = asyncio.run_coroutine_threadsafe(run(), _event_loop())
+
+
+@st.cache_resource(show_spinner=False)
+def _speculation_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=HTTP_MAX_CONNECTIONS, thread_name_prefix="speculate")
+
+
+@st.cache_resource(show_spinner=False)
+def _speculation_registry() -> Dict[str, _Speculation]:
+    """In-flight speculations by run id; graph state only carries the id."""
+    return {}
+
+
+@st.cache_resource(show_spinner=False)
+def speculation_stats() -> Dict[str, Dict[str, int]]:
+    """Process-wide per-branch totals: launched, used, and tokens spent on discarded results."""
+    return {}
+
+
+_SPECULATION_LOCK = threading.Lock()
+
+
+def start_speculation(state: AppState, asynchronous: bool = False) -> bool:
+    """Begin the analysis branches for ``state``'s run while the router decides.
+
+    ``asynchronous`` runs them as tasks on the shared event loop instead of the pool.
+    """
+    run_id = state.get("run_id")
+    if not (SPECULATIVE_EXECUTION and run_id) or state.get("has_new_upload"):
+        # A new upload is re-indexed first, so nothing downstream can start yet
+        return False
+    data_path = Path(state["data_path"])  # type: ignore[index]
+    vector_dir = Path(state["vector_dir"])  # type: ignore[index]
+    query = state.get("query", "")
+    k = int(state.get("top_k", 5))
+    speculation = _Speculation()
+    if asynchronous:
+        speculation.submit_coroutine("retrieval", lambda: aretrieve_context(vector_dir, query, k=k))
+        speculation.submit_coroutine("plan", lambda: _aplan_from_preview(get_llm(), data_path, query))
+    else:
+        pool = _speculation_pool()
+        speculation.submit(pool, "retrieval", lambda: retrieve_context(vector_dir, query, k=k))
+        speculation.submit(pool, "plan", lambda: plan_for_query(get_llm(), dataset_preview(data_path), query))
+    with _SPECULATION_LOCK:
+        _speculation_registry()[str(run_id)] = speculation
+    return True
+
+
+def speculative_result(state: AppState, name: str, compute: Callable[[], Any]) -> Any:
+    """The speculated ``name`` branch of this run if one was started, else ``compute()``."""
+    with _SPECULATION_LOCK:
+        speculation = _speculation_registry().get(str(state.get("run_id")))
+    if speculation is None or name not in speculation.futures:
+        return compute()
+    speculation.used.add(name)
+    return speculation.futures[name].result()
+
+
+async def aspeculative_result(state: AppState, name: str, compute: Callable[[], Any]) -> Any:
+    """``speculative_result`` awaiting the branch; ``compute`` returns a coroutine."""
+    with _SPECULATION_LOCK:
+        speculation = _speculation_registry().get(str(state.get("run_id")))
+    if speculation is None or name not in speculation.futures:
+        return await compute()
+    speculation.used.add(name)
+    return await asyncio.wrap_future(speculation.futures[name])
+
+
+def finish_speculation(run_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Drop a run's speculation and account for branches whose results went unused.
+
+    Returns ``{branch: {"used", "tokens", "seconds"}}``; unused branches still
+    running are left to finish and are counted when they do.
+    """
+    with _SPECULATION_LOCK:
+        speculation = _speculation_registry().pop(str(run_id), None)
+    if speculation is None:
+        return {}
+    totals = speculation_stats()
+    report: Dict[str, Dict[str, Any]] = {}
+    for name, future in speculation.futures.items():
+        used = name in speculation.used
+        with _SPECULATION_LOCK:
+            branch = totals.setdefault(name, {"launched": 0, "used": 0, "wasted_tokens": 0})
+            branch["launched"] += 1
+            branch["used"] += int(used)
+        if not used and future.cancel():
+            # Coroutine branches can be cancelled mid-flight; what they spent is lost
+            with _SPECULATION_LOCK:
+                branch["wasted_tokens"] += speculation.tokens[name][0]
+        elif not used:
+
+            def waste(_future: Any, tokens: List[int] = speculation.tokens[name], branch: Dict[str, int] = branch) -> None:
+                with _SPECULATION_LOCK:
+                    branch["wasted_tokens"] += tokens[0]
+
+            future.add_done_callback(waste)
+        report[name] = {
+            "used": used,
+            "tokens": speculation.tokens[name][0] if future.done() else None,
+            "seconds": speculation.seconds.get(name),
+        }
+    return report
+
+
+# Rule-based routing; the LLM is only consulted below this confidence
+ROUTER_CONFIDENCE_THRESHOLD = _get_float_setting("ROUTER_CONFIDENCE_THRESHOLD", 0.8)
+# Whole words only: "pieces", "chartered", "drawdown" or "graphics" are not chart asks
+_CHART_PATTERN = re.compile(
+    r"\b(?:(?:plot|chart|graph)(?:s|ed|ing|ted|ting)?"
+    r"|visuali[sz](?:e|es|ed|ing|ation|ations)"
+    r"|(?:histogram|scatter|scatter ?plot|heat ?map|pie ?chart|bar ?chart|line ?chart|diagram)s?"
+    r"|draw (?:a|an|the|me))\b",
+    re.I,
+)
+_WEAK_CHART_PATTERN = re.compile(r"\b(show|display|trend|over time)\b", re.I)
+_ANALYSIS_PATTERN = re.compile(
+    r"\b(how many|how much|top|bottom|highest|lowest|average|avg|mean|sum|total|count|"
+    r"median|max|min|compare|rank|percent|percentage|ratio|share|distinct|unique|filter)\b",
+    re.I,
+)
+# Start almost any question, so alone they only lean toward analysis
+_QUESTION_PATTERN = re.compile(r"\b(what|which|who|list|where)\b", re.I)
+
+
+def _classify_intent_rules(query: str, has_new_upload: bool, prefer_visual: bool) -> Tuple[str, float]:
+    """Keyword/upload-state intent with a confidence score in [0, 1]."""
+    query = query.strip()
+    if has_new_upload and not query:
+        return "ingest", 1.0
+    chart = bool(_CHART_PATTERN.search(query))
+    analysis = bool(_ANALYSIS_PATTERN.search(query))
+    if chart and analysis:
+        # "Plot the top 5 ..." wants the computed table as well as the chart
+        follow, confidence = "analyze_and_visualize", 0.9
+    elif chart:
+        follow, confidence = "visualize", 0.95
+    elif prefer_visual:
+        follow, confidence = ("analyze_and_visualize", 0.85) if analysis else ("visualize", 0.85)
+    elif _WEAK_CHART_PATTERN.search(query):
+        # "show"/"trend" read either way; let the LLM decide unless the ask is clearly analytical
+        follow, confidence = "analyze", 0.7 if analysis else 0.5
+    elif analysis:
+        follow, confidence = "analyze", 0.9
+    elif _QUESTION_PATTERN.search(query):
+        follow, confidence = "analyze", 0.6
+    else:
+        follow, confidence = "analyze", 0.5
+    if not query:
+        return "analyze", 0.5
+    return (f"ingest_then_{follow}" if has_new_upload else follow), confidence
+
+
+def _rule_route(state: AppState, asynchronous: bool = False) -> Tuple[str, float, Optional[str]]:
+    """Rule-based intent and confidence, plus the LLM prompt when the rules are unsure."""
+    query = state.get("query", "").strip()
+    has_new_upload = bool(state.get("has_new_upload"))
+    prefer_visual = bool(state.get("prefer_visual"))
+
+    intent, confidence = _classify_intent_rules(query, has_new_upload, prefer_visual)
+    if confidence < ROUTER_CONFIDENCE_THRESHOLD or intent in ("analyze", "analyze_and_visualize"):
+        # Overlaps the router's LLM call; discarded if it routes elsewhere
+        start_speculation(state, asynchronous)
+    if confidence >= ROUTER_CONFIDENCE_THRESHOLD:
+        return intent, confidence, None
+    classification_prompt = (
+        "You are a router. Classify the user's intent for data tasks.\n"
+        "Return one of: ingest, analyze, visualize, analyze_and_visualize, ingest_then_analyze,\n"
+        "ingest_then_visualize, ingest_then_analyze_and_visualize.\n"
+        "Rules: If a new file was uploaded, prefer ingest_then_* if a query exists, else ingest.\n"
+        "If the query asks for plots/charts/visualization or the UI prefers visualization, choose visualize.\n"
+        "If it also asks for computed figures (totals, rankings, comparisons), choose analyze_and_visualize.\n"
+        f"Query: {query!r}. PreferVisual: {prefer_visual}. HasNewUpload: {has_new_upload}."
+    )
+    return intent, confidence, classification_prompt
+
+
+def _intent_from_completion(completion: Any, intent: str) -> Tuple[str, str]:
+    intent_raw = str(getattr(completion, "content", "")).lower()
+    for candidate in [
+        "ingest_then_analyze_and_visualize",
+        "analyze_and_visualize",
+        "ingest_then_visualize",
+        "ingest_then_analyze",
+        "ingest",
+        "visualize",
+        "analyze",
+    ]:
+        if candidate in intent_raw:
+            return candidate, "llm"
+    # Free-form LLM text: keep the rule-based intent
+    return intent, "rules_fallback"
+
+
+def _set_route(state: AppState, intent: str, source: str, confidence: float) -> AppState:
+    logger.info(
+        "route intent=%s source=%s confidence=%.2f query=%r", intent, source, confidence, state.get("query", "").strip()[:200]
+    )
+    state["intent"] = intent
+    state["route_source"] = source
+    state["route_confidence"] = confidence
+    return state
+
+
+def router_node(state: AppState) -> AppState:
+    """Route the query to an intent: rules first, the LLM only when they are unsure."""
+    intent, confidence, classification_prompt = _rule_route(state)
+    source = "rules"
+    if classification_prompt is not None:
+        try:
+            completion = cached_invoke(get_llm(), classification_prompt, "router")
+            intent, source = _intent_from_completion(completion, intent)
+        except Exception:
+            # Robust fallback
+            source = "rules_fallback"
+    return _set_route(state, intent, source, confidence)
+
+
+async def arouter_node(state: AppState) -> AppState:
+    """``router_node`` awaiting the classification call; speculation runs on the event loop."""
+    intent, confidence, classification_prompt = _rule_route(state, asynchronous=True)
+    source = "rules"
+    if classification_prompt is not None:
+        try:
+            completion = await acached_invoke(get_llm(), classification_prompt, "router")
+            intent, source = _intent_from_completion(completion, intent)
+        except Exception:
+            # Robust fallback
+            source = "rules_fallback"
+    return _set_route(state, intent, source, confidence)
+
+
+def _ingest(state: AppState, embed_async: bool = False) -> AppState:
+    data_path = Path(state["data_path"])  # type: ignore[index]
+    vector_dir = Path(state["vector_dir"])  # type: ignore[index]
+
+    # Stream the stored dataset into the vector store, reusing a parsed frame if one is cached
+    cached = cached_dataset(data_path)
+    # Type inference happens once here and is persisted for every later query
+    dataset_coercion_schema(data_path, cached)
+    state["ingestion_stats"] = build_vector_store(
+        cached if cached is not None else data_path, vector_dir, max_rows=INGEST_MAX_ROWS, embed_async=embed_async
+    )
+    # Remember which upload the index reflects so reruns skip re-ingestion
+    _write_indexed_fingerprint(vector_dir, read_dataset_meta(data_path).get("fingerprint"))
+
+    # Decide next step (used by conditional edge)
+    return state
+
+
+def ingestion_agent(state: AppState) -> AppState:
+    return _ingest(state)
+
+
+@st.cache_resource(show_spinner=False)
+def _ingest_pool() -> ThreadPoolExecutor:
+    """Runs ``_ingest`` for the async graph.
+
+    ``_ingest`` blocks on embedding coroutines that themselves need the loop's
+    default executor (cache lookups, tokenization), so it must not occupy a
+    default-executor thread: enough concurrent ingestions would fill it and
+    wait on each other forever.
+    """
+    return ThreadPoolExecutor(max_workers=HTTP_MAX_CONNECTIONS, thread_name_prefix="ingest")
+
+
+async def aingestion_agent(state: AppState) -> AppState:
+    """Parsing and FAISS inserts run on ``_ingest_pool``; embedding requests are awaited on the loop."""
+    return await asyncio.get_running_loop().run_in_executor(_ingest_pool(), _ingest, state, True)
+
+
+# State keys written by the analysis and visualization branches
+ANALYSIS_OUTPUTS = ("retrieved_text", "analysis_answer", "analysis_plan", "analysis_table", "analysis_logs")
+VISUALIZATION_OUTPUTS = ("chart_spec", "chart_logs")
+
+
+def _plan_result(
+    state: AppState, llm: ChatOpenAI, data_path: Path, query: str
+) -> Optional[Tuple[Dict[str, Any], pd.DataFrame, List[str]]]:
+    """The run's analysis plan, its result and logs; None when the planner gave no steps."""
+    plan, remember_plan, plan_logs = speculative_result(
+        state, "plan", lambda: plan_for_query(llm, dataset_preview(data_path), query)
+    )
+    if not (plan and isinstance(plan, dict) and plan.get("steps")):
+        return None
+    result_df, logs = execute_plan_lazily(data_path, plan)
+    if remember_plan is not None:
+        remember_plan()
+    return plan, result_df, plan_logs + logs
+
+
+async def _aplan_result(
+    state: AppState, llm: ChatOpenAI, data_path: Path, query: str
+) -> Optional[Tuple[Dict[str, Any], pd.DataFrame, List[str]]]:
+    plan, remember_plan, plan_logs = await aspeculative_result(
+        state, "plan", lambda: _aplan_from_preview(llm, data_path, query)
+    )
+    if not (plan and isinstance(plan, dict) and plan.get("steps")):
+        return None
+    result_df, logs = await asyncio.to_thread(execute_plan_lazily, data_path, plan)
+    if remember_plan is not None:
+        await asyncio.to_thread(remember_plan)
+    return plan, result_df, plan_logs + logs
+
+
+def _store_analysis(state: AppState, plan: Dict[str, Any], result_df: pd.DataFrame, logs: List[str]) -> AppState:
+    # Store plan and a compact table for UI display
+    state["analysis_plan"] = plan
+    table_cols = [str(c) for c in result_df.columns.tolist()]
+    table_rows = result_df.head(500).to_dict(orient="records")
+    state["analysis_table"] = {"columns": table_cols, "rows": table_rows}
+    state["analysis_logs"] = logs
+    # The page can show the table while the summary is still being written
+    emit(state, "table", state["analysis_table"])
+    return state
+
+
+def _pandas_agent_answer(
+    llm: ChatOpenAI, data_path: Path, query: str, retrieved_text: str, on_token: Optional[Callable[[str], None]] = None
+) -> str:
+    # Pandas agent over the DataFrame (a private copy, since agent code may mutate it)
+    df = load_dataset(data_path)
+    callbacks: List[BaseCallbackHandler] = []
+    if on_token is not None:
+        # Tokens only reach callbacks from a streaming client
+        llm = llm.model_copy(update={"streaming": True})
+        callbacks.append(_FinalAnswerStreamer(on_token))
+    pandas_agent = create_pandas_dataframe_agent(llm, df.copy(), verbose=False, allow_dangerous_code=True)
+    analysis_prompt = (
+        "Use the DataFrame to answer the user's question succinctly.\n"
+        "When helpful, perform aggregations, filters, or computations.\n"
+        "If the question is ambiguous, state necessary assumptions briefly.\n"
+        f"Question: {query}\n"
+        f"Relevant rows (retrieved):\n{retrieved_text[:4000]}\n"
+    )
+    try:
+        answer = pandas_agent.run(analysis_prompt, callbacks=callbacks)
+    except Exception as exc:
+        answer = f"Unable to run full analysis agent. Fallback summary: {df.describe(include='all').to_string()[:1500]}\nError: {exc}"
+    return str(answer)
+
+
+def analysis_agent(state: AppState) -> AppState:
+    data_path = Path(state["data_path"])  # type: ignore[index]
+    vector_dir = Path(state["vector_dir"])  # type: ignore[index]
+    query = state.get("query", "")
+    k = int(state.get("top_k", 5))
 
+    # Retrieve context from FAISS (started by the router when speculating)
+    docs = speculative_result(state, "retrieval", lambda: retrieve_context(vector_dir, query, k=k))
+    retrieved_text = "\n\n".join(d.page_content for d in docs) if docs else ""
+    state["retrieved_text"] = retrieved_text
 
-def router_node(state: AppState) -> AppState:
-    """Route the query to an intent."""
+    # Attempt structured analysis plan first; fallback to pandas agent if needed.
+    # The plan is written from a preview and executed lazily against the file.
     llm = get_llm()
-    query = state.get("query", "").strip()
-    has_new_upload = bool(state.get("has_new_upload"))
-    prefer_visual = bool(state.get("prefer_visual"))
 
-    classification_prompt = (
-        "You are a router. Classify the user's intent for data tasks.\n"
-        "Return one of: ingest, analyze, visualize, ingest_then_analyze, ingest_then_visualize.\n"
-        "Rules: If a new file was uploaded, prefer ingest_then_* if a query exists, else ingest.\n"
-        "If the query asks for plots/charts/visualization or the UI prefers visualization, choose visualize.\n"
-        f"Query: {query!r}. PreferVisual: {prefer_visual}. HasNewUpload: {has_new_upload}."
-    )
-    intent = "analyze"
     try:
-        completion = llm.invoke(classification_prompt)
-        intent_raw = str(getattr(completion, "content", "")).lower()
-        for candidate in [
-            "ingest_then_visualize",
-            "ingest_then_analyze",
-            "ingest",
-            "visualize",
-            "analyze",
-        ]:
-            if candidate in intent_raw:
-                intent = candidate
-                break
-        else:
-            # Heuristic fallback if LLM returns free-form text
-            if has_new_upload and query:
-                intent = "ingest_then_analyze"
-            elif has_new_upload:
-                intent = "ingest"
-            elif prefer_visual or any(k in query.lower() for k in ["plot", "chart", "graph", "visualiz", "show"]):
-                intent = "visualize"
-            else:
-                intent = "analyze"
+        # Computed once per run; a parallel visualization branch charts the same result
+        planned = shared_run_result(state, "plan_result", lambda: _plan_result(state, llm, data_path, query))
+        if planned is not None:
+            plan, result_df, logs = planned
+            _store_analysis(state, plan, result_df, logs)
+            state["analysis_answer"] = _summarize_result(llm, result_df, query, logs, _token_sink(state))
+            return _branch_update(state, ANALYSIS_OUTPUTS)
     except Exception:
-        # Robust fallback
-        if has_new_upload and query:
-            intent = "ingest_then_analyze"
-        elif has_new_upload:
-            intent = "ingest"
-        elif prefer_visual or any(k in query.lower() for k in ["plot", "chart", "graph", "visualiz", "show"]):
-            intent = "visualize"
-        else:
-            intent = "analyze"
-
-    state["intent"] = intent
-    return state
-
+        # Fall back to pandas agent below
+        pass
 
-def ingestion_agent(state: AppState) -> AppState:
-    data_path = Path(state["data_path"])  # type: ignore[index]
-    vector_dir = Path(state["vector_dir"])  # type: ignore[index]
+    state["analysis_answer"] = _pandas_agent_answer(llm, data_path, query, retrieved_text, _token_sink(state))
+    return _branch_update(state, ANALYSIS_OUTPUTS)
 
-    # Load dataframe and build vector store
-    df = pd.read_csv(data_path)
-    build_vector_store(df, vector_dir)
 
-    # Decide next step (used by conditional edge)
-    return state
+async def _aplan_from_preview(
+    llm: ChatOpenAI, data_path: Path, query: str
+) -> Tuple[Dict[str, Any], Optional[Callable[[], None]], List[str]]:
+    return await aplan_for_query(llm, await asyncio.to_thread(dataset_preview, data_path), query)
 
 
-def analysis_agent(state: AppState) -> AppState:
+async def aanalysis_agent(state: AppState) -> AppState:
+    """``analysis_agent`` awaiting its LLM and embedding calls; file reads and plan execution run on worker threads."""
     data_path = Path(state["data_path"])  # type: ignore[index]
     vector_dir = Path(state["vector_dir"])  # type: ignore[index]
     query = state.get("query", "")
     k = int(state.get("top_k", 5))
 
-    # Retrieve context from FAISS
-    docs = retrieve_context(vector_dir, query, k=k)
+    docs = await aspeculative_result(state, "retrieval", lambda: aretrieve_context(vector_dir, query, k=k))
     retrieved_text = "\n\n".join(d.page_content for d in docs) if docs else ""
     state["retrieved_text"] = retrieved_text
 
-    # Attempt structured analysis plan first; fallback to pandas agent if needed
-    df = pd.read_csv(data_path)
     llm = get_llm()
 
     try:
-        plan = _generate_analysis_plan(llm, df, query)
-        if plan and isinstance(plan, dict) and plan.get("steps"):
-            result_df, logs = _execute_analysis_plan(df, plan)
-            summary = _summarize_result(llm, result_df, query, logs)
-            state["analysis_answer"] = summary
-            # Store plan and a compact table for UI display
-            state["analysis_plan"] = plan
-            table_cols = [str(c) for c in result_df.columns.tolist()]
-            table_rows = result_df.head(500).to_dict(orient="records")
-            state["analysis_table"] = {"columns": table_cols, "rows": table_rows}
-            state["analysis_logs"] = logs
-            return state
+        planned = await ashared_run_result(state, "plan_result", lambda: _aplan_result(state, llm, data_path, query))
+        if planned is not None:
+            plan, result_df, logs = planned
+            _store_analysis(state, plan, result_df, logs)
+            state["analysis_answer"] = await _asummarize_result(llm, result_df, query, logs, _token_sink(state))
+            return _branch_update(state, ANALYSIS_OUTPUTS)
     except Exception:
         # Fall back to pandas agent below
         pass
 
-    # Fallback: Pandas agent over the DataFrame
-    pandas_agent = create_pandas_dataframe_agent(llm, df, verbose=False, allow_dangerous_code=True)
-    analysis_prompt = (
-        "Use the DataFrame to answer the user's question succinctly.\n"
-        "When helpful, perform aggregations, filters, or computations.\n"
-        "If the question is ambiguous, state necessary assumptions briefly.\n"
-        f"Question: {query}\n"
-        f"Relevant rows (retrieved):\n{retrieved_text[:4000]}\n"
+    # The pandas agent only has a blocking interface
+    state["analysis_answer"] = await asyncio.to_thread(
+        _pandas_agent_answer, llm, data_path, query, retrieved_text, _token_sink(state)
     )
-    try:
-        answer = pandas_agent.run(analysis_prompt)
-    except Exception as exc:
-        answer = f"Unable to run full analysis agent. Fallback summary: {df.describe(include='all').to_string()[:1500]}\nError: {exc}"
-
-    state["analysis_answer"] = str(answer)
-    return state
+    return _branch_update(state, ANALYSIS_OUTPUTS)
 
 
 # -------------------------
 # Structured analysis planning & execution
 # -------------------------
 
-def _generate_analysis_plan(llm: ChatOpenAI, df: pd.DataFrame, query: str) -> Dict[str, Any]:
+def _analysis_plan_prompt(df: pd.DataFrame, query: str) -> str:
     schema = {
         "type": "object",
         "properties": {
@@ -345,7 +2328,7 @@ def _generate_analysis_plan(llm: ChatOpenAI, df: pd.DataFrame, query: str) -> Di
     # Provide compact schema and metadata to the model
     dtypes_map = {str(c): str(t) for c, t in df.dtypes.items()}
     preview = df.head(10).to_dict(orient="records")
-    prompt = (
+    return (
         "You are a senior data analyst. Create a minimal JSON-only analysis plan\n"
         "to answer the user's question on the given DataFrame. Use only the schema below.\n"
         "Prefer simple, robust steps (filter, groupby_agg, sort, topk).\n"
@@ -356,27 +2339,39 @@ def _generate_analysis_plan(llm: ChatOpenAI, df: pd.DataFrame, query: str) -> Di
         f"Question: {query}\n"
         "Return JSON only."
     )
-    resp = llm.invoke(prompt)
-    content = getattr(resp, "content", "{}")
+
+
+def _parse_json_object(content: str, default: Dict[str, Any]) -> Dict[str, Any]:
+    """The outermost ``{...}`` in a completion; ``{}`` when there is none, ``default`` when it does not parse."""
     try:
         start = content.find("{")
         end = content.rfind("}")
-        plan = json.loads(content[start : end + 1]) if start != -1 and end != -1 else {}
+        return json.loads(content[start : end + 1]) if start != -1 and end != -1 else {}
     except Exception:
-        plan = {}
-    return plan
+        return default
+
+
+def _generate_analysis_plan(llm: ChatOpenAI, df: pd.DataFrame, query: str) -> Dict[str, Any]:
+    resp = cached_invoke(llm, _analysis_plan_prompt(df, query), "planner")
+    return _parse_json_object(getattr(resp, "content", "{}"), {})
 
 
-def _resolve_column(df: pd.DataFrame, name: str) -> Optional[str]:
-    if name in df.columns:
+async def _agenerate_analysis_plan(llm: ChatOpenAI, df: pd.DataFrame, query: str) -> Dict[str, Any]:
+    resp = await acached_invoke(llm, _analysis_plan_prompt(df, query), "planner")
+    return _parse_json_object(getattr(resp, "content", "{}"), {})
+
+
+def _resolve_column(df: Union[pd.DataFrame, List[str]], name: str) -> Optional[str]:
+    columns = df.columns if isinstance(df, pd.DataFrame) else df
+    if name in columns:
         return name
     # case-insensitive fallback
-    lowered = {str(c).lower(): str(c) for c in df.columns}
+    lowered = {str(c).lower(): str(c) for c in columns}
     ci = lowered.get(str(name).lower())
     if ci:
         return ci
     # fuzzy match fallback
-    candidates = [str(c) for c in df.columns]
+    candidates = [str(c) for c in columns]
     lowered_candidates = [c.lower() for c in candidates]
     import difflib as _difflib
     matches = _difflib.get_close_matches(str(name).lower(), lowered_candidates, n=1, cutoff=0.8)
@@ -400,377 +2395,1598 @@ def _as_number(value: Any) -> Any:
         return value
 
 
-def _smart_coerce_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    working = df.copy()
-    # Try to coerce common numeric formats and dates
-    for col in list(working.columns):
-        series = working[col]
-        if pd.api.types.is_object_dtype(series):
-            # numeric-like strings: remove currency, commas, percent
-            cleaned = series.astype(str).str.replace(r"[,$]", "", regex=True).str.replace("%", "", regex=False)
-            coerced = pd.to_numeric(cleaned, errors="coerce")
-            non_na_ratio = float(coerced.notna().mean()) if len(coerced) else 0.0
-            if non_na_ratio > 0.6:
-                working[col] = coerced
-                continue
-            # date-like by name
-            import re as _re
-            if _re.search(r"date|time|timestamp", str(col), flags=_re.I):
+def _widened(value: Any) -> Any:
+    """Compact int32/float32 columns back to 64-bit before arithmetic."""
+    if isinstance(value, pd.Series) and isinstance(value.dtype, np.dtype):
+        if value.dtype.kind in "iu" and value.dtype.itemsize < 8:
+            return value.astype(np.int64)
+        if value.dtype.kind == "f" and value.dtype.itemsize < 8:
+            return value.astype(np.float64)
+    return value
+
+
+def _category_values(series: pd.Series) -> pd.Series:
+    """Unordered categoricals refuse <, > and between; compare their values instead."""
+    if isinstance(series.dtype, pd.CategoricalDtype) and not series.cat.ordered:
+        return series.astype(series.cat.categories.dtype)
+    return series
+
+
+# -------------------------
+# Type inference
+# -------------------------
+
+# Bump when inference rules change so persisted schemas are recomputed
+INFERENCE_ENGINE_VERSION = 2
+INFERENCE_SAMPLE_SIZE = 2_000
+INFERENCE_STRATA = 10
+# Share of non-null sampled values that must parse for a column to convert
+INFERENCE_MATCH_RATIO = 0.8
+# Distinct values (absolute and relative) up to which text is categorical, in an
+# inference sample and in a whole column at compaction
+CATEGORY_MAX_DISTINCT = 200
+CATEGORY_MAX_RATIO = 0.1
+
+_DATE_NAME_PATTERN = re.compile(r"date|time|timestamp", re.I)
+_CURRENCY_PATTERN = re.compile(r"^\(?[-+]?\s*[$€£¥]|[$€£¥]\s*\)?$")
+_NUMBER_PATTERN = r"^\(?[-+]?\s*[$€£¥]?\s*(?:\d{1,3}(?:,\d{3})+|\d+)?(?:\.\d+)?(?:[eE][-+]?\d+)?\s*[$€£¥]?\s*%?\)?$"
+_BOOLEAN_VALUES = {
+    "true": True, "false": False, "yes": True, "no": False,
+    "y": True, "n": False, "t": True, "f": False,
+}
+
+
+def _stratified_sample(series: pd.Series, size: int = INFERENCE_SAMPLE_SIZE, strata: int = INFERENCE_STRATA) -> pd.Series:
+    """Non-null values drawn evenly from ``strata`` contiguous row ranges.
+
+    Sorted or appended uploads often change format part-way through, which a
+    head() sample would miss.
+    """
+    n = len(series)
+    if n > size:
+        rng = np.random.default_rng(0)
+        bounds = np.linspace(0, n, strata + 1, dtype=np.int64)
+        per = max(1, size // strata)
+        positions = np.unique(np.concatenate([rng.integers(lo, hi, per) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]))
+        series = series.iloc[positions]
+    return series.dropna()
+
+
+def _infer_text_column(name: str, sample: pd.Series) -> Dict[str, Any]:
+    """Classify one text column from its sample; returns a schema entry."""
+    n = len(sample)
+    if n == 0:
+        return {"kind": "string", "confidence": 0.0}
+    text = sample.astype(str).str.strip()
+    lowered = text.str.lower()
+
+    is_bool = lowered.isin(list(_BOOLEAN_VALUES))
+    if float(is_bool.mean()) >= INFERENCE_MATCH_RATIO and lowered[is_bool].nunique() == 2:
+        return {"kind": "boolean", "dtype": "boolean", "confidence": float(is_bool.mean())}
+
+    numeric_like = text.str.fullmatch(_NUMBER_PATTERN) & text.str.contains(r"\d", regex=True)
+    numeric_ratio = float(numeric_like.mean())
+    if numeric_ratio >= INFERENCE_MATCH_RATIO:
+        matched = text[numeric_like]
+        rule = {
+            "currency": bool(matched.str.contains(_CURRENCY_PATTERN, regex=True).any()),
+            "percent": bool(matched.str.endswith("%").any() | matched.str.endswith("%)").any()),
+            "thousands": bool(matched.str.contains(r"\d,\d{3}", regex=True).any()),
+            "parens_negative": bool(matched.str.startswith("(").any()),
+        }
+        kind = "currency" if rule["currency"] else ("percent" if rule["percent"] else "numeric")
+        return {"kind": kind, "rule": rule, "confidence": numeric_ratio}
+
+    formats: Dict[str, float] = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for value in text.head(5):
+            fmt = guess_datetime_format(value)
+            if fmt and fmt not in formats:
+                formats[fmt] = float(pd.to_datetime(text, format=fmt, errors="coerce").notna().mean())
+    best = max(formats.items(), key=lambda kv: kv[1]) if formats else (None, 0.0)
+    name_hint = bool(_DATE_NAME_PATTERN.search(name))
+    if best[1] >= INFERENCE_MATCH_RATIO or (name_hint and best[1] >= 0.5):
+        return {"kind": "datetime", "dtype": "datetime64[ns]", "rule": {"format": best[0]}, "confidence": best[1]}
+    if name_hint:
+        # Date-named column without a single format: parse per value if most values parse
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            ratio = float(pd.to_datetime(text, errors="coerce").notna().mean())
+        if ratio >= 0.5:
+            return {"kind": "datetime", "dtype": "datetime64[ns]", "rule": {"format": None}, "confidence": ratio}
+
+    distinct = int(text.nunique())
+    if distinct <= CATEGORY_MAX_DISTINCT and distinct <= CATEGORY_MAX_RATIO * n:
+        return {"kind": "category", "distinct_in_sample": distinct, "confidence": 1.0 - distinct / n}
+    return {"kind": "string", "confidence": 1.0}
+
+
+def _is_text_series(series: pd.Series) -> bool:
+    """Object, string or category-of-text columns, as left by ``compact_dataframe``."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.cat.categories.to_series()
+    return pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+
+
+def _infer_coercion_schema(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """Infer every column's type from a stratified sample (the schema report).
+
+    Text columns are classified as boolean, numeric/currency/percent, datetime
+    (by content, or by name as a fallback), category or string. Columns already
+    typed by the file are reported as-is. Only the sample is parsed here; the
+    full column is converted once by ``_apply_coercion_schema``.
+    """
+    schema: Dict[str, Dict[str, Any]] = {}
+    for col in list(df.columns):
+        series = df[col]
+        if _is_text_series(series):
+            entry = _infer_text_column(str(col), _stratified_sample(series))
+            entry["sample_size"] = int(min(len(series), INFERENCE_SAMPLE_SIZE))
+        elif pd.api.types.is_bool_dtype(series):
+            entry = {"kind": "boolean", "confidence": 1.0}
+        elif pd.api.types.is_numeric_dtype(series):
+            entry = {"kind": "numeric", "confidence": 1.0}
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            entry = {"kind": "datetime", "confidence": 1.0}
+        else:
+            entry = {"kind": str(series.dtype), "confidence": 1.0}
+        entry["source_dtype"] = str(series.dtype)
+        schema[str(col)] = entry
+    return schema
+
+
+def _parse_numeric_text(series: pd.Series, rule: Dict[str, Any]) -> pd.Series:
+    text = series.astype(str).str.strip()
+    if rule.get("parens_negative"):
+        text = text.str.replace(r"^\((.*)\)$", r"-\1", regex=True)
+    strip = "".join(
+        part
+        for part, wanted in ((",", rule.get("thousands")), ("$€£¥", rule.get("currency")), ("%", rule.get("percent")))
+        if wanted
+    )
+    if strip:
+        text = text.str.replace(f"[{re.escape(strip)}\\s]", "", regex=True)
+    return pd.to_numeric(text, errors="coerce")
+
+
+def _convert_text_column(series: pd.Series, kind: Optional[str], rule: Dict[str, Any]) -> Optional[pd.Series]:
+    if kind in ("numeric", "currency", "percent"):
+        return _parse_numeric_text(series, rule)
+    if kind == "boolean":
+        return series.astype(str).str.strip().str.lower().map(_BOOLEAN_VALUES).astype("boolean")
+    if kind == "datetime":
+        if rule.get("format"):
+            return pd.to_datetime(series, format=rule["format"], errors="coerce")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return pd.to_datetime(series, errors="coerce")
+    return None
+
+
+def _apply_coercion_schema(df: pd.DataFrame, schema: Dict[str, Dict[str, Any]]) -> pd.DataFrame:
+    """Convert the text columns ``schema`` types, one vectorized pass per column.
+
+    Categorical columns are converted per distinct value and expanded through
+    their codes. Untouched columns share memory with ``df``.
+    """
+    working = df.copy(deep=False)
+    for col in list(working.columns):
+        spec = schema.get(str(col)) or {}
+        series = working[col]
+        if not _is_text_series(series):
+            continue
+        kind = spec.get("kind")
+        rule = spec.get("rule") or {}
+        try:
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                converted = _convert_text_column(pd.Series(series.cat.categories), kind, rule)
+                if converted is not None:
+                    # Code -1 (missing) takes the converted dtype's NA
+                    values = converted.array.take(series.cat.codes.to_numpy(), allow_fill=True)
+                    working[col] = pd.Series(values, index=series.index, name=series.name)
+            else:
+                converted = _convert_text_column(series, kind, rule)
+                if converted is not None:
+                    working[col] = converted
+        except Exception:
+            pass
+    return working
+
+
+def _smart_coerce_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    # Try to coerce common numeric formats and dates
+    return _apply_coercion_schema(df, _infer_coercion_schema(df))
+
+
+def _inference_sample(data_path: Path) -> pd.DataFrame:
+    """Rows to infer types from without loading a large dataset.
+
+    Uses the cached frame when there is one, otherwise up to
+    ``INFERENCE_STRATA`` row groups spread evenly across the Parquet file.
+    """
+    cached = cached_dataset(data_path)
+    if cached is not None or data_path.suffix != ".parquet":
+        return cached if cached is not None else load_dataset(data_path)
+    parquet = pq.ParquetFile(data_path, memory_map=True)
+    if parquet.num_row_groups <= INFERENCE_STRATA:
+        return load_dataset(data_path)
+    groups = np.unique(np.linspace(0, parquet.num_row_groups - 1, INFERENCE_STRATA).astype(int))
+    return parquet.read_row_groups(groups.tolist()).to_pandas(types_mapper=_ARROW_STRING_DTYPES.get)
+
+
+def dataset_coercion_schema(data_path: Path, df: Optional[pd.DataFrame] = None) -> Dict[str, Dict[str, Any]]:
+    """Coercion schema of the stored dataset, inferred once per file version.
+
+    The schema is persisted in the dataset's ``.meta.json`` together with the
+    file size and mtime it was computed for; ``df`` (the parsed file) avoids
+    a reload when the caller already has it.
+    """
+    data_path = Path(data_path)
+    version = list(_file_version(data_path)[1:])
+    stored = read_dataset_meta(data_path).get("coercion")
+    if (
+        isinstance(stored, dict)
+        and stored.get("version") == version
+        and stored.get("engine") == INFERENCE_ENGINE_VERSION
+        and isinstance(stored.get("columns"), dict)
+    ):
+        return stored["columns"]
+    schema = _infer_coercion_schema(df if df is not None else _inference_sample(data_path))
+    write_dataset_meta(
+        data_path, {"coercion": {"version": version, "engine": INFERENCE_ENGINE_VERSION, "columns": schema}}
+    )
+    return schema
+
+
+def schema_report_frame(schema: Dict[str, Dict[str, Any]]) -> pd.DataFrame:
+    """Tabular view of an inferred schema for display."""
+    rows = []
+    for col, entry in schema.items():
+        rule = entry.get("rule") or {}
+        details = ", ".join(f"{k}={v}" for k, v in rule.items() if v not in (False, None))
+        if entry.get("distinct_in_sample") is not None:
+            details = f"{entry['distinct_in_sample']} distinct in sample"
+        rows.append(
+            {
+                "column": col,
+                "inferred": entry.get("kind"),
+                "stored as": entry.get("source_dtype"),
+                "confidence": round(float(entry.get("confidence", 0.0)), 3),
+                "details": details,
+            }
+        )
+    return pd.DataFrame(rows, columns=["column", "inferred", "stored as", "confidence", "details"])
+
+
+def load_typed_dataset(data_path: Path) -> pd.DataFrame:
+    """The dataset with its coercion schema applied, cached per file version.
+
+    Like ``load_dataset`` the frame is shared and must not be mutated; plan
+    execution works on a shallow copy.
+    """
+    data_path = Path(data_path)
+    key = _file_version(data_path) + ("typed",)
+
+    def _build() -> pd.DataFrame:
+        raw = load_dataset(data_path)
+        return _apply_coercion_schema(raw, dataset_coercion_schema(data_path, raw))
+
+    return _dataset_cache().get_or_load(key, _build)
+
+
+def _parse_dtype(name: str):
+    t = str(name).lower()
+    if t in {"int", "int64", "integer"}:
+        return "int64"
+    if t in {"float", "float64", "double"}:
+        return "float64"
+    if t in {"str", "string", "text"}:
+        return "string"
+    if t in {"bool", "boolean"}:
+        return "boolean"
+    if t in {"datetime", "timestamp", "date"}:
+        return "datetime64[ns]"
+    return None
+
+
+def _date_trunc(series: pd.Series, freq: str) -> pd.Series:
+    f = freq.lower()
+    try:
+        s = pd.to_datetime(series, errors="coerce")
+        if f == "day":
+            return s.dt.floor("D")
+        if f == "week":
+            return s.dt.to_period("W").apply(lambda p: p.start_time)
+        if f == "month":
+            return s.dt.to_period("M").dt.to_timestamp()
+        if f == "quarter":
+            return s.dt.to_period("Q").dt.to_timestamp()
+        if f == "year":
+            return s.dt.to_period("Y").dt.to_timestamp()
+    except Exception:
+        pass
+    return series
+
+
+def _op_filter(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    conditions = step.get("conditions") or []
+    mask = pd.Series(True, index=working.index)
+    for cond in conditions:
+        col_raw = cond.get("column")
+        optr = str(cond.get("operator", "==")).lower()
+        val = cond.get("value")
+        values = cond.get("values")
+        ci = bool(cond.get("case_insensitive", True))
+        col = _resolve_column(working, str(col_raw))
+        if not col or col not in working.columns:
+            continue
+        series = working[col]
+        if optr in {">", ">=", "<", "<=", "between"}:
+            series = _category_values(series)
+        if optr in {"==", "!=", ">", ">=", "<", "<="}:
+            right = _as_number(val)
+            try:
+                expr_mask = getattr(series, "__{}__".format(
+                    {"==": "eq", "!=": "ne", ">": "gt", ">=": "ge", "<": "lt", "<=": "le"}[optr]
+                ))(right)
+            except Exception:
+                expr_mask = series.astype(str).str.lower().eq(str(val).lower()) if ci else series.astype(str).eq(str(val))
+                if optr == "!=":
+                    expr_mask = ~expr_mask
+        elif optr in {"contains"}:
+            expr_mask = series.astype(str).str.contains(str(val), case=not ci, na=False)
+        elif optr in {"in", "not_in"}:
+            vals = [ _as_number(v) for v in (values if isinstance(values, list) else [val]) ]
+            expr_mask = series.isin(vals)
+            if optr == "not_in":
+                expr_mask = ~expr_mask
+        elif optr in {"between"}:
+            arr = values if isinstance(values, list) else [None, None]
+            left, right = (_as_number(arr[0]), _as_number(arr[1]))
+            expr_mask = series.between(left, right, inclusive="both")
+        else:
+            continue
+        mask &= expr_mask.fillna(False)
+    # The compiler fuses a following select (or a pushed-down projection) into
+    # the filter, so a single .loc copies only the kept columns
+    project = step.get("select") or step.get("project")
+    if project:
+        working = working.loc[mask, [c for c in project if c in working.columns]]
+        log(f"filter rows -> {len(working)} rows")
+        if step.get("select"):
+            log(f"select columns -> {list(working.columns)}")
+    else:
+        working = working[mask]
+        log(f"filter rows -> {len(working)} rows")
+    return working
+
+
+def _op_select(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    columns = [c for c in (step.get("columns") or []) if _resolve_column(working, str(c))]
+    resolved = [_resolve_column(working, str(c)) for c in columns]
+    resolved = [c for c in resolved if c is not None]
+    if resolved:
+        working = working.loc[:, resolved]  # type: ignore[index]
+        log(f"select columns -> {resolved}")
+    return working
+
+
+def _op_compute(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    new_col = str(step.get("new_column") or "new")
+    operation = str(step.get("operation") or "add").lower()
+    left_spec = step.get("left") or {}
+    right_spec = step.get("right") or {}
+    left_col = _resolve_column(working, str(left_spec.get("column"))) if left_spec.get("column") else None
+    right_col = _resolve_column(working, str(right_spec.get("column"))) if right_spec.get("column") else None
+    left_val = _widened(working[left_col]) if left_col else _as_number(left_spec.get("value"))
+    right_val = _widened(working[right_col]) if right_col else _as_number(right_spec.get("value"))
+    try:
+        if operation == "add":
+            working[new_col] = left_val + right_val  # type: ignore[operator]
+        elif operation == "subtract":
+            working[new_col] = left_val - right_val  # type: ignore[operator]
+        elif operation == "multiply":
+            working[new_col] = left_val * right_val  # type: ignore[operator]
+        elif operation == "divide":
+            working[new_col] = left_val / right_val  # type: ignore[operator]
+        log(f"compute {new_col} = {operation}(...)")
+    except Exception:
+        pass
+    return working
+
+
+def _op_groupby_agg(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    by = [c for c in (step.get("by") or []) if _resolve_column(working, str(c))]
+    by_resolved = [_resolve_column(working, str(c)) for c in by]
+    by_resolved = [c for c in by_resolved if c is not None]
+    aggs_conf = step.get("aggregations") or []
+    agg_map: Dict[str, List[str]] = {}
+    for a in aggs_conf:
+        col = _resolve_column(working, str(a.get("column")))
+        func = str(a.get("agg", "sum")).lower()
+        if col and func in {"sum", "mean", "count", "min", "max", "median"}:
+            agg_map.setdefault(col, []).append(func)
+    if by_resolved and agg_map:
+        grouped = working.groupby(by_resolved, dropna=False, observed=True).agg(agg_map)
+        # Flatten MultiIndex columns if present
+        grouped.columns = ["_".join([str(c) for c in col]).strip("_") if isinstance(col, tuple) else str(col) for col in grouped.columns.values]
+        working = grouped.reset_index()
+        log(f"groupby {by_resolved} agg {agg_map}")
+    return working
+
+
+def _op_sort(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    by = [c for c in (step.get("by") or []) if _resolve_column(working, str(c))]
+    by_resolved = [_resolve_column(working, str(c)) for c in by]
+    by_resolved = [c for c in by_resolved if c is not None]
+    ascending = step.get("ascending", False)
+    try:
+        working = working.sort_values(by=by_resolved or working.columns.tolist(), ascending=ascending)
+        log(f"sort by {by_resolved or list(working.columns)} asc={ascending}")
+    except Exception:
+        pass
+    return working
+
+
+def _op_topk(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    k = int(step.get("k", 5))
+    by = _resolve_column(working, str(step.get("by"))) if step.get("by") else None
+    try:
+        if by and pd.api.types.is_numeric_dtype(working[by]):
+            working = working.nlargest(k, by)
+        else:
+            working = working.head(k)
+        log(f"topk {k} by {by or 'head'}")
+    except Exception:
+        working = working.head(k)
+        log(f"topk {k} (fallback head)")
+    return working
+
+
+def _op_rename(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    mapping = step.get("mapping") or {}
+    safe_map = { (k if k in working.columns else _resolve_column(working, str(k))): str(v) for k, v in mapping.items() }
+    safe_map = { k: v for k, v in safe_map.items() if k }
+    if safe_map:
+        working = working.rename(columns=safe_map)
+        log(f"rename columns {safe_map}")
+    return working
+
+
+def _op_pivot(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    index = step.get("index")
+    values = step.get("values")
+    columns = step.get("columns")
+    aggfunc = step.get("aggfunc", "sum")
+    fill_value = step.get("fill_value")
+    try:
+        pivoted = pd.pivot_table(
+            working,
+            index=index,
+            columns=columns,
+            values=values,
+            aggfunc=aggfunc,
+            fill_value=fill_value,
+            observed=True,
+        )
+        if isinstance(pivoted.columns, pd.MultiIndex):
+            pivoted.columns = ["_".join([str(c) for c in col]).strip("_") for col in pivoted.columns]
+        working = pivoted.reset_index()
+        log("pivot table")
+    except Exception:
+        pass
+    return working
+
+
+def _op_limit(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    n = int(step.get("n", 10))
+    working = working.head(n)
+    log(f"limit {n}")
+    return working
+
+
+def _op_dropna(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    subset = step.get("subset")
+    how = step.get("how", "any")
+    try:
+        working = working.dropna(subset=subset, how=how)
+        log(f"dropna subset={subset} how={how}")
+    except Exception:
+        pass
+    return working
+
+
+def _op_fillna(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    value = step.get("value")
+    try:
+        if isinstance(value, dict):
+            working = working.fillna(value)
+        else:
+            working = working.fillna(value)
+        log("fillna applied")
+    except Exception:
+        pass
+    return working
+
+
+def _op_cast(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    types = step.get("types") or {}
+    try:
+        for k, v in list(types.items()):
+            col = _resolve_column(working, str(k))
+            if not col:
+                continue
+            target = _parse_dtype(v)
+            if target == "datetime64[ns]":
+                working[col] = pd.to_datetime(working[col], errors="coerce")
+            elif target:
+                working[col] = working[col].astype(target, errors="ignore")
+        log(f"cast columns {types}")
+    except Exception:
+        pass
+    return working
+
+
+def _op_date_parse(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    columns = step.get("columns") or []
+    for c in columns:
+        col = _resolve_column(working, str(c))
+        if col:
+            try:
+                working[col] = pd.to_datetime(working[col], errors="coerce")
+            except Exception:
+                pass
+    log(f"date_parse {columns}")
+    return working
+
+
+def _op_date_trunc(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
+    freq = step.get("freq", "month")
+    if column and column in working.columns:
+        working[column] = _date_trunc(working[column], str(freq))
+        log(f"date_trunc {column} freq={freq}")
+    return working
+
+
+def _op_window_rank(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    by = _resolve_column(working, str(step.get("by"))) if step.get("by") else None
+    partition_by = step.get("partition_by")
+    if isinstance(partition_by, str):
+        partition_by = [partition_by]
+    partition_resolved = [c for c in (partition_by or []) if _resolve_column(working, str(c))]
+    partition_resolved = [ _resolve_column(working, str(c)) for c in partition_resolved ]
+    partition_resolved = [ c for c in partition_resolved if c ]
+    rank_col = str(step.get("rank_column") or "rank")
+    ascending = bool(step.get("ascending", False))
+    try:
+        if by and by in working.columns:
+            if partition_resolved:
+                working[rank_col] = working.sort_values(by=by, ascending=ascending).groupby(partition_resolved, observed=True)[by].rank(method="dense", ascending=ascending)
+            else:
+                working[rank_col] = working[by].rank(method="dense", ascending=ascending)
+            log(f"window_rank on {by} partition_by={partition_resolved}")
+    except Exception:
+        pass
+    return working
+
+
+def _op_cumsum(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
+    new_col = str(step.get("new_column") or f"{column}_cumsum")
+    by = step.get("by")
+    if isinstance(by, str):
+        by = [by]
+    by_resolved = [ _resolve_column(working, str(c)) for c in (by or []) ]
+    by_resolved = [ c for c in by_resolved if c ]
+    try:
+        if column and by_resolved:
+            working[new_col] = _widened(working[column]).groupby([working[c] for c in by_resolved], observed=True).cumsum()
+        elif column:
+            working[new_col] = _widened(working[column]).cumsum()
+        log(f"cumsum for {column} by={by_resolved}")
+    except Exception:
+        pass
+    return working
+
+
+def _op_pct_change(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
+    new_col = str(step.get("new_column") or f"{column}_pct_change")
+    periods = int(step.get("periods", 1))
+    by = step.get("by")
+    if isinstance(by, str):
+        by = [by]
+    by_resolved = [ _resolve_column(working, str(c)) for c in (by or []) ]
+    by_resolved = [ c for c in by_resolved if c ]
+    try:
+        if column and by_resolved:
+            working[new_col] = working.groupby(by_resolved, observed=True)[column].pct_change(periods=periods)
+        elif column:
+            working[new_col] = working[column].pct_change(periods=periods)
+        log(f"pct_change for {column} by={by_resolved} periods={periods}")
+    except Exception:
+        pass
+    return working
+
+
+def _op_value_counts(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
+    if column and column in working.columns:
+        working = _value_counts_frame(working[column].value_counts(), str(column), step)
+        log(f"value_counts {column} normalize={bool(step.get('normalize', False))} top={int(step.get('k', 20))}")
+    return working
+
+
+def _value_counts_frame(counts: pd.Series, column: str, step: Dict[str, Any]) -> pd.DataFrame:
+    """The value_counts step's output from raw counts.
+
+    Ties are ordered by value so merged chunk or partition counts come out in
+    the same order as a single pass.
+    """
+    # Categories absent after filtering would otherwise be listed with zero counts
+    counts = counts[counts > 0]
+    try:
+        counts = counts.sort_index(kind="stable")
+    except TypeError:
+        pass
+    counts = counts.sort_values(ascending=False, kind="stable")
+    if step.get("normalize", False):
+        counts = counts / counts.sum()
+    return counts.head(int(step.get("k", 20))).rename_axis(column).reset_index(name="count")
+
+
+def _op_dedupe(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    subset = step.get("subset")
+    keep = step.get("keep", "first")
+    try:
+        working = working.drop_duplicates(subset=subset, keep=keep)
+        log(f"dedupe subset={subset} keep={keep}")
+    except Exception:
+        pass
+    return working
+
+
+def _op_sample(working: pd.DataFrame, step: Dict[str, Any], log: Callable[[str], None]) -> pd.DataFrame:
+    n = step.get("n")
+    frac = step.get("frac")
+    random_state = step.get("random_state")
+    try:
+        if n is not None:
+            working = working.sample(n=int(n), random_state=random_state)
+        elif frac is not None:
+            working = working.sample(frac=float(frac), random_state=random_state)
+        log(f"sample n={n} frac={frac}")
+    except Exception:
+        pass
+    return working
+
+
+_PLAN_OPS: Dict[str, Callable[[pd.DataFrame, Dict[str, Any], Callable[[str], None]], pd.DataFrame]] = {
+    "filter": _op_filter,
+    "select": _op_select,
+    "compute": _op_compute,
+    "groupby_agg": _op_groupby_agg,
+    "sort": _op_sort,
+    "topk": _op_topk,
+    "rename": _op_rename,
+    "pivot": _op_pivot,
+    "limit": _op_limit,
+    "dropna": _op_dropna,
+    "fillna": _op_fillna,
+    "cast": _op_cast,
+    "date_parse": _op_date_parse,
+    "date_trunc": _op_date_trunc,
+    "window_rank": _op_window_rank,
+    "cumsum": _op_cumsum,
+    "pct_change": _op_pct_change,
+    "value_counts": _op_value_counts,
+    "dedupe": _op_dedupe,
+    "sample": _op_sample,
+}
+
+_FILTER_OPERATORS = {"==", "!=", ">", ">=", "<", "<=", "contains", "in", "not_in", "between"}
+# Steps that copy every row of the frame they receive; worth projecting ahead of
+_ROW_COPYING_OPS = {"filter", "sort", "topk", "dropna", "dedupe", "sample"}
+# Steps whose output columns are chosen by the step itself
+_NARROWING_OPS = {"select", "groupby_agg", "pivot", "value_counts"}
+
+
+def _as_list(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _resolve_step(step: Dict[str, Any], columns: List[str]) -> Tuple[Optional[Dict[str, Any]], Optional[List[str]]]:
+    """Resolve one step's column references against ``columns``.
+
+    Returns the resolved step (None when it cannot do anything) and the frame's
+    columns after it runs, or None when those depend on the data (pivot).
+    """
+    op = str(step.get("op", "")).lower()
+    step = dict(step, op=op)
+
+    def one(name: Any) -> Optional[str]:
+        return _resolve_column(columns, str(name)) if name else None
+
+    def many(names: Any) -> List[str]:
+        return [c for c in (one(n) for n in _as_list(names)) if c]
+
+    if op == "filter":
+        conditions = []
+        for cond in step.get("conditions") or []:
+            col = one(cond.get("column"))
+            if col and str(cond.get("operator", "==")).lower() in _FILTER_OPERATORS:
+                conditions.append(dict(cond, column=col))
+        return (dict(step, conditions=conditions) if conditions else None), columns
+    if op == "select":
+        resolved = many(step.get("columns"))
+        return (dict(step, columns=resolved), resolved) if resolved else (None, columns)
+    if op == "compute":
+        left, right = dict(step.get("left") or {}), dict(step.get("right") or {})
+        for spec in (left, right):
+            if spec.get("column"):
+                spec["column"] = one(spec["column"])
+        new_col = str(step.get("new_column") or "new")
+        return dict(step, left=left, right=right), columns + [new_col] * (new_col not in columns)
+    if op == "groupby_agg":
+        by = many(step.get("by"))
+        aggregations = []
+        for a in step.get("aggregations") or []:
+            col, func = one(a.get("column")), str(a.get("agg", "sum")).lower()
+            if col and func in {"sum", "mean", "count", "min", "max", "median"}:
+                aggregations.append({"column": col, "agg": func})
+        if not (by and aggregations):
+            return None, columns
+        # Mirrors the flattened names _op_groupby_agg produces
+        outputs = list(dict.fromkeys(f"{a['column']}_{a['agg']}" for a in aggregations))
+        return dict(step, by=by, aggregations=aggregations), by + outputs
+    if op in {"sort", "topk"}:
+        if op == "topk":
+            return dict(step, by=one(step.get("by"))), columns
+        return dict(step, by=many(step.get("by"))), columns
+    if op == "rename":
+        mapping = {(k if k in columns else one(k)): str(v) for k, v in (step.get("mapping") or {}).items()}
+        mapping = {k: v for k, v in mapping.items() if k}
+        return (dict(step, mapping=mapping), [mapping.get(c, c) for c in columns]) if mapping else (None, columns)
+    if op == "pivot":
+        resolved_names = {}
+        for key in ("index", "columns", "values"):
+            names = _as_list(step.get(key))
+            found = many(names)
+            if len(found) != len(names):
+                # pivot_table would raise on the unknown name, leaving the frame as it was
+                return None, columns
+            if names:
+                resolved_names[key] = found if isinstance(step.get(key), (list, tuple)) else found[0]
+        return dict(step, **resolved_names), None
+    if op == "cast":
+        types = {}
+        for key, target in (step.get("types") or {}).items():
+            col = one(key)
+            if col:
+                types[col] = target
+        return dict(step, types=types), columns
+    if op == "date_parse":
+        return dict(step, columns=many(step.get("columns"))), columns
+    if op == "date_trunc":
+        column = one(step.get("column"))
+        return (dict(step, column=column) if column else None), columns
+    if op == "window_rank":
+        by = one(step.get("by"))
+        if not by:
+            return None, columns
+        rank_col = str(step.get("rank_column") or "rank")
+        step = dict(step, by=by, partition_by=many(step.get("partition_by")), rank_column=rank_col)
+        return step, columns + [rank_col] * (rank_col not in columns)
+    if op in {"cumsum", "pct_change"}:
+        column = one(step.get("column"))
+        if not column:
+            return None, columns
+        new_col = str(step.get("new_column") or f"{column}_{op}")
+        step = dict(step, column=column, by=many(step.get("by")), new_column=new_col)
+        return step, columns + [new_col] * (new_col not in columns)
+    if op == "value_counts":
+        column = one(step.get("column"))
+        return (dict(step, column=column), [column, "count"]) if column else (None, columns)
+    if op in _PLAN_OPS:
+        return step, columns
+    return None, columns
+
+
+def _step_reads(step: Dict[str, Any]) -> Optional[set]:
+    """Columns a resolved step reads; None means it may read any column."""
+    op = step["op"]
+    if op == "filter":
+        return {c["column"] for c in step["conditions"]}
+    if op == "select":
+        return set(step["columns"])
+    if op == "compute":
+        return {s["column"] for s in (step["left"], step["right"]) if s.get("column")}
+    if op == "groupby_agg":
+        return set(step["by"]) | {a["column"] for a in step["aggregations"]}
+    if op == "sort":
+        return set(step["by"]) or None
+    if op == "topk":
+        return {step["by"]} if step.get("by") else set()
+    if op == "pivot":
+        if step.get("values") is None:
+            return None
+        return {c for key in ("index", "columns", "values") for c in _as_list(step.get(key))}
+    if op in {"dropna", "dedupe"}:
+        return {str(c) for c in _as_list(step.get("subset"))} or None
+    if op == "cast":
+        return set(step["types"])
+    if op == "date_parse":
+        return set(step["columns"])
+    if op in {"date_trunc", "value_counts"}:
+        return {step["column"]}
+    if op == "window_rank":
+        return {step["by"], *step["partition_by"]}
+    if op in {"cumsum", "pct_change"}:
+        return {step["column"], *step["by"]}
+    return set()
+
+
+def _step_writes(step: Dict[str, Any]) -> set:
+    """Columns a resolved step creates or overwrites in place."""
+    op = step["op"]
+    if op == "compute":
+        return {str(step.get("new_column") or "new")}
+    if op == "cast":
+        return set(step["types"])
+    if op == "date_parse":
+        return set(step["columns"])
+    if op == "date_trunc":
+        return {step["column"]}
+    if op == "window_rank":
+        return {step["rank_column"]}
+    if op in {"cumsum", "pct_change"}:
+        return {step["new_column"]}
+    return set()
+
+
+def _filter_commutes_with(prev: Dict[str, Any], filter_step: Dict[str, Any]) -> bool:
+    """Whether ``filter_step`` can run before ``prev`` with the same result."""
+    cols = _step_reads(filter_step) or set()
+    op = prev["op"]
+    if op in {"sort", "select", "dropna"}:
+        return True
+    if op in {"compute", "cast", "date_parse", "date_trunc"}:
+        return not (cols & _step_writes(prev))
+    if op == "groupby_agg":
+        # Dropping whole groups by their key leaves the other groups' aggregates unchanged
+        return cols <= set(prev["by"])
+    return False
+
+
+def compile_analysis_plan(plan: Dict[str, Any], columns: List[str]) -> Dict[str, Any]:
+    """Validate and optimize a plan for a frame with ``columns``.
+
+    Column references are resolved once, against the columns each step will
+    see. Adjacent filters are fused into one mask and filters are pushed ahead
+    of sort/select/compute and, on key columns, groupby_agg. Columns no later
+    step reads are projected away right after the leading filters, and a
+    filter followed by a select runs as one ``.loc``. Steps after a pivot,
+    whose output columns depend on the data, are left for the interpreter to
+    resolve at run time.
+
+    Returns ``{"steps": [...], "rewrites": [...], "columns": [...]}`` where
+    ``columns`` lists the input columns the plan reads (None for all of them);
+    run it with ``_run_plan_steps``.
+    """
+    input_columns = [str(c) for c in columns]
+    steps: List[Dict[str, Any]] = []
+    rewrites: List[str] = []
+    schema: Optional[List[str]] = input_columns
+    raw_steps = list(plan.get("steps", []))
+    for position, step in enumerate(raw_steps):
+        if schema is None:
+            steps.extend(dict(s, op=str(s.get("op", "")).lower()) for s in raw_steps[position:])
+            break
+        resolved, schema = _resolve_step(step, schema)
+        if resolved is None:
+            rewrites.append(f"dropped no-op step {str(step.get('op', ''))!r}")
+        else:
+            steps.append(resolved)
+    # Only the steps before the first pivot (inclusive) have resolved columns
+    barrier = next((i + 1 for i, s in enumerate(steps) if s["op"] == "pivot"), len(steps))
+    head, tail = steps[:barrier], steps[barrier:]
+
+    def fuse_filters(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        fused: List[Dict[str, Any]] = []
+        for item in items:
+            if item["op"] == "filter" and fused and fused[-1]["op"] == "filter":
+                fused[-1] = dict(fused[-1], conditions=fused[-1]["conditions"] + item["conditions"])
+                rewrites.append("fused adjacent filters")
+            else:
+                fused.append(item)
+        return fused
+
+    head = fuse_filters(head)
+    moved = True
+    while moved:
+        moved = False
+        for i in range(1, len(head)):
+            if head[i]["op"] == "filter" and head[i - 1]["op"] != "filter" and _filter_commutes_with(head[i - 1], head[i]):
+                rewrites.append(f"pushed filter ahead of {head[i - 1]['op']}")
+                head[i - 1], head[i] = head[i], head[i - 1]
+                moved = True
+        head = fuse_filters(head)
+
+    # Liveness: the columns each step still needs, walking back from the end.
+    # Every referenced column stays live, so run-time name resolution in the
+    # op handlers never falls through to a fuzzy match on a projected frame.
+    live: Optional[set] = None
+    live_before: List[Optional[set]] = []
+    for step in reversed(head):
+        reads = _step_reads(step)
+        if step["op"] in _NARROWING_OPS:
+            live = reads
+        elif step["op"] == "rename":
+            inverse = {v: k for k, v in step["mapping"].items()}
+            live = None if live is None else {inverse.get(c, c) for c in live} | set(step["mapping"])
+        elif live is not None:
+            live = None if reads is None else (live - _step_writes(step)) | reads
+        live_before.insert(0, live)
+
+    reads = live_before[0] if head else None
+
+    # A filter directly followed by a select becomes one .loc
+    fused_head: List[Dict[str, Any]] = []
+    fused_live: List[Optional[set]] = []
+    for step, live in zip(head, live_before):
+        if step["op"] == "select" and fused_head and fused_head[-1]["op"] == "filter" and "select" not in fused_head[-1]:
+            fused_head[-1] = dict(fused_head[-1], select=step["columns"])
+            rewrites.append("fused filter and select")
+            continue
+        fused_head.append(step)
+        fused_live.append(live)
+    head = fused_head
+
+    # Project away unread columns once, after the leading filters, when a
+    # row-copying step would otherwise carry them along
+    lead = 0
+    while lead < len(head) and head[lead]["op"] == "filter":
+        lead += 1
+    needed = fused_live[lead] if lead < len(head) else None
+    prefix = head[: next((i for i, s in enumerate(head) if s["op"] in _NARROWING_OPS), len(head))]
+    if (
+        needed is not None
+        and len(needed) < len(input_columns)
+        and not (lead and "select" in head[lead - 1])
+        and any(s["op"] in _ROW_COPYING_OPS for s in prefix)
+    ):
+        projection = [c for c in input_columns if c in needed]
+        if lead:
+            head[lead - 1] = dict(head[lead - 1], project=projection)
+        else:
+            head.insert(0, {"op": "select", "columns": projection})
+        rewrites.append(f"projected {len(projection)} of {len(input_columns)} columns")
+
+    return {
+        "steps": head + tail,
+        "rewrites": rewrites,
+        "columns": None if reads is None else [c for c in input_columns if c in reads],
+    }
+
+
+def _run_plan_steps(working: pd.DataFrame, steps: Iterable[Dict[str, Any]], log: Callable[[str], None]) -> pd.DataFrame:
+    for step in steps:
+        handler = _PLAN_OPS.get(str(step.get("op", "")).lower())
+        if handler is not None:
+            working = handler(working, step, log)
+    return working
+
+
+# -------------------------
+# Plan prefix cache
+# -------------------------
+
+@st.cache_resource(show_spinner=False)
+def _plan_prefix_cache() -> _LRUCache:
+    """Intermediate plan results shared across sessions; budget in MB via PLAN_CACHE_MAX_MB."""
+    return _LRUCache(_get_int_setting("PLAN_CACHE_MAX_MB", 512) * 1024 * 1024, sizeof=lambda v: _frame_nbytes(v[0]))
+
+
+def _plan_prefix_keys(source: Tuple[Any, ...], steps: List[Dict[str, Any]]) -> List[Tuple[Any, ...]]:
+    """Cache key of every step prefix of a compiled plan.
+
+    ``source`` identifies the input frame (dataset version and read spec); the
+    steps are hashed as canonical JSON, chained so each key covers its whole
+    prefix.
+    """
+    digest = hashlib.blake2b(repr(source).encode("utf-8"), digest_size=16)
+    keys = []
+    for step in steps:
+        digest.update(json.dumps(step, sort_keys=True, default=str).encode("utf-8"))
+        keys.append(source + (digest.copy().hexdigest(),))
+    return keys
+
+
+def _execute_analysis_plan(
+    df: Union[pd.DataFrame, Callable[[], pd.DataFrame]],
+    plan: Dict[str, Any],
+    typed: bool = False,
+    compiled: bool = True,
+    program: Optional[Dict[str, Any]] = None,
+    cache_source: Optional[Tuple[Any, ...]] = None,
+) -> Tuple[pd.DataFrame, List[str]]:
+    # ``df`` may be a loader, called only when no cached prefix covers the plan
+    def prepare() -> pd.DataFrame:
+        frame = df() if callable(df) else df
+        # A frame from load_typed_dataset is already coerced; steps only ever replace
+        # whole columns, so a shallow copy keeps the cached frame intact
+        return frame.copy(deep=False) if typed else _smart_coerce_dataframe(frame)
+
+    working: Optional[pd.DataFrame] = None if callable(df) else prepare()
+    logs: List[str] = []
+
+    if compiled:
+        # ``program`` is a plan already compiled for this frame's source (see execute_plan_lazily)
+        if program is None:
+            working = working if working is not None else prepare()
+            program = compile_analysis_plan(plan, list(working.columns))
+        if program["rewrites"]:
+            logs.append("compiled plan: " + "; ".join(dict.fromkeys(program["rewrites"])))
+        steps = program["steps"]
+        # With a ``cache_source``, resume from the longest prefix already computed
+        # for that input and keep every new intermediate frame (with its step logs)
+        keys = _plan_prefix_keys(cache_source, steps) if cache_source is not None else []
+        step_logs: List[str] = []
+        done = 0
+        for i in range(len(keys), 0, -1):
+            hit = _plan_prefix_cache().get(keys[i - 1])
+            if hit is not None:
+                working, step_logs, done = hit[0].copy(deep=False), list(hit[1]), i
+                logs.append(f"plan cache hit: reused {i} of {len(steps)} steps")
+                break
+        if working is None:
+            working = prepare()
+        if (
+            done == 0
+            and len(working) >= PARALLEL_MIN_ROWS
+            and PLAN_WORKERS > 1
+            and _parallel_split(steps) is not None
+        ):
+            gate = _parallel_gate()
+            # Another session's plan holds the workers: run this one on one core
+            # rather than forking more processes or waiting for them
+            if gate.acquire(blocking=False):
                 try:
-                    working[col] = pd.to_datetime(series, errors="coerce")
+                    result, parallel_logs = execute_plan_parallel(working, program)
+                    if keys:
+                        _plan_prefix_cache().put(keys[-1], (result.copy(deep=False), parallel_logs))
+                    return result, logs + parallel_logs
                 except Exception:
-                    pass
-    return working
+                    logger.exception("Parallel plan execution failed; running on one core")
+                finally:
+                    gate.release()
+            else:
+                logs.append("parallel: workers busy with another plan; running on one core")
+        for i in range(done, len(steps)):
+            working = _run_plan_steps(working, steps[i : i + 1], step_logs.append)
+            if keys:
+                _plan_prefix_cache().put(keys[i], (working.copy(deep=False), list(step_logs)))
+        logs.extend(step_logs)
+    else:
+        working = _run_plan_steps(working if working is not None else prepare(), plan.get("steps", []), logs.append)
 
+    # Final compaction to avoid extremely wide outputs
+    if len(working.columns) > 50:
+        working = working.iloc[:, :50]
+        logs.append("trim columns to first 50 for display")
 
-def _parse_dtype(name: str):
-    t = str(name).lower()
-    if t in {"int", "int64", "integer"}:
-        return "int64"
-    if t in {"float", "float64", "double"}:
-        return "float64"
-    if t in {"str", "string", "text"}:
-        return "string"
-    if t in {"bool", "boolean"}:
-        return "boolean"
-    if t in {"datetime", "timestamp", "date"}:
-        return "datetime64[ns]"
-    return None
+    return working, logs
 
 
-def _date_trunc(series: pd.Series, freq: str) -> pd.Series:
-    f = freq.lower()
-    try:
-        s = pd.to_datetime(series, errors="coerce")
-        if f == "day":
-            return s.dt.floor("D")
-        if f == "week":
-            return s.dt.to_period("W").apply(lambda p: p.start_time)
-        if f == "month":
-            return s.dt.to_period("M").dt.to_timestamp()
-        if f == "quarter":
-            return s.dt.to_period("Q").dt.to_timestamp()
-        if f == "year":
-            return s.dt.to_period("Y").dt.to_timestamp()
-    except Exception:
-        pass
-    return series
+# -------------------------
+# Lazy plan execution
+# -------------------------
 
+# Filter operators that translate to Parquet predicates matching the same rows.
+# "!=" and "not_in" are left out: pandas keeps NaN rows for them, Arrow drops nulls.
+_PUSHDOWN_OPERATORS = {"==": "==", ">": ">", ">=": ">=", "<": "<", "<=": "<=", "in": "in"}
 
-def _execute_analysis_plan(df: pd.DataFrame, plan: Dict[str, Any]) -> Tuple[pd.DataFrame, List[str]]:
-    working = _smart_coerce_dataframe(df)
-    logs: List[str] = []
 
-    def log(msg: str) -> None:
-        logs.append(msg)
+def _pushdown_value_kind(arrow_type: pa.DataType, coercion_kind: Optional[str]) -> Optional[str]:
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+        return "number"
+    if (pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)) and coercion_kind in {"string", "category"}:
+        return "text"
+    return None
+
+
+def _pushdown_accepts(value: Any, kind: str) -> bool:
+    if kind == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, str)
+
 
-    steps: List[Dict[str, Any]] = list(plan.get("steps", []))
+def _pushdown_predicates(
+    steps: List[Dict[str, Any]], arrow_schema: pa.Schema, coercion: Dict[str, Dict[str, Any]]
+) -> List[Tuple[str, str, Any]]:
+    """Parquet predicates implied by the leading filters of a compiled plan.
+
+    Only conditions whose column is stored with the type the plan sees and whose
+    value has a matching type are pushed: numbers against numeric columns, and
+    strings against uncoerced text columns for ``==``/``in``. Anything else is
+    left to pandas, so the predicates never drop a row the plan would keep; the
+    filters are re-applied on the rows read.
+    """
+    predicates: List[Tuple[str, str, Any]] = []
+    names = set(arrow_schema.names)
     for step in steps:
-        op = str(step.get("op", "")).lower()
-        if op == "filter":
-            conditions = step.get("conditions") or []
-            mask = pd.Series(True, index=working.index)
-            for cond in conditions:
-                col_raw = cond.get("column")
-                optr = str(cond.get("operator", "==")).lower()
-                val = cond.get("value")
-                values = cond.get("values")
-                ci = bool(cond.get("case_insensitive", True))
-                col = _resolve_column(working, str(col_raw))
-                if not col or col not in working.columns:
-                    continue
-                series = working[col]
-                if optr in {"==", "!=", ">", ">=", "<", "<="}:
-                    right = _as_number(val)
-                    try:
-                        expr_mask = getattr(series, "__{}__".format(
-                            {"==": "eq", "!=": "ne", ">": "gt", ">=": "ge", "<": "lt", "<=": "le"}[optr]
-                        ))(right)
-                    except Exception:
-                        expr_mask = series.astype(str).str.lower().eq(str(val).lower()) if ci else series.astype(str).eq(str(val))
-                        if optr == "!=":
-                            expr_mask = ~expr_mask
-                elif optr in {"contains"}:
-                    expr_mask = series.astype(str).str.contains(str(val), case=not ci, na=False)
-                elif optr in {"in", "not_in"}:
-                    vals = [ _as_number(v) for v in (values if isinstance(values, list) else [val]) ]
-                    expr_mask = series.isin(vals)
-                    if optr == "not_in":
-                        expr_mask = ~expr_mask
-                elif optr in {"between"}:
-                    arr = values if isinstance(values, list) else [None, None]
-                    left, right = (_as_number(arr[0]), _as_number(arr[1]))
-                    expr_mask = series.between(left, right, inclusive="both")
-                else:
-                    continue
-                mask &= expr_mask.fillna(False)
-            working = working[mask]
-            log(f"filter rows -> {len(working)} rows")
-
-        elif op == "select":
-            columns = [c for c in (step.get("columns") or []) if _resolve_column(working, str(c))]
-            resolved = [_resolve_column(working, str(c)) for c in columns]
-            resolved = [c for c in resolved if c is not None]
-            if resolved:
-                working = working.loc[:, resolved]  # type: ignore[index]
-                log(f"select columns -> {resolved}")
-
-        elif op == "compute":
-            new_col = str(step.get("new_column") or "new")
-            operation = str(step.get("operation") or "add").lower()
-            left_spec = step.get("left") or {}
-            right_spec = step.get("right") or {}
-            left_col = _resolve_column(working, str(left_spec.get("column"))) if left_spec.get("column") else None
-            right_col = _resolve_column(working, str(right_spec.get("column"))) if right_spec.get("column") else None
-            left_val = working[left_col] if left_col else _as_number(left_spec.get("value"))
-            right_val = working[right_col] if right_col else _as_number(right_spec.get("value"))
+        if step["op"] != "filter":
+            break
+        for cond in step["conditions"]:
+            col = cond["column"]
+            optr = str(cond.get("operator", "==")).lower()
+            if col not in names or (optr not in _PUSHDOWN_OPERATORS and optr != "between"):
+                continue
+            kind = _pushdown_value_kind(arrow_schema.field(col).type, (coercion.get(col) or {}).get("kind"))
+            if kind is None:
+                continue
+            if optr == "between":
+                bounds = cond.get("values") if isinstance(cond.get("values"), list) else []
+                if kind == "number" and len(bounds) == 2:
+                    lo, hi = _as_number(bounds[0]), _as_number(bounds[1])
+                    if _pushdown_accepts(lo, kind) and _pushdown_accepts(hi, kind):
+                        predicates += [(col, ">=", lo), (col, "<=", hi)]
+            elif optr == "in":
+                raw = cond.get("values")
+                values = [_as_number(v) for v in (raw if isinstance(raw, list) else [cond.get("value")])]
+                if values and all(_pushdown_accepts(v, kind) for v in values):
+                    predicates.append((col, "in", values))
+            elif kind == "number" or optr == "==":
+                value = _as_number(cond.get("value"))
+                if _pushdown_accepts(value, kind):
+                    predicates.append((col, _PUSHDOWN_OPERATORS[optr], value))
+    return predicates
+
+
+def scan_dataset(
+    data_path: Path, columns: Optional[List[str]] = None, predicates: Optional[List[Tuple[str, str, Any]]] = None
+) -> pd.DataFrame:
+    """Read only ``columns`` of the rows matching ``predicates``, typed by the coercion schema."""
+    data_path = Path(data_path)
+    raw = _read_dataset_file(data_path, columns, predicates)
+    return _apply_coercion_schema(raw, dataset_coercion_schema(data_path))
+
+
+def dataset_preview(data_path: Path, rows: int = 10) -> pd.DataFrame:
+    """The first ``rows`` typed rows, read without loading the whole dataset."""
+    data_path = Path(data_path)
+    cached = _dataset_cache().peek(_file_version(data_path) + ("typed",))
+    if cached is not None:
+        return cached.head(rows)
+    if data_path.suffix == ".parquet":
+        parquet = pq.ParquetFile(data_path, memory_map=True)
+        batch = next(parquet.iter_batches(batch_size=rows), None)
+        table = pa.Table.from_batches([batch]) if batch is not None else parquet.schema_arrow.empty_table()
+        raw = table.to_pandas(types_mapper=_ARROW_STRING_DTYPES.get).head(rows)
+    else:
+        raw = pd.read_csv(data_path, nrows=rows)
+    return _apply_coercion_schema(raw, dataset_coercion_schema(data_path))
+
+
+def execute_plan_lazily(data_path: Path, plan: Dict[str, Any]) -> Tuple[pd.DataFrame, List[str]]:
+    """Run ``plan`` against the stored dataset, reading only what it needs.
+
+    The plan is compiled against the file's column names; its input columns
+    and pushable leading filters become a Parquet read that skips other
+    columns and non-matching row groups, so plans over a slice of a large file
+    never materialize the rest. When even that read would exceed
+    ``PLAN_MEMORY_BUDGET_MB`` the plan is streamed in chunks if its steps allow
+    it and its result fits the budget (see ``execute_plan_chunked``). When the typed frame is already cached
+    (or the dataset is a legacy CSV) the plan runs on the full frame instead.
+    """
+    data_path = Path(data_path)
+    program = compile_analysis_plan(plan, dataset_columns(data_path))
+    cached = _dataset_cache().peek(_file_version(data_path) + ("typed",))
+    version = _file_version(data_path)
+    if cached is not None or data_path.suffix != ".parquet":
+        frame = cached if cached is not None else load_typed_dataset(data_path)
+        return _execute_analysis_plan(frame, plan, typed=True, program=program, cache_source=version + ("typed",))
+
+    predicates = _pushdown_predicates(program["steps"], pq.read_schema(data_path), dataset_coercion_schema(data_path))
+    columns = program["columns"]
+    source = version + (tuple(columns) if columns is not None else None, repr(predicates))
+    final_key = _plan_prefix_keys(source, program["steps"])[-1] if program["steps"] else None
+    hit = _plan_prefix_cache().get(final_key) if final_key else None
+    if hit is not None:
+        # Same plan over the same read: skip the read entirely
+        return hit[0].copy(deep=False), [f"plan cache hit: reused all {len(program['steps'])} steps"] + list(hit[1])
+    notes: List[str] = []
+    budget = PLAN_MEMORY_BUDGET_MB * 1024 * 1024
+    estimate = _estimated_scan_bytes(data_path, program["columns"])
+    if estimate > budget:
+        split, reason = _chunk_split(program["steps"])
+        if split is not None:
             try:
-                if operation == "add":
-                    working[new_col] = left_val + right_val  # type: ignore[operator]
-                elif operation == "subtract":
-                    working[new_col] = left_val - right_val  # type: ignore[operator]
-                elif operation == "multiply":
-                    working[new_col] = left_val * right_val  # type: ignore[operator]
-                elif operation == "divide":
-                    working[new_col] = left_val / right_val  # type: ignore[operator]
-                log(f"compute {new_col} = {operation}(...)")
-            except Exception:
-                pass
+                result, logs = execute_plan_chunked(data_path, program, predicates, budget)
+            except ValueError as exc:
+                reason = str(exc)
+            else:
+                if final_key:
+                    _plan_prefix_cache().put(final_key, (result.copy(deep=False), logs))
+                return result, logs
+        notes.append(
+            f"in-memory execution: {reason}; the {estimate / 1e6:,.0f} MB read exceeds"
+            f" the {PLAN_MEMORY_BUDGET_MB:,} MB plan budget"
+        )
+        logger.warning("Plan for %s runs in memory over budget: %s", data_path, reason)
 
-        elif op == "groupby_agg":
-            by = [c for c in (step.get("by") or []) if _resolve_column(working, str(c))]
-            by_resolved = [_resolve_column(working, str(c)) for c in by]
-            by_resolved = [c for c in by_resolved if c is not None]
-            aggs_conf = step.get("aggregations") or []
-            agg_map: Dict[str, List[str]] = {}
-            for a in aggs_conf:
-                col = _resolve_column(working, str(a.get("column")))
-                func = str(a.get("agg", "sum")).lower()
-                if col and func in {"sum", "mean", "count", "min", "max", "median"}:
-                    agg_map.setdefault(col, []).append(func)
-            if by_resolved and agg_map:
-                grouped = working.groupby(by_resolved, dropna=False).agg(agg_map)
-                # Flatten MultiIndex columns if present
-                grouped.columns = ["_".join([str(c) for c in col]).strip("_") if isinstance(col, tuple) else str(col) for col in grouped.columns.values]
-                working = grouped.reset_index()
-                log(f"groupby {by_resolved} agg {agg_map}")
-
-        elif op == "sort":
-            by = [c for c in (step.get("by") or []) if _resolve_column(working, str(c))]
-            by_resolved = [_resolve_column(working, str(c)) for c in by]
-            by_resolved = [c for c in by_resolved if c is not None]
-            ascending = step.get("ascending", False)
-            try:
-                working = working.sort_values(by=by_resolved or working.columns.tolist(), ascending=ascending)
-                log(f"sort by {by_resolved or list(working.columns)} asc={ascending}")
-            except Exception:
-                pass
+    if columns is None and not predicates:
+        result, logs = _execute_analysis_plan(
+            load_typed_dataset(data_path), plan, typed=True, program=program, cache_source=version + ("typed",)
+        )
+        return result, notes + logs
+    scans: List[str] = []
 
-        elif op == "topk":
-            k = int(step.get("k", 5))
-            by = _resolve_column(working, str(step.get("by"))) if step.get("by") else None
-            try:
-                if by and pd.api.types.is_numeric_dtype(working[by]):
-                    working = working.nlargest(k, by)
-                else:
-                    working = working.head(k)
-                log(f"topk {k} by {by or 'head'}")
-            except Exception:
-                working = working.head(k)
-                log(f"topk {k} (fallback head)")
-
-        elif op == "rename":
-            mapping = step.get("mapping") or {}
-            safe_map = { (k if k in working.columns else _resolve_column(working, str(k))): str(v) for k, v in mapping.items() }
-            safe_map = { k: v for k, v in safe_map.items() if k }
-            if safe_map:
-                working = working.rename(columns=safe_map)
-                log(f"rename columns {safe_map}")
-
-        elif op == "pivot":
-            index = step.get("index")
-            values = step.get("values")
-            columns = step.get("columns")
-            aggfunc = step.get("aggfunc", "sum")
-            fill_value = step.get("fill_value")
-            try:
-                pivoted = pd.pivot_table(
-                    working,
-                    index=index,
-                    columns=columns,
-                    values=values,
-                    aggfunc=aggfunc,
-                    fill_value=fill_value,
-                )
-                if isinstance(pivoted.columns, pd.MultiIndex):
-                    pivoted.columns = ["_".join([str(c) for c in col]).strip("_") for col in pivoted.columns]
-                working = pivoted.reset_index()
-                log("pivot table")
-            except Exception:
-                pass
+    def scan() -> pd.DataFrame:
+        frame = scan_dataset(data_path, columns, predicates)
+        total = read_dataset_meta(data_path).get("rows")
+        scans.append(f"scan {len(frame.columns)} columns, {len(frame):,}" + (f" of {total:,}" if total else "") + " rows")
+        if predicates:
+            scans[-1] += " with " + ", ".join(f"{c} {o} {v!r}" for c, o, v in predicates)
+        return frame
 
+    result, logs = _execute_analysis_plan(scan, plan, typed=True, program=program, cache_source=source)
+    return result, notes + scans + logs
+
+
+# -------------------------
+# Out-of-core chunked execution
+# -------------------------
+
+# Peak memory budget for one plan's input; larger reads are streamed in chunks
+PLAN_MEMORY_BUDGET_MB = _get_int_setting("PLAN_MEMORY_BUDGET_MB", 1024)
+# A chunk is converted, filtered and folded while the next one is read: budget
+# this many copies of it
+CHUNK_MEMORY_FACTOR = 4
+# Row-wise steps: running them chunk by chunk gives the same rows
+_CHUNK_ROW_OPS = {"filter", "select", "compute", "cast", "date_parse", "date_trunc", "rename", "fillna", "dropna"}
+# Steps folded across chunks by _ChunkMerger
+_CHUNK_MERGE_OPS = {"groupby_agg", "value_counts", "topk", "dedupe", "limit"}
+_CHUNK_AGGREGATIONS = {"sum", "count", "min", "max", "mean"}
+
+
+def _estimated_scan_bytes(data_path: Path, columns: Optional[List[str]]) -> int:
+    """Uncompressed size of ``columns`` (all when None) from the Parquet footer."""
+    metadata = pq.read_metadata(data_path)
+    wanted = set(columns) if columns is not None else None
+    total = 0
+    for rg in range(metadata.num_row_groups):
+        group = metadata.row_group(rg)
+        for j in range(group.num_columns):
+            column = group.column(j)
+            if wanted is None or column.path_in_schema in wanted:
+                total += column.total_uncompressed_size
+    return total
+
+
+def _chunk_split(steps: List[Dict[str, Any]]) -> Tuple[Optional[int], str]:
+    """Position of the step that merges chunk results (``len(steps)`` if none).
+
+    Returns None and the reason when a step before it needs the whole frame.
+    """
+    for i, step in enumerate(steps):
+        op = step["op"]
+        if op in _CHUNK_ROW_OPS:
+            continue
+        if op == "groupby_agg":
+            unsupported = sorted({a["agg"] for a in step["aggregations"]} - _CHUNK_AGGREGATIONS)
+            if unsupported:
+                return None, f"groupby_agg {', '.join(unsupported)} is not chunk-decomposable"
+        if op == "dedupe" and step.get("keep", "first") not in ("first", "last"):
+            return None, "dedupe keep=False is not chunk-decomposable"
+        if op in _CHUNK_MERGE_OPS:
+            return i, ""
+        return None, f"step {op!r} is not chunk-decomposable"
+    return len(steps), ""
+
+
+class _ChunkMerger:
+    """Folds one merging step over chunk results.
+
+    The state kept between chunks is proportional to the step's output
+    (groups, distinct values, k rows), not to the rows read. Partial
+    aggregates are re-merged whenever they outgrow a quarter of the budget.
+    Without a merging step every surviving row is kept, and ValueError is
+    raised once those rows outgrow the budget.
+    """
+
+    def __init__(self, step: Optional[Dict[str, Any]], budget_bytes: int) -> None:
+        self.step = step or {}
+        self.op = self.step.get("op")
+        self.budget_bytes = budget_bytes
+        self.parts: List[Any] = []
+        self.rows = 0
+        self.kept_bytes = 0
+        self.done = False
+        if self.op == "groupby_agg":
+            # mean is carried as sum and count
+            self.partial_map: Dict[str, List[str]] = {}
+            for a in self.step["aggregations"]:
+                for func in ("sum", "count") if a["agg"] == "mean" else (a["agg"],):
+                    funcs = self.partial_map.setdefault(a["column"], [])
+                    if func not in funcs:
+                        funcs.append(func)
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        step, op = self.step, self.op
+        if op == "groupby_agg":
+            self.parts.append(chunk.groupby(step["by"], dropna=False, observed=True).agg(self.partial_map))
+            if len(self.parts) > 1 and sum(_frame_nbytes(p) for p in self.parts) > self.budget_bytes // 4:
+                self.parts = [self._merge_groups()]
+        elif op == "value_counts":
+            counts = chunk[step["column"]].value_counts()
+            counts = counts[counts > 0]
+            if isinstance(counts.index, pd.CategoricalIndex):
+                counts.index = counts.index.astype(counts.index.categories.dtype)
+            self.parts = [self.parts[0].add(counts, fill_value=0) if self.parts else counts]
+        elif op == "topk":
+            k, by = int(step.get("k", 5)), step.get("by")
+            frame = pd.concat(self.parts + [chunk]) if self.parts else chunk
+            if by and by in frame.columns and pd.api.types.is_numeric_dtype(frame[by]):
+                self.parts = [frame.nlargest(k, by)]
+            else:
+                self.parts = [frame.head(k)]
+                self.done = len(self.parts[0]) >= k
+        elif op == "dedupe":
+            frame = pd.concat(self.parts + [chunk]) if self.parts else chunk
+            self.parts = [frame.drop_duplicates(subset=step.get("subset"), keep=step.get("keep", "first"))]
         elif op == "limit":
             n = int(step.get("n", 10))
-            working = working.head(n)
-            log(f"limit {n}")
+            self.parts.append(chunk.head(n - self.rows))
+            self.rows += len(self.parts[-1])
+            self.done = self.rows >= n
+        else:
+            # Row-wise plan: the result is every surviving row
+            self.parts.append(chunk)
+            self.kept_bytes += _frame_nbytes(chunk)
+            if self.kept_bytes > self.budget_bytes:
+                raise ValueError(f"the rows it keeps outgrow {self.budget_bytes / 2**20:,.0f} MB")
+
+    def absorb(self, parts: List[Any]) -> None:
+        """Fold another merger's partial state (e.g. from a worker) into this one."""
+        if self.op == "groupby_agg":
+            self.parts.extend(parts)
+        elif self.op == "value_counts":
+            for counts in parts:
+                self.parts = [self.parts[0].add(counts, fill_value=0) if self.parts else counts]
+        else:
+            # topk/dedupe/limit state is itself a set of rows
+            for frame in parts:
+                self.add(frame)
+
+    def _merge_groups(self) -> pd.DataFrame:
+        combined = pd.concat(self.parts)
+        merge = {col: ("sum" if col[1] in ("sum", "count") else col[1]) for col in combined.columns}
+        levels = list(range(combined.index.nlevels))
+        return combined.groupby(level=levels, dropna=False, observed=True).agg(merge)
+
+    def result(self, columns: List[str]) -> Tuple[pd.DataFrame, str]:
+        step, op = self.step, self.op
+        if op == "groupby_agg":
+            if not self.parts:
+                return pd.DataFrame(columns=step["by"]), f"groupby {step['by']} (no rows)"
+            merged = self._merge_groups()
+            agg_map: Dict[str, List[str]] = {}
+            for a in step["aggregations"]:
+                agg_map.setdefault(a["column"], []).append(a["agg"])
+            out = pd.DataFrame(index=merged.index)
+            for col, funcs in agg_map.items():
+                for func in funcs:
+                    if func == "mean":
+                        out[f"{col}_mean"] = merged[(col, "sum")] / merged[(col, "count")]
+                    else:
+                        out[f"{col}_{func}"] = merged[(col, func)]
+            return out.reset_index(), f"groupby {step['by']} agg {agg_map} (merged from chunks)"
+        if op == "value_counts":
+            counts = self.parts[0] if self.parts else pd.Series(dtype="int64")
+            counts = counts.astype("int64")
+            return _value_counts_frame(counts, step["column"], step), f"value_counts {step['column']} (merged from chunks)"
+        frame = pd.concat(self.parts) if self.parts else pd.DataFrame(columns=columns)
+        if op == "topk":
+            return frame, f"topk {step.get('k', 5)} by {step.get('by') or 'head'} (merged from chunks)"
+        if op == "dedupe":
+            return frame, f"dedupe subset={step.get('subset')} keep={step.get('keep', 'first')} (merged from chunks)"
+        if op == "limit":
+            return frame, f"limit {step.get('n', 10)}"
+        return frame, f"{len(frame):,} rows kept"
+
+
+def execute_plan_chunked(
+    data_path: Path,
+    program: Dict[str, Any],
+    predicates: Optional[List[Tuple[str, str, Any]]] = None,
+    budget_bytes: Optional[int] = None,
+) -> Tuple[pd.DataFrame, List[str]]:
+    """Stream the stored dataset through a compiled plan in bounded chunks.
+
+    The row-wise steps before the first merging step (groupby_agg with
+    sum/count/min/max/mean, value_counts, topk, dedupe, limit) run on each
+    chunk; that step folds the chunk results into a partial state, and the
+    remaining steps run in memory on the merged result. Chunks are sized so a
+    few copies of one fit in ``budget_bytes``. Raises ValueError for plans
+    that cannot be split this way, and for plans without a merging step whose
+    surviving rows outgrow ``budget_bytes``.
+    """
+    data_path = Path(data_path)
+    budget_bytes = budget_bytes or PLAN_MEMORY_BUDGET_MB * 1024 * 1024
+    steps = program["steps"]
+    split, reason = _chunk_split(steps)
+    if split is None:
+        raise ValueError(reason)
+    prefix, suffix = steps[:split], steps[split + 1 :]
+    merger = _ChunkMerger(steps[split] if split < len(steps) else None, budget_bytes)
+
+    columns = program["columns"]
+    num_rows = pq.read_metadata(data_path).num_rows
+    row_bytes = max(1, _estimated_scan_bytes(data_path, columns) // max(num_rows, 1))
+    chunk_rows = int(min(max(budget_bytes // (CHUNK_MEMORY_FACTOR * row_bytes), 1_000), 1_000_000))
+    coercion = dataset_coercion_schema(data_path)
+    dataset = ds.dataset(data_path, format="parquet")
+    batches = dataset.to_batches(
+        columns=columns,
+        filter=pq.filters_to_expression(predicates) if predicates else None,
+        batch_size=chunk_rows,
+        batch_readahead=1,
+        fragment_readahead=1,
+    )
+    chunks = rows_read = rows_kept = 0
+    output_columns: List[str] = []
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        raw = batch.to_pandas(types_mapper=_ARROW_STRING_DTYPES.get)
+        chunk = _run_plan_steps(_apply_coercion_schema(raw, coercion), prefix, lambda _msg: None)
+        chunks, rows_read, rows_kept = chunks + 1, rows_read + batch.num_rows, rows_kept + len(chunk)
+        output_columns = list(chunk.columns)
+        merger.add(chunk)
+        if merger.done:
+            break
+
+    result, merged = merger.result(output_columns)
+    logs = [
+        f"chunked scan: {chunks} chunks of up to {chunk_rows:,} rows, {rows_read:,} rows read, {rows_kept:,} kept"
+        + (f" by {', '.join(s['op'] for s in prefix)}" if prefix else ""),
+        merged,
+    ]
+    result, suffix_logs = _execute_analysis_plan(result, {"steps": suffix}, typed=True, compiled=False)
+    return result, logs + suffix_logs
 
-        elif op == "dropna":
-            subset = step.get("subset")
-            how = step.get("how", "any")
-            try:
-                working = working.dropna(subset=subset, how=how)
-                log(f"dropna subset={subset} how={how}")
-            except Exception:
-                pass
 
-        elif op == "fillna":
-            value = step.get("value")
-            try:
-                if isinstance(value, dict):
-                    working = working.fillna(value)
-                else:
-                    working = working.fillna(value)
-                log("fillna applied")
-            except Exception:
-                pass
+# -------------------------
+# Parallel plan execution
+# -------------------------
 
-        elif op == "cast":
-            types = step.get("types") or {}
-            try:
-                for k, v in list(types.items()):
-                    col = _resolve_column(working, str(k))
-                    if not col:
-                        continue
-                    target = _parse_dtype(v)
-                    if target == "datetime64[ns]":
-                        working[col] = pd.to_datetime(working[col], errors="coerce")
-                    elif target:
-                        working[col] = working[col].astype(target, errors="ignore")
-                log(f"cast columns {types}")
-            except Exception:
-                pass
+# Worker processes for large in-memory plans; 0 means one per CPU core
+PLAN_WORKERS = _get_int_setting("PLAN_WORKERS", 0) or os.cpu_count() or 1
+# Frames smaller than this run on one core; process start-up would dominate
+PARALLEL_MIN_ROWS = _get_int_setting("PARALLEL_MIN_ROWS", 1_000_000)
+# Merging steps worth parallelizing: their partial results are small
+_PARALLEL_MERGE_OPS = {"groupby_agg", "value_counts", "topk", "dedupe"}
+# In a worker process, the frame its pool partitions. It is handed over as the
+# pool initializer's argument, which fork inherits copy-on-write instead of
+# pickling, so only row bounds and partial results cross the process boundary.
+# Each pool carries its own frame, so concurrent sessions cannot see each other's.
+_PARALLEL_FRAME: Optional[pd.DataFrame] = None
 
-        elif op == "date_parse":
-            columns = step.get("columns") or []
-            for c in columns:
-                col = _resolve_column(working, str(c))
-                if col:
-                    try:
-                        working[col] = pd.to_datetime(working[col], errors="coerce")
-                    except Exception:
-                        pass
-            log(f"date_parse {columns}")
-
-        elif op == "date_trunc":
-            column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
-            freq = step.get("freq", "month")
-            if column and column in working.columns:
-                working[column] = _date_trunc(working[column], str(freq))
-                log(f"date_trunc {column} freq={freq}")
-
-        elif op == "window_rank":
-            by = _resolve_column(working, str(step.get("by"))) if step.get("by") else None
-            partition_by = step.get("partition_by")
-            if isinstance(partition_by, str):
-                partition_by = [partition_by]
-            partition_resolved = [c for c in (partition_by or []) if _resolve_column(working, str(c))]
-            partition_resolved = [ _resolve_column(working, str(c)) for c in partition_resolved ]
-            partition_resolved = [ c for c in partition_resolved if c ]
-            rank_col = str(step.get("rank_column") or "rank")
-            ascending = bool(step.get("ascending", False))
-            try:
-                if by and by in working.columns:
-                    if partition_resolved:
-                        working[rank_col] = working.sort_values(by=by, ascending=ascending).groupby(partition_resolved)[by].rank(method="dense", ascending=ascending)
-                    else:
-                        working[rank_col] = working[by].rank(method="dense", ascending=ascending)
-                    log(f"window_rank on {by} partition_by={partition_resolved}")
-            except Exception:
-                pass
 
-        elif op == "cumsum":
-            column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
-            new_col = str(step.get("new_column") or f"{column}_cumsum")
-            by = step.get("by")
-            if isinstance(by, str):
-                by = [by]
-            by_resolved = [ _resolve_column(working, str(c)) for c in (by or []) ]
-            by_resolved = [ c for c in by_resolved if c ]
-            try:
-                if column and by_resolved:
-                    working[new_col] = working.groupby(by_resolved)[column].cumsum()
-                elif column:
-                    working[new_col] = working[column].cumsum()
-                log(f"cumsum for {column} by={by_resolved}")
-            except Exception:
-                pass
+@st.cache_resource(show_spinner=False)
+def _parallel_gate() -> threading.Lock:
+    """Held while a plan runs partition-parallel.
 
-        elif op == "pct_change":
-            column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
-            new_col = str(step.get("new_column") or f"{column}_pct_change")
-            periods = int(step.get("periods", 1))
-            by = step.get("by")
-            if isinstance(by, str):
-                by = [by]
-            by_resolved = [ _resolve_column(working, str(c)) for c in (by or []) ]
-            by_resolved = [ c for c in by_resolved if c ]
-            try:
-                if column and by_resolved:
-                    working[new_col] = working.groupby(by_resolved)[column].pct_change(periods=periods)
-                elif column:
-                    working[new_col] = working[column].pct_change(periods=periods)
-                log(f"pct_change for {column} by={by_resolved} periods={periods}")
-            except Exception:
-                pass
+    One such plan at a time keeps the process at PLAN_WORKERS forked workers
+    however many sessions are active, each holding the frame copy-on-write.
+    """
+    return threading.Lock()
 
-        elif op == "value_counts":
-            column = _resolve_column(working, str(step.get("column"))) if step.get("column") else None
-            normalize = bool(step.get("normalize", False))
-            top = int(step.get("k", 20))
-            if column and column in working.columns:
-                vc = working[column].value_counts(normalize=normalize).head(top)
-                working = vc.reset_index().rename(columns={"index": str(column), column: "count"})
-                log(f"value_counts {column} normalize={normalize} top={top}")
 
-        elif op == "dedupe":
-            subset = step.get("subset")
-            keep = step.get("keep", "first")
-            try:
-                working = working.drop_duplicates(subset=subset, keep=keep)
-                log(f"dedupe subset={subset} keep={keep}")
-            except Exception:
-                pass
+def _set_parallel_frame(frame: pd.DataFrame) -> None:
+    global _PARALLEL_FRAME
+    _PARALLEL_FRAME = frame
 
-        elif op == "sample":
-            n = step.get("n")
-            frac = step.get("frac")
-            random_state = step.get("random_state")
-            try:
-                if n is not None:
-                    working = working.sample(n=int(n), random_state=random_state)
-                elif frac is not None:
-                    working = working.sample(frac=float(frac), random_state=random_state)
-                log(f"sample n={n} frac={frac}")
-            except Exception:
-                pass
 
-        else:
-            # Unknown op: skip
-            continue
+def _run_partition(
+    frame: pd.DataFrame, prefix: List[Dict[str, Any]], merge_step: Dict[str, Any], budget_bytes: int
+) -> Tuple[List[Any], int]:
+    # ``frame`` is a row slice of the shared frame; steps only replace whole
+    # columns, so a shallow copy detaches it without copying the data
+    chunk = _run_plan_steps(frame.copy(deep=False), prefix, lambda _msg: None)
+    merger = _ChunkMerger(merge_step, budget_bytes)
+    merger.add(chunk)
+    return merger.parts, len(chunk)
 
-    # Final compaction to avoid extremely wide outputs
-    if len(working.columns) > 50:
-        working = working.iloc[:, :50]
-        log("trim columns to first 50 for display")
 
-    return working, logs
+def _run_forked_partition(
+    bounds: Tuple[int, int], prefix: List[Dict[str, Any]], merge_step: Dict[str, Any], budget_bytes: int
+) -> Tuple[List[Any], int]:
+    start, stop = bounds
+    return _run_partition(_PARALLEL_FRAME.iloc[start:stop], prefix, merge_step, budget_bytes)  # type: ignore[union-attr]
 
 
-def _summarize_result(llm: ChatOpenAI, df: pd.DataFrame, query: str, logs: List[str]) -> str:
+def _parallel_split(steps: List[Dict[str, Any]]) -> Optional[int]:
+    """Position of the merging step when the plan can run partition-parallel."""
+    split, _ = _chunk_split(steps)
+    if split is None or split == len(steps) or steps[split]["op"] not in _PARALLEL_MERGE_OPS:
+        return None
+    return split
+
+
+def execute_plan_parallel(
+    df: pd.DataFrame, program: Dict[str, Any], workers: Optional[int] = None
+) -> Tuple[pd.DataFrame, List[str]]:
+    """Run a compiled plan over contiguous row partitions of ``df`` in parallel.
+
+    The row-wise steps and the partial form of the merging step (as in
+    ``execute_plan_chunked``) run in a forked process pool where fork is
+    available, with the frame shared copy-on-write; elsewhere in a thread
+    pool. Partials are merged in partition order, so the result does not depend
+    on which worker finishes first. Raises ValueError for plans that cannot be
+    split this way.
+
+    The server is multithreaded when it forks (event loop, thread pools), and a
+    child only keeps the forking thread, so any lock another thread held at
+    the fork stays held in the child. Workers therefore run nothing but pandas
+    steps over the inherited frame: no caches, locks, logging, event loop,
+    SQLite, FAISS or HTTP clients. That is what makes fork safe here, and it is
+    kept over forkserver or spawn because those would pickle the whole frame
+    into every worker, which costs more than the plan. The pool is shut down
+    when the plan finishes; callers bound concurrent pools with
+    ``_parallel_gate``.
+    """
+    steps = program["steps"]
+    split = _parallel_split(steps)
+    if split is None:
+        raise ValueError("plan has no partition-parallel merging step")
+    prefix, merge_step, suffix = steps[:split], steps[split], steps[split + 1 :]
+    workers = max(1, min(workers or PLAN_WORKERS, len(df)))
+    budget_bytes = PLAN_MEMORY_BUDGET_MB * 1024 * 1024
+    edges = np.linspace(0, len(df), workers + 1, dtype=np.int64)
+    bounds = [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:])]
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        mode = "processes"
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_set_parallel_frame,
+            initargs=(df,),
+        ) as pool:
+            futures = [pool.submit(_run_forked_partition, b, prefix, merge_step, budget_bytes) for b in bounds]
+            partials = [f.result() for f in futures]
+    else:
+        mode = "threads"
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_partition, df.iloc[a:b], prefix, merge_step, budget_bytes) for a, b in bounds]
+            partials = [f.result() for f in futures]
+
+    merger = _ChunkMerger(merge_step, budget_bytes)
+    for parts, _ in partials:
+        merger.absorb(parts)
+    result, merged = merger.result([])
+    kept = sum(rows for _, rows in partials)
+    logs = [
+        f"parallel: {workers} partitions on {workers} {mode}, {kept:,} rows kept"
+        + (f" by {', '.join(s['op'] for s in prefix)}" if prefix else ""),
+        merged.replace("merged from chunks", "merged from partitions"),
+    ]
+    result, suffix_logs = _execute_analysis_plan(result, {"steps": suffix}, typed=True, compiled=False)
+    return result, logs + suffix_logs
+
+
+def _summary_prompt(df: pd.DataFrame, query: str, logs: List[str]) -> str:
     # Create a compact CSV preview for the model
-    limited = df.head(30)
-    csv_preview = limited.to_csv(index=False)
-    prompt = (
+    csv_preview = df.head(30).to_csv(index=False)
+    return (
         "You are a precise data analyst. Write a concise 2-4 sentence answer\n"
         "to the user's question based on the provided result table.\n"
         "Focus on key numbers, rankings, and trends.\n"
@@ -779,18 +3995,47 @@ def _summarize_result(llm: ChatOpenAI, df: pd.DataFrame, query: str, logs: List[
         "Result CSV (first 30 rows):\n"
         f"{csv_preview[:6000]}\n"
     )
+
+
+def _summary_fallback(df: pd.DataFrame) -> str:
     try:
-        resp = llm.invoke(prompt)
+        return df.head(30).describe(include='all').to_string()[:1200]
+    except Exception:
+        return "Analysis complete. See the results table below."
+
+
+def _summarize_result(
+    llm: ChatOpenAI, df: pd.DataFrame, query: str, logs: List[str], on_token: Optional[Callable[[str], None]] = None
+) -> str:
+    """A short answer from the result table; ``on_token`` receives it as it is written."""
+    try:
+        prompt = _summary_prompt(df, query, logs)
+        if on_token is not None:
+            resp = cached_stream(llm, prompt, "summarizer", on_token)
+        else:
+            resp = cached_invoke(llm, prompt, "summarizer")
         content = getattr(resp, "content", "")
         return str(content).strip() or "Analysis complete. See the results table below."
     except Exception:
-        try:
-            return limited.describe(include='all').to_string()[:1200]
-        except Exception:
-            return "Analysis complete. See the results table below."
+        return _summary_fallback(df)
+
+
+async def _asummarize_result(
+    llm: ChatOpenAI, df: pd.DataFrame, query: str, logs: List[str], on_token: Optional[Callable[[str], None]] = None
+) -> str:
+    try:
+        prompt = _summary_prompt(df, query, logs)
+        if on_token is not None:
+            resp = await acached_stream(llm, prompt, "summarizer", on_token)
+        else:
+            resp = await acached_invoke(llm, prompt, "summarizer")
+        content = getattr(resp, "content", "")
+        return str(content).strip() or "Analysis complete. See the results table below."
+    except Exception:
+        return _summary_fallback(df)
 
 
-def _choose_chart_plan(llm: ChatOpenAI, df: pd.DataFrame, query: str) -> Dict[str, Any]:
+def _chart_plan_prompt(columns: List[str], query: str) -> str:
     schema = {
         "type": "object",
         "properties": {
@@ -800,28 +4045,29 @@ def _choose_chart_plan(llm: ChatOpenAI, df: pd.DataFrame, query: str) -> Dict[st
             "color": {"type": "string"},
             "title": {"type": "string"},
             "aggregation": {"type": "string", "enum": ["sum", "mean", "count", "median", "min", "max"]},
+            "freq": {"type": "string", "enum": ["day", "week", "month", "quarter", "year"]},
         },
         "required": ["type"],
         "additionalProperties": True,
     }
-    cols = ", ".join([str(c) for c in df.columns.tolist()])
-    prompt = (
+    cols = ", ".join([str(c) for c in columns])
+    return (
         "Decide an appropriate chart plan for the question using the given columns.\n"
         "Return a compact JSON object only, matching this JSON schema: \n"
         f"{json.dumps(schema)}\n"
         f"Columns: {cols}\n"
         f"Question: {query}\n"
     )
-    resp = llm.invoke(prompt)
-    content = getattr(resp, "content", "{}")
-    try:
-        # Try to extract JSON directly
-        start = content.find("{")
-        end = content.rfind("}")
-        plan = json.loads(content[start : end + 1]) if start != -1 and end != -1 else {}
-    except Exception:
-        plan = {"type": "bar"}
-    return plan
+
+
+def _choose_chart_plan(llm: ChatOpenAI, columns: List[str], query: str) -> Dict[str, Any]:
+    resp = cached_invoke(llm, _chart_plan_prompt(columns, query), "chart_planner")
+    return _parse_json_object(getattr(resp, "content", "{}"), {"type": "bar"})
+
+
+async def _achoose_chart_plan(llm: ChatOpenAI, columns: List[str], query: str) -> Dict[str, Any]:
+    resp = await acached_invoke(llm, _chart_plan_prompt(columns, query), "chart_planner")
+    return _parse_json_object(getattr(resp, "content", "{}"), {"type": "bar"})
 
 
 def _render_plotly_from_plan(df: pd.DataFrame, plan: Dict[str, Any]) -> go.Figure:
@@ -860,44 +4106,191 @@ def _render_plotly_from_plan(df: pd.DataFrame, plan: Dict[str, Any]) -> go.Figur
     return fig
 
 
+# Marks sent to the browser per chart; the reduced chart data is cut to this many rows
+CHART_MAX_POINTS = _get_int_setting("CHART_MAX_POINTS", 2000)
+# Bins of a histogram over a numeric column
+CHART_HISTOGRAM_BINS = 50
+_CHART_AGGREGATIONS = {"sum", "mean", "count", "median", "min", "max"}
+
+
+def chart_data_plan(preview: pd.DataFrame, chart: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Analysis steps that reduce the dataset to what ``chart`` draws, and the chart plan for their result.
+
+    Bar and line charts are grouped by x (and color) with the chart's
+    aggregation, sum by default, after truncating dates to ``freq`` (day by
+    default); without a numeric y the rows per x are counted. Scatter and box
+    charts draw rows, so they are sampled down to CHART_MAX_POINTS. A numeric
+    histogram reads its one column and is binned by ``_histogram_frame``.
+    """
+    chart_type = str(chart.get("type", "bar")).lower()
+    columns = [str(c) for c in preview.columns]
+    numeric = [str(c) for c in preview.select_dtypes(include=[np.number]).columns]
+    x, y, color = (_resolve_column(columns, str(chart[key])) if chart.get(key) else None for key in ("x", "y", "color"))
+    resolved = dict(chart, type=chart_type)
+
+    if chart_type == "histogram":
+        x = x or y or (numeric[0] if numeric else (columns[0] if columns else None))
+        if x is None:
+            return {"steps": [{"op": "limit", "n": CHART_MAX_POINTS}]}, resolved
+        if x in numeric:
+            return {"steps": [{"op": "select", "columns": [x]}]}, dict(resolved, x=x, y=None, color=None)
+        counts = {"op": "value_counts", "column": x, "k": CHART_MAX_POINTS}
+        return {"steps": [counts]}, dict(resolved, type="bar", x=x, y="count", color=None)
+
+    if chart_type in ("scatter", "box"):
+        if chart_type == "scatter":
+            x = x or next((c for c in numeric if c != y), None)
+        y = y or next((c for c in numeric if c != x), None)
+        picked = list(dict.fromkeys(c for c in (x, y, color) if c)) or columns[:2]
+        # One mark per row: a fixed random sample keeps the figure bounded
+        steps = [{"op": "select", "columns": picked}, {"op": "sample", "n": CHART_MAX_POINTS, "random_state": 0}]
+        return {"steps": steps}, dict(resolved, x=x, y=y, color=color)
+
+    y = y or next((c for c in numeric if c != x), None)
+    x = x or next((c for c in columns if c != y), None)
+    if x is None:
+        return {"steps": [{"op": "limit", "n": CHART_MAX_POINTS}]}, resolved
+    steps: List[Dict[str, Any]] = []
+    temporal = pd.api.types.is_datetime64_any_dtype(preview[x])
+    if temporal:
+        steps.append({"op": "date_trunc", "column": x, "freq": str(chart.get("freq") or "day")})
+    by = [x] + ([color] if color and color != x else [])
+    if y in numeric and y not in by:
+        agg = str(chart.get("aggregation") or "sum").lower()
+        agg = agg if agg in _CHART_AGGREGATIONS else "sum"
+        steps.append({"op": "groupby_agg", "by": by, "aggregations": [{"column": y, "agg": agg}]})
+        value = f"{y}_{agg}"
+    else:
+        steps.append({"op": "value_counts", "column": x, "k": CHART_MAX_POINTS})
+        value, color = "count", None
+    # Ordered axes keep their order; categories are ranked by value, so the cut keeps the largest
+    ordered = temporal or x in numeric or chart_type == "line"
+    steps.append({"op": "sort", "by": [x] if ordered else [value], "ascending": ordered})
+    steps.append({"op": "limit", "n": CHART_MAX_POINTS})
+    return {"steps": steps}, dict(resolved, x=x, y=value, color=color)
+
+
+def _histogram_frame(values: pd.Series) -> pd.DataFrame:
+    """Bin centers and counts of a numeric column: one bar per bin instead of one value per row."""
+    data = pd.to_numeric(values, errors="coerce").dropna().to_numpy(dtype=float)
+    counts, edges = np.histogram(data, bins=CHART_HISTOGRAM_BINS)
+    return pd.DataFrame({str(values.name): (edges[:-1] + edges[1:]) / 2, "count": counts})
+
+
+def _chart_spec(data_path: Path, plan: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Figure JSON for a chart plan, drawn from the dataset as reduced by the plan executor, and the steps' logs."""
+    data_plan, chart = chart_data_plan(dataset_preview(data_path), plan)
+    result_df, logs = execute_plan_lazily(data_path, data_plan)
+    x = chart.get("x")
+    if chart.get("type") == "histogram" and x in result_df.columns and pd.api.types.is_numeric_dtype(result_df[x]):
+        result_df = _histogram_frame(result_df[x])
+        chart = dict(chart, type="bar", y="count")
+        logs = logs + [f"histogram {x}: {CHART_HISTOGRAM_BINS} bins"]
+    return _result_chart_spec(result_df, chart), logs
+
+
+def _result_chart_spec(result_df: pd.DataFrame, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Chart an analysis result. The chart plan names dataset columns, so each is
+    resolved against the result (``sales`` may now be ``sales_sum``); names that do
+    not resolve are left to the renderer's defaults."""
+    columns = [str(c) for c in result_df.columns]
+    resolved = dict(plan)
+    for key in ("x", "y", "color"):
+        name = plan.get(key)
+        if name:
+            resolved[key] = _resolve_column(columns, str(name)) or next(
+                (c for c in columns if c.startswith(f"{name}_")), None
+            )
+    return _render_plotly_from_plan(result_df.head(CHART_MAX_POINTS), resolved).to_dict()
+
+
+def _with_analysis(state: AppState) -> bool:
+    """True when an analysis branch runs alongside this visualization."""
+    return str(state.get("intent", "")).endswith("analyze_and_visualize")
+
+
 def visualization_agent(state: AppState) -> AppState:
     data_path = Path(state["data_path"])  # type: ignore[index]
     query = state.get("query", "")
 
-    df = pd.read_csv(data_path)
     llm = get_llm()
-    plan = _choose_chart_plan(llm, df, query)
-    fig = _render_plotly_from_plan(df, plan)
+    columns = dataset_columns(data_path)
+    plan = _choose_chart_plan(llm, columns, query)
+    planned = None
+    if _with_analysis(state):
+        try:
+            planned = shared_run_result(state, "plan_result", lambda: _plan_result(state, llm, data_path, query))
+        except Exception:
+            # The analysis branch falls back to the pandas agent; chart the dataset
+            planned = None
+    if planned is not None:
+        state["chart_spec"] = _result_chart_spec(planned[1], plan)
+    else:
+        state["chart_spec"], state["chart_logs"] = _chart_spec(data_path, plan)
+    emit(state, "chart", state["chart_spec"])
+    return _branch_update(state, VISUALIZATION_OUTPUTS)
 
-    state["chart_spec"] = fig.to_dict()
-    # Provide a concise caption
-    state["analysis_answer"] = state.get("analysis_answer") or "Suggested visualization shown below."
-    return state
+
+async def avisualization_agent(state: AppState) -> AppState:
+    """``visualization_agent`` awaiting the chart plan; reading and rendering run on a worker thread."""
+    data_path = Path(state["data_path"])  # type: ignore[index]
+    query = state.get("query", "")
+
+    llm = get_llm()
+    columns = await asyncio.to_thread(dataset_columns, data_path)
+    planned = None
+    if _with_analysis(state):
+        # The chart plan is written while the shared plan result is computed
+        shared = asyncio.ensure_future(
+            ashared_run_result(state, "plan_result", lambda: _aplan_result(state, llm, data_path, query))
+        )
+        plan = await _achoose_chart_plan(llm, columns, query)
+        try:
+            planned = await shared
+        except Exception:
+            planned = None
+    else:
+        plan = await _achoose_chart_plan(llm, columns, query)
+    if planned is not None:
+        state["chart_spec"] = await asyncio.to_thread(_result_chart_spec, planned[1], plan)
+    else:
+        state["chart_spec"], state["chart_logs"] = await asyncio.to_thread(_chart_spec, data_path, plan)
+    emit(state, "chart", state["chart_spec"])
+    return _branch_update(state, VISUALIZATION_OUTPUTS)
 
 
 def finalize_node(state: AppState) -> AppState:
-    # Prefer analysis answer; otherwise generic message
-    answer = state.get("analysis_answer") or "Task completed."
+    # Fan-in of the branches: prefer the analysis answer, then a caption for a lone chart
+    answer = state.get("analysis_answer") or (
+        "Suggested visualization shown below." if state.get("chart_spec") else "Task completed."
+    )
     state["final_answer"] = str(answer)
+    state["speculation"] = finish_speculation(state.get("run_id"))
+    release_run_results(state.get("run_id"))
     return state
 
 
 # Graph wiring
 
-def _route_from_router(state: AppState) -> str:
+def _route_from_router(state: AppState) -> Union[str, List[str]]:
     intent = state.get("intent", "analyze")
-    mapping = {
+    mapping: Dict[str, Union[str, List[str]]] = {
         "ingest": "ingestion",
         "analyze": "analysis",
         "visualize": "visualization",
+        # Parallel branches of one step, joined at finalize
+        "analyze_and_visualize": ["analysis", "visualization"],
         "ingest_then_analyze": "ingestion",
         "ingest_then_visualize": "ingestion",
+        "ingest_then_analyze_and_visualize": "ingestion",
     }
     return mapping.get(intent, "analysis")
 
 
-def _route_after_ingest(state: AppState) -> str:
+def _route_after_ingest(state: AppState) -> Union[str, List[str]]:
     intent = state.get("intent", "analyze")
+    if intent == "ingest_then_analyze_and_visualize":
+        return ["analysis", "visualization"]
     if intent == "ingest_then_visualize":
         return "visualization"
     if intent in ("ingest_then_analyze",):
@@ -906,12 +4299,13 @@ def _route_after_ingest(state: AppState) -> str:
     return "finalize"
 
 
-def build_graph() -> Any:
+def build_graph(asynchronous: bool = False) -> Any:
+    """Compile the agent graph; ``asynchronous`` wires the async nodes, run with ``ainvoke``."""
     graph = StateGraph(AppState)
-    graph.add_node("router", router_node)
-    graph.add_node("ingestion", ingestion_agent)
-    graph.add_node("analysis", analysis_agent)
-    graph.add_node("visualization", visualization_agent)
+    graph.add_node("router", arouter_node if asynchronous else router_node)
+    graph.add_node("ingestion", aingestion_agent if asynchronous else ingestion_agent)
+    graph.add_node("analysis", aanalysis_agent if asynchronous else analysis_agent)
+    graph.add_node("visualization", avisualization_agent if asynchronous else visualization_agent)
     graph.add_node("finalize", finalize_node)
 
     graph.set_entry_point("router")
@@ -936,16 +4330,111 @@ def build_graph() -> Any:
 
 
 # -------------------------
-# UI
+# Warm start
 # -------------------------
 
-st.set_page_config(page_title=APP_NAME, layout="wide")
+# Most recently modified datasets (and their indexes) loaded at process start; 0 disables
+WARM_START_PRELOAD = _get_int_setting("WARM_START_PRELOAD", 2)
 
-# Inject custom JavaScript to suppress known Streamlit console warnings
-# These warnings are from Streamlit's internal implementation and don't affect functionality
-import streamlit.components.v1 as components
 
-components.html("""
+@st.cache_resource(show_spinner=False)
+def startup_metrics() -> Dict[str, Any]:
+    """Process-wide warm-start timings, filled in by ``warm_start`` and the ``record_*_latency`` helpers."""
+    return {"process_start": time.time(), "preloaded": [], "warm_queries": 0}
+
+
+# Run graph nodes as coroutines on one shared event loop; 0 runs them on a worker thread
+ASYNC_GRAPH = _get_int_setting("ASYNC_GRAPH", 1)
+
+
+@st.cache_resource(show_spinner=False)
+def get_compiled_graph() -> Any:
+    started = time.perf_counter()
+    app = build_graph(asynchronous=bool(ASYNC_GRAPH))
+    startup_metrics()["graph_build_s"] = time.perf_counter() - started
+    return app
+
+
+def _recent_datasets(limit: int) -> List[Tuple[Path, Path]]:
+    """(data_path, vector_dir) of the most recently written datasets under DATA_DIR."""
+    if limit <= 0 or not DATA_DIR.exists():
+        return []
+    found = [p for p in DATA_DIR.glob("*/*") if p.suffix in (".parquet", ".csv")]
+    found.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    return [(p, STORE_DIR / p.parent.name / p.stem) for p in found[:limit]]
+
+
+def _preload(datasets: List[Tuple[Path, Path]], with_indexes: bool) -> None:
+    metrics = startup_metrics()
+    started = time.perf_counter()
+    for data_path, vector_dir in datasets:
+        try:
+            load_dataset(data_path)
+            if with_indexes:
+                load_vector_store(vector_dir)
+            metrics["preloaded"].append(str(data_path))
+        except Exception as exc:
+            logger.warning("warm start: could not preload %s: %s", data_path, exc)
+    metrics["preload_s"] = time.perf_counter() - started
+
+
+@st.cache_resource(show_spinner=False)
+def warm_start() -> Dict[str, Any]:
+    """Build the graph and API clients once per process and preload recent datasets.
+
+    Preloading runs on a background thread so the first page render is not
+    delayed; a query that races it waits on the same cache entry instead of
+    reading the file twice.
+    """
+    metrics = startup_metrics()
+    get_compiled_graph()
+    have_key = True
+    started = time.perf_counter()
+    try:
+        get_llm()
+        get_embeddings()
+    except RuntimeError:
+        have_key = False
+    metrics["clients_s"] = time.perf_counter() - started
+    datasets = _recent_datasets(WARM_START_PRELOAD)
+    if datasets:
+        threading.Thread(target=_preload, args=(datasets, have_key), name="warm-start-preload", daemon=True).start()
+    return metrics
+
+
+def record_query_latency(seconds: float) -> None:
+    """Track the process's first (cold) query separately from later (warm) ones."""
+    metrics = startup_metrics()
+    if "first_query_s" not in metrics:
+        metrics["first_query_s"] = seconds
+        return
+    count = int(metrics["warm_queries"]) + 1
+    previous = float(metrics.get("warm_query_avg_s", 0.0))
+    metrics["warm_queries"] = count
+    metrics["warm_query_avg_s"] = previous + (seconds - previous) / count
+    metrics["warm_query_last_s"] = seconds
+
+
+def record_stream_latency(timings: Dict[str, float]) -> None:
+    """Running averages of a run's time to its first rendered output and first answer token."""
+    metrics = startup_metrics()
+    for key in ("first_output", "first_token"):
+        if key not in timings:
+            continue
+        count = int(metrics.get(f"{key}_runs", 0)) + 1
+        previous = float(metrics.get(f"{key}_avg_s", 0.0))
+        metrics[f"{key}_runs"] = count
+        metrics[f"{key}_avg_s"] = previous + (timings[key] - previous) / count
+        metrics[f"{key}_last_s"] = timings[key]
+
+
+# -------------------------
+# UI
+# -------------------------
+
+# Injected into the page to suppress known Streamlit console warnings.
+# These warnings are from Streamlit's internal implementation and don't affect functionality
+_CONSOLE_WARNING_FILTER_JS = """
 <script>
 // Suppress specific console warnings that come from Streamlit's internal JavaScript
 (function() {
@@ -979,152 +4468,330 @@ components.html("""
     };
 })();
 </script>
-""", height=0)
+"""
 
-st.title(APP_NAME)
 
-# Check for API key but don't stop the app - show warning instead
-_api_key_available = False
-try:
-    ensure_openai_key()
-    _api_key_available = True
-except RuntimeError as e:
-    st.warning("⚠️ OpenAI API key not configured")
-    st.info(
-        "To use this app, please configure your OPENAI_API_KEY:\n"
-        "- **On Streamlit Cloud**: Add it in the app settings under 'Secrets'\n"
-        "- **Locally**: Create `.streamlit/secrets.toml` with `OPENAI_API_KEY = \"sk-...\"`\n"
-        "- **Or**: Set the environment variable `OPENAI_API_KEY`"
-    )
-
-with st.sidebar:
-    st.header("Settings")
-    user_id = st.text_input("User ID", value=st.session_state.get("user_id", "user"))
-    dataset_id = st.text_input("Dataset ID", value=st.session_state.get("dataset_id", "dataset"))
-    prefer_visual = st.checkbox("Prefer visualization", value=False, help="Hints the router towards charts.")
-    top_k = st.slider("Retriever top_k", min_value=3, max_value=15, value=5, step=1)
+def _render_chart(area: Any, chart_spec: Dict[str, Any]) -> None:
+    with area.container():
+        try:
+            fig = go.Figure(chart_spec)
+            st.plotly_chart(fig, use_container_width=True)
+        except Exception:
+            st.caption("Chart JSON (failed to render):")
+            st.code(json.dumps(chart_spec, indent=2))
 
-    clear_btn = st.button("Clear vector store", type="primary")
 
-# Manage paths
-paths = ensure_dirs_for(user_id, dataset_id)
-data_path: Path = paths["data_path"]  # type: ignore[assignment]
-vector_dir: Path = paths["vector_dir"]  # type: ignore[assignment]
+def _render_table(area: Any, analysis_table: Dict[str, Any]) -> None:
+    with area.container():
+        try:
+            table_df = pd.DataFrame(analysis_table.get("rows", []))
+            cols = analysis_table.get("columns")
+            if isinstance(cols, list) and cols:
+                ordered = [c for c in cols if c in table_df.columns]
+                if ordered:
+                    table_df = table_df.loc[:, ordered]
+            st.markdown("**Results table**")
+            st.dataframe(table_df, use_container_width=True)
+        except Exception:
+            st.caption("Results table (raw):")
+            st.code(json.dumps(analysis_table)[:8000])
 
-if clear_btn:
-    # Remove FAISS files if present
-    for p in [vector_dir / "index.faiss", vector_dir / "index.pkl"]:
-        if p.exists():
-            try:
-                p.unlink()
-            except Exception:
-                pass
-    st.success("Vector store cleared.")
 
-st.markdown("Upload a file and/or ask a question. The router will decide what to do.")
+def main() -> None:
+    st.set_page_config(page_title=APP_NAME, layout="wide")
 
-col_left, col_right = st.columns([2, 3])
+    # Inject custom JavaScript to suppress known Streamlit console warnings
+    components.html(_CONSOLE_WARNING_FILTER_JS, height=0)
 
-with col_left:
-    uploaded = st.file_uploader("Upload CSV / Excel / JSON", type=["csv", "xlsx", "xls", "json"])
-    has_new_upload = False
-    if uploaded is not None:
-        try:
-            raw = uploaded.getvalue()
-            name = (uploaded.name or "").lower()
-            if name.endswith(".csv"):
-                df = pd.read_csv(BytesIO(raw))
-            elif name.endswith((".xlsx", ".xls")):
-                df = pd.read_excel(BytesIO(raw))
-            elif name.endswith(".json"):
-                try:
-                    df = pd.read_json(BytesIO(raw))
-                except ValueError:
-                    df = pd.read_json(BytesIO(raw), lines=True)
-            else:
-                df = pd.read_csv(BytesIO(raw))
-            df.to_csv(data_path, index=False)
-            has_new_upload = True
-            st.success(f"File saved to {data_path}")
-            st.caption(f"Rows: {len(df):,} | Columns: {len(df.columns)}")
-            st.dataframe(df.head(20), use_container_width=True)
-        except Exception as exc:
-            st.error(f"Failed to read file: {exc}")
+    st.title(APP_NAME)
 
-with col_right:
-    default_q = "What are the top 5 products by revenue?"
-    query = st.text_area("Your query", value=default_q, height=120)
-    run = st.button("Run", type="primary")
+    warm_start()
 
-if run:
+    # Check for API key but don't stop the app - show warning instead
+    _api_key_available = False
     try:
-        # Pre-flight checks
-        if not _api_key_available:
-            st.error("Cannot run analysis: OpenAI API key not configured. Please add your API key to continue.")
-            st.stop()
-        if not data_path.exists():
-            st.warning("No dataset found. Please upload a file first.")
-            st.stop()
-        # Build and run graph
-        app = build_graph()
-        initial_state: AppState = {
-            "user_id": user_id,
-            "dataset_id": dataset_id,
-            "query": query,
-            "prefer_visual": prefer_visual,
-            "has_new_upload": bool(has_new_upload),
-            "top_k": int(top_k),
-            "data_path": str(data_path),
-            "vector_dir": str(vector_dir),
-        }
+        ensure_openai_key()
+        _api_key_available = True
+    except RuntimeError as e:
+        st.warning("⚠️ OpenAI API key not configured")
+        st.info(
+            "To use this app, please configure your OPENAI_API_KEY:\n"
+            "- **On Streamlit Cloud**: Add it in the app settings under 'Secrets'\n"
+            "- **Locally**: Create `.streamlit/secrets.toml` with `OPENAI_API_KEY = \"sk-...\"`\n"
+            "- **Or**: Set the environment variable `OPENAI_API_KEY`"
+        )
+
+    with st.sidebar:
+        st.header("Settings")
+        user_id = st.text_input("User ID", value=st.session_state.get("user_id", "user"))
+        dataset_id = st.text_input("Dataset ID", value=st.session_state.get("dataset_id", "dataset"))
+        prefer_visual = st.checkbox("Prefer visualization", value=False, help="Hints the router towards charts.")
+        top_k = st.slider("Retriever top_k", min_value=3, max_value=15, value=5, step=1)
+
+        clear_btn = st.button("Clear vector store", type="primary")
+
+        _cache_stats = dataset_cache_stats()
+        st.caption(
+            f"Dataset cache: {_cache_stats['hits']} hits / {_cache_stats['misses']} misses | "
+            f"{_cache_stats['entries']} frames, {_cache_stats['size'] / 1e6:,.1f} MB"
+        )
+        _plan_stats = semantic_plan_cache_stats()
+        if _plan_stats["hits"] or _plan_stats["misses"]:
+            st.caption(
+                f"Semantic plan cache: {_plan_stats['hits']} hits / {_plan_stats['misses']} misses"
+                f" ({_plan_stats['rejected']} stale plans, {_plan_stats['mismatched']} different literals rejected)"
+            )
+        _spec_stats = speculation_stats()
+        if _spec_stats:
+            st.caption(
+                "Speculation: "
+                + ", ".join(f"{name} {b['used']}/{b['launched']} used" for name, b in sorted(_spec_stats.items()))
+                + f" | {sum(b['wasted_tokens'] for b in _spec_stats.values()):,} tokens wasted"
+            )
+        _llm_stats = llm_cache_stats()
+        if _llm_stats:
+            st.caption(
+                "LLM cache: "
+                + ", ".join(f"{site} {c['hits']:.0f}/{c['hits'] + c['misses']:.0f}" for site, c in sorted(_llm_stats.items()))
+                + f" hits | {sum(c['seconds_saved'] for c in _llm_stats.values()):.1f}s saved"
+            )
+        with st.expander("Startup metrics", expanded=False):
+            _metrics = startup_metrics()
+            _lines = [
+                f"graph build: {_metrics.get('graph_build_s', 0.0):.3f}s",
+                f"API clients: {_metrics.get('clients_s', 0.0):.3f}s",
+                f"preload: {_metrics['preload_s']:.2f}s ({len(_metrics['preloaded'])} datasets)"
+                if "preload_s" in _metrics else "preload: pending or disabled",
+            ]
+            if "first_query_s" in _metrics:
+                _lines.append(f"first (cold) query: {_metrics['first_query_s']:.2f}s")
+            if _metrics.get("warm_queries"):
+                _lines.append(
+                    f"warm queries: {_metrics['warm_queries']} | avg {_metrics['warm_query_avg_s']:.2f}s | "
+                    f"last {_metrics['warm_query_last_s']:.2f}s"
+                )
+            if _metrics.get("first_output_runs"):
+                _lines.append(
+                    f"first output: avg {_metrics['first_output_avg_s']:.2f}s | last {_metrics['first_output_last_s']:.2f}s"
+                )
+            if _metrics.get("first_token_runs"):
+                _lines.append(
+                    f"first answer token: avg {_metrics['first_token_avg_s']:.2f}s | "
+                    f"last {_metrics['first_token_last_s']:.2f}s"
+                )
+            st.code("\n".join(_lines))
+
+    # Manage paths
+    paths = ensure_dirs_for(user_id, dataset_id)
+    data_path: Path = paths["data_path"]  # type: ignore[assignment]
+    vector_dir: Path = paths["vector_dir"]  # type: ignore[assignment]
 
-        # Execute graph
-        result: AppState = app.invoke(initial_state)  # type: ignore[assignment]
+    if clear_btn:
+        # Remove FAISS files if present
+        for p in [vector_dir / "index.faiss", vector_dir / "index.pkl", vector_dir / INDEX_PARAMS_FILE, vector_dir / INGESTED_MARKER]:
+            if p.exists():
+                try:
+                    p.unlink()
+                except Exception:
+                    pass
+        invalidate_vector_store(vector_dir)
+        st.success("Vector store cleared.")
+
+    st.markdown("Upload a file and/or ask a question. The router will decide what to do.")
 
-        # Present results
-        answer = result.get("final_answer") or ""
-        st.markdown("**Answer**")
-        st.write(answer)
+    col_left, col_right = st.columns([2, 3])
 
-        # Show chart if present
-        chart_spec = result.get("chart_spec")
-        if isinstance(chart_spec, dict) and chart_spec:
+    with col_left:
+        uploaded = st.file_uploader("Upload CSV / Excel / JSON", type=["csv", "xlsx", "xls", "json"])
+        has_new_upload = False
+        if uploaded is not None:
             try:
-                fig = go.Figure(chart_spec)
-                st.plotly_chart(fig, use_container_width=True)
+                # The uploader keeps its file across reruns; hash each upload once per session
+                fingerprints = st.session_state.setdefault("upload_fingerprints", {})
+                file_key = getattr(uploaded, "file_id", None) or f"{uploaded.name}:{uploaded.size}"
+                fingerprint = fingerprints.get(file_key)
+                if fingerprint is None:
+                    fingerprint = upload_fingerprint(uploaded.getbuffer())
+                    fingerprints[file_key] = fingerprint
+                stored_fingerprint = read_dataset_meta(data_path).get("fingerprint")
             except Exception:
-                st.caption("Chart JSON (failed to render):")
-                st.code(json.dumps(chart_spec, indent=2))
+                fingerprint, stored_fingerprint = None, None
+            try:
+                if fingerprint and fingerprint == stored_fingerprint and data_path.exists():
+                    # Unchanged content: reuse the stored dataset without parsing or rewriting
+                    df = load_dataset(data_path)
+                    st.caption(f"Unchanged upload, using stored dataset {data_path}")
+                    has_new_upload = read_indexed_fingerprint(vector_dir) != fingerprint
+                else:
+                    raw = uploaded.getvalue()
+                    name = (uploaded.name or "").lower()
+                    if name.endswith(".csv"):
+                        df = pd.read_csv(BytesIO(raw))
+                    elif name.endswith((".xlsx", ".xls")):
+                        df = pd.read_excel(BytesIO(raw))
+                    elif name.endswith(".json"):
+                        try:
+                            df = pd.read_json(BytesIO(raw))
+                        except ValueError:
+                            df = pd.read_json(BytesIO(raw), lines=True)
+                    else:
+                        df = pd.read_csv(BytesIO(raw))
+                    df, compaction = compact_dataframe(df)
+                    data_path = save_dataset(df, data_path)
+                    write_dataset_meta(
+                        data_path,
+                        {
+                            "fingerprint": fingerprint,
+                            "source_name": uploaded.name,
+                            "rows": int(len(df)),
+                            "columns": int(len(df.columns)),
+                            "compaction": compaction,
+                        },
+                    )
+                    has_new_upload = True
+                    st.success(f"File saved to {data_path}")
+                caption = f"Rows: {len(df):,} | Columns: {len(df.columns)}"
+                compaction = read_dataset_meta(data_path).get("compaction") or {}
+                if compaction.get("memory_before"):
+                    caption += (
+                        f" | Memory: {compaction['memory_before'] / 1e6:,.1f} MB"
+                        f" → {compaction['memory_after'] / 1e6:,.1f} MB"
+                    )
+                st.caption(caption)
+                st.dataframe(df.head(20), use_container_width=True)
+                with st.expander("Schema report", expanded=False):
+                    st.dataframe(schema_report_frame(dataset_coercion_schema(data_path, df)), use_container_width=True)
+            except Exception as exc:
+                st.error(f"Failed to read file: {exc}")
+
+    with col_right:
+        default_q = "What are the top 5 products by revenue?"
+        query = st.text_area("Your query", value=default_q, height=120)
+        run = st.button("Run", type="primary")
+
+    if run:
+        try:
+            # Pre-flight checks
+            if not _api_key_available:
+                st.error("Cannot run analysis: OpenAI API key not configured. Please add your API key to continue.")
+                st.stop()
+            if not data_path.exists():
+                st.warning("No dataset found. Please upload a file first.")
+                st.stop()
+            # Compiled once per process by warm_start()
+            app = get_compiled_graph()
+            run_id = uuid.uuid4().hex
+            initial_state: AppState = {
+                "user_id": user_id,
+                "dataset_id": dataset_id,
+                "run_id": run_id,
+                "query": query,
+                "prefer_visual": prefer_visual,
+                "has_new_upload": bool(has_new_upload),
+                "top_k": int(top_k),
+                "data_path": str(data_path),
+                "vector_dir": str(vector_dir),
+            }
+
+            # Execute graph off the script thread, which renders output as the nodes emit it
+            run_started = time.perf_counter()
+            stream = open_output_stream(run_id)
+            st.markdown("**Answer**")
+            answer_area = st.empty()
+            details_area = st.container()
+            chart_area = st.empty()
+            table_area = st.empty()
+            timings: Dict[str, float] = {}
+            rendered: set = set()
+
+            def show(kind: str, payload: Any) -> None:
+                if kind == "chart" and isinstance(payload, dict) and payload:
+                    _render_chart(chart_area, payload)
+                elif kind == "table" and isinstance(payload, dict) and payload.get("rows"):
+                    _render_table(table_area, payload)
+                else:
+                    return
+                rendered.add(kind)
 
-        # Show tabular results if present
-        analysis_table = result.get("analysis_table")
-        if isinstance(analysis_table, dict) and analysis_table.get("rows"):
             try:
-                table_df = pd.DataFrame(analysis_table.get("rows", []))
-                cols = analysis_table.get("columns")
-                if isinstance(cols, list) and cols:
-                    ordered = [c for c in cols if c in table_df.columns]
-                    if ordered:
-                        table_df = table_df.loc[:, ordered]
-                st.markdown("**Results table**")
-                st.dataframe(table_df, use_container_width=True)
-            except Exception:
-                st.caption("Results table (raw):")
-                st.code(json.dumps(analysis_table)[:8000])
+                if ASYNC_GRAPH:
+                    # LLM calls are awaited on the shared loop
+                    future: Any = asyncio.run_coroutine_threadsafe(app.ainvoke(initial_state), _event_loop())
+                else:
+                    future = _run_pool().submit(app.invoke, initial_state)
+                with answer_area.container():
+                    streamed = st.write_stream(stream_run_output(stream, future.done, show, timings, run_started))
+                result: AppState = future.result()  # type: ignore[assignment]
+            finally:
+                close_output_stream(run_id)
+                # No-ops after finalize; release the branches of a failed run
+                finish_speculation(run_id)
+                release_run_results(run_id)
+            timings["complete"] = time.perf_counter() - run_started
+            record_query_latency(timings["complete"])
+            record_stream_latency(timings)
+
+            # Present results
+            answer = result.get("final_answer") or ""
+            if not isinstance(streamed, str) or streamed.strip() != answer.strip():
+                # Nothing was streamed (e.g. a chart-only run) or the node replaced it
+                answer_area.write(answer)
+            with details_area:
+                st.caption(
+                    " | ".join(
+                        f"{label} {timings[key]:.2f}s"
+                        for key, label in (("first_output", "first output"), ("first_token", "first token"), ("complete", "complete"))
+                        if key in timings
+                    )
+                )
+                if result.get("route_source"):
+                    st.caption(
+                        f"Route: {result.get('intent')} via {result.get('route_source')} "
+                        f"(confidence {float(result.get('route_confidence') or 0):.2f})"
+                    )
+                speculation = result.get("speculation")
+                if isinstance(speculation, dict) and speculation:
+                    wasted = [f"{name} ({branch['tokens'] or 0:,} tokens)" for name, branch in speculation.items() if not branch["used"]]
+                    st.caption(
+                        "Speculative branches: "
+                        + ", ".join(f"{name} {'used' if branch['used'] else 'discarded'}" for name, branch in speculation.items())
+                        + (f" | wasted: {', '.join(wasted)}" if wasted else "")
+                    )
+
+            # Chart and table, unless already shown while the run was in progress
+            if "chart" not in rendered:
+                show("chart", result.get("chart_spec"))
+            if "table" not in rendered:
+                show("table", result.get("analysis_table"))
+
+            ingestion_stats = result.get("ingestion_stats")
+            if isinstance(ingestion_stats, dict) and ingestion_stats.get("documents"):
+                st.caption(
+                    f"Indexed {ingestion_stats['documents']:,} chunks | "
+                    f"embedding cache hit ratio {ingestion_stats['hit_ratio']:.0%} "
+                    f"({ingestion_stats['embedded']:,} embedded, "
+                    f"{ingestion_stats['bytes_saved'] / 1e6:,.1f} MB not re-sent)"
+                )
 
-        # Optional: show retrieved snippets
-        retrieved_text = result.get("retrieved_text")
-        if retrieved_text:
-            with st.expander("Retrieved context", expanded=False):
-                st.code(retrieved_text[:8000])
+            # Optional: show retrieved snippets
+            retrieved_text = result.get("retrieved_text")
+            if retrieved_text:
+                with st.expander("Retrieved context", expanded=False):
+                    st.code(retrieved_text[:8000])
+
+            # Show analysis logs if present
+            analysis_logs = result.get("analysis_logs")
+            if isinstance(analysis_logs, list) and analysis_logs:
+                with st.expander("Analysis steps", expanded=False):
+                    st.code("\n".join(str(x) for x in analysis_logs))
+            chart_logs = result.get("chart_logs")
+            if isinstance(chart_logs, list) and chart_logs:
+                with st.expander("Chart data steps", expanded=False):
+                    st.code("\n".join(str(x) for x in chart_logs))
 
-        # Show analysis logs if present
-        analysis_logs = result.get("analysis_logs")
-        if isinstance(analysis_logs, list) and analysis_logs:
-            with st.expander("Analysis steps", expanded=False):
-                st.code("\n".join(str(x) for x in analysis_logs))
+        except Exception as exc:
+            st.error(f"Run failed: {exc}")
 
-    except Exception as exc:
-        st.error(f"Run failed: {exc}")
 
-# Footer note removed per request
+if __name__ == "__main__":
+    main()